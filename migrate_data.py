@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+__author__ = 'Gareth Coles'
+
+"""
+Data migration tool for Ultros. Imports a YAML or JSON data file into an
+SQLite data file, so that plugins can use the SQLite data format with their
+existing data.
+
+For example, to import the auth plugin's passwords file..
+
+    python migrate_data.py plugins/auth/passwords.yml
+
+That will create data/plugins/auth/passwords.sqlite - you'll then need to
+point the plugin at the new file, using the SQLite format. Paths are
+relative to the data directory, and the original file is left alone.
+"""
+
+import argparse
+import os
+import sys
+
+if os.path.dirname(sys.argv[0]):
+    os.chdir(os.path.dirname(sys.argv[0]))
+
+from system.translations import Translations
+
+DESC = "Import a YAML or JSON data file into an SQLite data file"
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description=DESC)
+    p.add_argument("-l", "--language", help="Specify which language to use")
+    p.add_argument("-d", "--data-dir", default="data",
+                   help="Specify the data directory (default: data)")
+    p.add_argument("-f", "--force", action="store_true",
+                   help="Import into the destination even if it exists")
+    p.add_argument("source", help="The YAML or JSON file to import")
+    p.add_argument("destination", nargs="?", default=None,
+                   help="The SQLite file to create (default: the source "
+                        "path, with a .sqlite extension)")
+
+    args = p.parse_args()
+    trans = Translations(args.language, log=False)
+else:
+    trans = Translations(log=False)
+
+_ = trans.get()
+
+from system.storage.data import JSONData, SQLiteData, YamlData
+
+handlers = {
+    ".yml": YamlData,
+    ".yaml": YamlData,
+    ".json": JSONData
+}
+
+
+def migrate(source, destination, force=False):
+    """
+    Import a YAML or JSON data file into an SQLite data file.
+
+    :param source: The path to the file to import
+    :param destination: The path to the SQLite file
+    :param force: Whether to import into the destination if it exists
+
+    :return: How many keys were imported
+    :rtype: int
+    """
+
+    extension = os.path.splitext(source)[1].lower()
+
+    if extension not in handlers:
+        raise ValueError(_("Unknown data file type: %s") % extension)
+
+    if not os.path.exists(source):
+        raise ValueError(_("No such file: %s") % source)
+
+    if os.path.exists(destination) and not force:
+        raise ValueError(_("File already exists: %s") % destination)
+
+    data = handlers[extension](source)
+    sqlite = SQLiteData(destination)
+
+    sqlite.import_data(data)
+
+    return len(sqlite)
+
+
+def main():
+    source = os.path.join(args.data_dir, args.source)
+
+    if args.destination:
+        destination = os.path.join(args.data_dir, args.destination)
+    else:
+        destination = os.path.splitext(source)[0] + ".sqlite"
+
+    try:
+        count = migrate(source, destination, args.force)
+    except ValueError as e:
+        print e.message
+        sys.exit(1)
+
+    print _("Imported %s keys from %s into %s") % (count, source,
+                                                   destination)
+
+
+if __name__ == "__main__":
+    main()
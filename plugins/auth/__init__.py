@@ -13,6 +13,7 @@ __author__ = 'Gareth Coles'
 
 import auth_handler
 import permissions_handler
+import throttle
 
 from system.command_manager import CommandManager
 from system.event_manager import EventManager
@@ -45,6 +46,7 @@ class AuthPlugin(plugin.PluginObject):
 
     auth_h = None
     perms_h = None
+    login_throttle = None
 
     def setup(self):
         """
@@ -53,6 +55,7 @@ class AuthPlugin(plugin.PluginObject):
 
         reload(auth_handler)
         reload(permissions_handler)
+        reload(throttle)
 
         self.logger.trace(_("Entered setup method."))
 
@@ -107,15 +110,25 @@ class AuthPlugin(plugin.PluginObject):
                 if not result:
                     self.logger.warn(_("Unable to set auth handler!"))
 
+            throttle_config = self.config.get("throttle", None) or {}
+
+            if throttle_config.get("enabled", True):
+                self.login_throttle = throttle.LoginThrottle(throttle_config)
+                self.login_throttle.start()
+
         self.logger.debug(_("Registering commands."))
         self.commands.register_command("login", self.login_command,
-                                       self, "auth.login", default=True)
+                                       self, "auth.login", default=True,
+                                       parse_args=False)
         self.commands.register_command("logout", self.logout_command,
-                                       self, "auth.login", default=True)
+                                       self, "auth.login", default=True,
+                                       parse_args=False)
         self.commands.register_command("register", self.register_command,
-                                       self, "auth.register", default=True)
+                                       self, "auth.register", default=True,
+                                       parse_args=False)
         self.commands.register_command("passwd", self.passwd_command, self,
-                                       "auth.passwd", default=True)
+                                       "auth.passwd", default=True,
+                                       parse_args=False)
 
         self.events.add_callback("PreCommand", self, self.pre_command, 10000)
 
@@ -164,16 +177,56 @@ class AuthPlugin(plugin.PluginObject):
             username = args[0]
             password = args[1]
 
-            result = self.auth_h.login(caller, protocol, username, password)
-            if not result:
-                self.logger.warn(_("%s failed to login as %s")
-                                 % (caller.nickname, username))
-                caller.respond(__("Invalid username or password!"))
-            else:
-                self.logger.info(_("%s logged in as %s")
-                                 % (caller.nickname, username))
-                caller.respond(__("You are now logged in as %s.")
-                               % username)
+            if not self.check_throttle(protocol, caller, username):
+                return
+
+            d = self.auth_h.login(caller, protocol, username, password)
+            d.addCallback(self._login_done, caller, username)
+
+    def check_throttle(self, protocol, caller, username=None):
+        """
+        Check whether someone's allowed to make another attempt at something
+        that involves hashing a password, telling them if they're not.
+
+        :param protocol: The protocol the attempt came from
+        :param caller: The user making the attempt
+        :param username: The account the attempt is for, if it exists
+
+        :return: Whether the attempt is allowed
+        :rtype: bool
+        """
+
+        if self.login_throttle is None:
+            return True
+
+        hostmask = throttle.get_hostmask(caller, protocol)
+
+        if self.login_throttle.attempt(hostmask, username):
+            return True
+
+        self.logger.warn(_("Throttled attempt from %s (%s) for account %s")
+                         % (caller.nickname, hostmask, username))
+        caller.respond(__("Too many attempts - please wait a few minutes "
+                          "and try again."))
+        return False
+
+    def _login_done(self, result, caller, username):
+        """
+        Tell a user whether their login attempt worked.
+        """
+
+        if not result:
+            self.logger.warn(_("%s failed to login as %s")
+                             % (caller.nickname, username))
+            caller.respond(__("Invalid username or password!"))
+        else:
+            self.logger.info(_("%s logged in as %s")
+                             % (caller.nickname, username))
+
+            if self.login_throttle is not None:
+                self.login_throttle.succeeded(username)
+            caller.respond(__("You are now logged in as %s.")
+                           % username)
 
     def logout_command(self, protocol, caller, source, command, raw_args,
                        parsed_args):
@@ -219,12 +272,27 @@ class AuthPlugin(plugin.PluginObject):
                               "Try another!"))
             return
 
-        if self.auth_h.create_user(username, password):
+        if not self.check_throttle(protocol, caller):
+            return
+
+        d = self.auth_h.create_user(username, password)
+        d.addCallback(self._register_done, caller, username)
+
+    def _register_done(self, result, caller, username):
+        """
+        Tell a user whether their account was created, and log them in if
+        it was.
+        """
+
+        if result:
             caller.respond(__("Your account has been created and you will now "
                               "be logged in. Thanks for registering!"))
-            self.perms_h.create_user(username)
-            self.login_command(caller, source, [username, password], protocol,
-                               raw_args, parsed_args)
+            if self.perms_h:
+                self.perms_h.create_user(username)
+
+            # They just gave us the password, no need to hash it again
+            self.auth_h.set_logged_in(caller, username)
+            self._login_done(True, caller, username)
         else:
             caller.respond(__("Something went wrong when creating your "
                               "account! You should ask the bot operators "
@@ -256,7 +324,18 @@ class AuthPlugin(plugin.PluginObject):
                               "another!"))
             return
 
-        if self.auth_h.change_password(username, old, new):
+        if not self.check_throttle(protocol, caller, username):
+            return
+
+        d = self.auth_h.change_password(username, old, new)
+        d.addCallback(self._passwd_done, caller, username)
+
+    def _passwd_done(self, result, caller, username):
+        """
+        Tell a user whether their password was changed.
+        """
+
+        if result:
             caller.respond(__("Your password has been changed successfully."))
         else:
             caller.respond(__("Old password incorrect - please try again!"))
@@ -286,8 +365,12 @@ class AuthPlugin(plugin.PluginObject):
 
     def deactivate(self):
         """
-        Called when the plugin is deactivated. Does nothing right now.
+        Called when the plugin is deactivated.
         """
+
+        if self.login_throttle is not None:
+            self.login_throttle.stop()
+
         if self.config["use-auth"]:
             if isinstance(
                     self.commands.auth_handler, auth_handler.authHandler
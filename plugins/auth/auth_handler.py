@@ -10,12 +10,23 @@ also includes a rudimentary password blacklist system.
 
 If you want to write your own auth handler, be sure to implement all the
 documented methods.
+
+Passwords are hashed with a configurable scheme and work factor (see
+`plugins.auth.hashing`). Hashing is slow on purpose, so it's done in the
+threadpool - the methods that need to hash a password return Deferreds.
 """
 
 __author__ = 'Gareth Coles'
 
 import hashlib
 
+from twisted.internet import reactor
+from twisted.internet.defer import maybeDeferred, succeed
+from twisted.internet.threads import deferToThreadPool
+
+from plugins.auth import hashing
+from system.decorators.log import deprecated
+from system.decorators.threads import pool
 from system.translations import Translations
 from utils.password import mkpasswd
 
@@ -30,6 +41,14 @@ class authHandler(object):
 
     users = {}
 
+    #: The scheme and work factor used to hash new passwords
+    #: :type: hashing.Hasher
+    hasher = None
+
+    #: Whether to hash passwords in the threadpool - you'll only want to
+    #: turn this off for testing
+    use_threads = True
+
     def __init__(self, plugin, data, blacklist):
         """
         Initialise the auth handler.
@@ -42,6 +61,8 @@ class authHandler(object):
         self.blacklist = blacklist
         self.plugin = plugin
 
+        self.hasher = self.get_hasher()
+
         self.create_superadmin_account()
         self.create_blacklisted_passwords()
 
@@ -148,7 +169,15 @@ class authHandler(object):
 
         password = mkpasswd(32, 11, 11, 10)
 
-        self.create_user(_("superadmin"), password)
+        d = self.create_user(_("superadmin"), password)
+        d.addCallbacks(self._superadmin_created, self._superadmin_failed,
+                       callbackArgs=(password,))
+
+    def _superadmin_created(self, result, password):
+        if not result:
+            self.plugin.logger.error(_("Unable to create the superadmin "
+                                       "account!"))
+            return
 
         self.plugin.logger.info("============================================")
         self.plugin.logger.info(_("Super admin username: superadmin"))
@@ -173,9 +202,54 @@ class authHandler(object):
                                       "permissions system isn't being used."))
             self.plugin.logger.warn(_("Please do this manually!"))
 
+    def _superadmin_failed(self, failure):
+        self.plugin.logger.error(_("Unable to create the superadmin account: "
+                                   "%s") % failure.getErrorMessage())
+
+    def get_hasher(self):
+        """
+        Get the hasher for new passwords, as set in the plugin's config.
+
+        Falls back to the default PBKDF2 settings if the configured scheme
+        isn't available.
+
+        :rtype: hashing.Hasher
+        """
+
+        settings = dict(self.plugin.config.get("hashing", None) or {})
+        scheme = settings.pop("scheme", hashing.PBKDF2Hasher.scheme)
+
+        try:
+            return hashing.get_hasher(scheme, **settings)
+        except KeyError:
+            self.plugin.logger.warn(_("Password hashing scheme '%s' isn't "
+                                      "available, using the default settings "
+                                      "instead") % scheme)
+            return hashing.get_hasher()
+
+    def defer(self, func, *args, **kwargs):
+        """
+        Run a function in the threadpool, returning a Deferred.
+
+        :param func: The function to run
+        :type func: function
+
+        :rtype: Deferred
+        """
+
+        if not self.use_threads:
+            return maybeDeferred(func, *args, **kwargs)
+
+        if not pool.started:
+            pool.start()
+
+        return deferToThreadPool(reactor, pool, func, *args, **kwargs)
+
+    @deprecated("Use the hashing module instead")
     def hash(self, salt, password):
         """
-        Returns the hash for a given password and salt.
+        Returns the hash for a given password and salt, using the legacy
+        sha512 scheme.
 
         :param salt: The salt to use in the hash
         :param password: The password itself
@@ -196,38 +270,96 @@ class authHandler(object):
 
         self.data.reload()
 
+    def _verify(self, password, record):
+        """
+        Check a password against an account's password data, rehashing it
+        if it was hashed with an outdated scheme or work factor.
+
+        This is run in the threadpool.
+
+        :return: (correct, new password data or None)
+        :rtype: tuple
+        """
+
+        if not hashing.verify(password, record):
+            return False, None
+
+        if self.hasher.needs_rehash(record):
+            return True, self.hasher.hash(password)
+
+        return True, None
+
+    def _store(self, username, record, new_record):
+        """
+        Replace an account's password data, as long as it hasn't changed
+        since we read it.
+
+        :return: Whether the password data was replaced
+        :rtype: bool
+        """
+
+        with self.data:
+            current = self.data.get(username, None)
+
+            if current is None or \
+                    current.get("password", None) != record["password"]:
+                return False
+
+            self.data[username] = new_record
+        return True
+
     def check_login(self, username, password):
         """
         Check whether a password is the valid login for a user.
 
+        If the password is correct but was hashed with an outdated scheme
+        or work factor, it's rehashed with the current settings.
+
         :param username: The username to check against
         :param password: The attempted password
 
         :type username: str
         :type password: str
 
-        :return: Whether the password was correct
-        :rtype: bool
+        :return: A Deferred, firing with whether the password was correct
+        :rtype: Deferred
         """
 
         username = username.lower()
         with self.data:
             if username not in self.data:
-                return False
-            user_data = self.data[username]
-        calculated = self.hash(user_data["salt"], password)
-        real_hash = user_data["password"]
-
-        if calculated == real_hash:
-            return True
+                return succeed(False)
+            record = dict(self.data[username])
+
+        d = self.defer(self._verify, password, record)
+        d.addCallbacks(self._check_login_verified, self._check_login_failed,
+                       callbackArgs=(username, record),
+                       errbackArgs=(username,))
+        return d
+
+    def _check_login_verified(self, result, username, record):
+        correct, new_record = result
+
+        if correct and new_record is not None:
+            if self._store(username, record, new_record):
+                self.plugin.logger.info(
+                    _("Upgraded password hash for %s to %s")
+                    % (username, self.hasher)
+                )
+
+        return correct
+
+    def _check_login_failed(self, failure, username):
+        self.plugin.logger.error(_("Unable to check password for %s: %s")
+                                 % (username, failure.getErrorMessage()))
         return False
 
     def create_user(self, username, password):
         """
         Create a new user account with a given username and password.
 
-        The salt will be generated randomly, at a length of 64. Creation will
-        fail if the user account already exists.
+        The salt will be generated randomly. Creation will fail if the user
+        account already exists.
 
         :param username: The username of the account
         :param password: The password to be used
@@ -235,24 +367,26 @@ class authHandler(object):
         :type username: str
         :type password: str
 
-        :return: Whether the account was created successfully
-        :rtype: bool
+        :return: A Deferred, firing with whether the account was created
+            successfully
+        :rtype: Deferred
         """
 
         username = username.lower()
 
-        with self.data:
-            if username in self.data:
-                return False
+        if username in self.data:
+            return succeed(False)
 
-            salt = mkpasswd(64, 21, 22, 21)
-            hashed = self.hash(salt, password)
+        d = self.defer(self.hasher.hash, password)
+        d.addCallback(self._create_user_hashed, username)
+        return d
 
-            self.data[username] = {
-                "password": hashed,
-                "salt": salt
-            }
+    def _create_user_hashed(self, record, username):
+        with self.data:
+            if username in self.data:
+                return False  # Someone beat us to it
 
+            self.data[username] = record
         return True
 
     def change_password(self, username, old, new):
@@ -272,26 +406,29 @@ class authHandler(object):
         :type old: str
         :type new: str
 
-        :return: Whether the password was changed
-        :rtype: bool
+        :return: A Deferred, firing with whether the password was changed
+        :rtype: Deferred
         """
 
         username = username.lower()
         with self.data:
             if username not in self.data:
-                return False
-            user_data = self.data[username]
-            calculated = self.hash(user_data["salt"], old)
-            real_hash = user_data["password"]
-            if calculated != real_hash:
-                return False
+                return succeed(False)
+            record = dict(self.data[username])
 
-            salt = mkpasswd(64, 21, 22, 21)
-            hashed = self.hash(salt, new)
+        d = self.defer(self._change_password, old, new, record)
+        d.addCallback(self._change_password_hashed, username, record)
+        return d
 
-            self.data[username]["password"] = hashed
-            self.data[username]["salt"] = salt
-        return True
+    def _change_password(self, old, new, record):
+        if not hashing.verify(old, record):
+            return None
+        return self.hasher.hash(new)
+
+    def _change_password_hashed(self, new_record, username, record):
+        if new_record is None:
+            return False
+        return self._store(username, record, new_record)
 
     def delete_user(self, username):
         """
@@ -330,25 +467,40 @@ class authHandler(object):
         :type username: str
         :type password: str
 
-        :return: Whether the user was logged in successfully.
-        :rtype: bool
+        :return: A Deferred, firing with whether the user was logged in
+            successfully.
+        :rtype: Deferred
         """
 
         username = username.lower()
-        with self.data:
-            if username not in self.data:
-                return False
-            user_data = self.data[username]
-        calculated = self.hash(user_data["salt"], password)
-        real_hash = user_data["password"]
 
-        if calculated == real_hash:
-            user.authorized = True
-            user.auth_name = username
+        d = self.check_login(username, password)
+        d.addCallback(self._login_checked, user, username)
+        return d
 
-            self.add_logged_in_user(username, user)
-            return True
-        return False
+    def _login_checked(self, correct, user, username):
+        if correct:
+            self.set_logged_in(user, username)
+        return correct
+
+    def set_logged_in(self, user, username):
+        """
+        Log a user in without checking their password - for when we already
+        know they have it, like just after they've registered.
+
+        :param user: The User object of the person to log in
+        :param username: The username of their account
+
+        :type user: User
+        :type username: str
+        """
+
+        username = username.lower()
+
+        user.authorized = True
+        user.auth_name = username
+
+        self.add_logged_in_user(username, user)
 
     def logout(self, user, protocol):
         """
@@ -0,0 +1,246 @@
+"""
+Password hashing schemes.
+
+Each account stores the scheme its password was hashed with, along with the
+work factor that was used, so the work factor can be raised in the config
+without breaking existing accounts. Accounts using an older scheme or a
+lower work factor are rehashed the next time they log in successfully.
+
+Accounts from before this existed only have a password and salt - those use
+the "sha512" scheme, which is only kept around so that they can log in and
+be upgraded.
+
+The available schemes are:
+
+* *pbkdf2* - PBKDF2-HMAC, with a configurable number of *rounds* and
+  *digest*
+* *scrypt* - scrypt, with configurable *n*, *r* and *p* - only available
+  when the hashlib we're running on supports it
+* *sha512* - The legacy scheme. Don't use this for new passwords!
+"""
+
+__author__ = 'Gareth Coles'
+
+import binascii
+import hashlib
+import hmac
+import os
+
+from kitchen.text.converters import to_bytes
+
+from system.translations import Translations
+_ = Translations().get()
+
+SCRYPT_AVAILABLE = hasattr(hashlib, "scrypt")
+
+#: Bytes of random salt to use for new hashes
+SALT_SIZE = 32
+
+
+def compare(a, b):
+    """
+    Compare two digests in constant time, so how long the comparison takes
+    doesn't give away how much of the digest was right.
+
+    :type a: str
+    :type b: str
+
+    :rtype: bool
+    """
+
+    return hmac.compare_digest(to_bytes(a), to_bytes(b))
+
+
+def make_salt():
+    """
+    Generate a random salt, as a hex string.
+
+    :rtype: str
+    """
+
+    return binascii.hexlify(os.urandom(SALT_SIZE))
+
+
+class Hasher(object):
+    """
+    Base class for password hashing schemes.
+
+    Subclasses should set *scheme* and *params* (the names of the work
+    factor settings stored with each account, along with their defaults),
+    and implement `digest`.
+    """
+
+    #: The name stored with each account hashed by this scheme
+    scheme = None
+
+    #: Work factor settings and their defaults
+    params = {}
+
+    def __init__(self, **settings):
+        self.settings = {}
+
+        for key, default in self.params.iteritems():
+            self.settings[key] = settings.get(key, default)
+
+    def digest(self, password, salt, settings):
+        """
+        Hash a password. Override this in subclasses.
+
+        :param password: The password to hash
+        :param salt: The salt to use
+        :param settings: The work factor settings to use
+
+        :type password: str
+        :type salt: str
+        :type settings: dict
+
+        :return: The hex digest
+        :rtype: str
+        """
+
+        raise NotImplementedError()
+
+    def hash(self, password, salt=None):
+        """
+        Hash a password with the current settings, for storing.
+
+        :param password: The password to hash
+        :param salt: The salt to use, or None to generate one
+
+        :type password: str
+        :type salt: str, None
+
+        :return: The account's password data, including the scheme and
+            work factor settings
+        :rtype: dict
+        """
+
+        if salt is None:
+            salt = make_salt()
+
+        record = {
+            "password": self.digest(password, salt, self.settings),
+            "salt": salt,
+            "scheme": self.scheme
+        }
+
+        record.update(self.settings)
+        return record
+
+    def needs_rehash(self, record):
+        """
+        Check whether an account's password data was created with a
+        different scheme, or a different work factor.
+
+        :param record: The account's password data
+        :type record: dict
+
+        :rtype: bool
+        """
+
+        if record.get("scheme", LegacyHasher.scheme) != self.scheme:
+            return True
+
+        for key, value in self.settings.iteritems():
+            if record.get(key, None) != value:
+                return True
+
+        return False
+
+    def __repr__(self):
+        return "<Hasher %s: %s>" % (self.scheme, self.settings)
+
+
+class LegacyHasher(Hasher):
+    """
+    The original sha512(salt + password) scheme.
+    """
+
+    scheme = "sha512"
+
+    def digest(self, password, salt, settings):
+        return hashlib.sha512(to_bytes(salt) + to_bytes(password)).hexdigest()
+
+
+class PBKDF2Hasher(Hasher):
+    """
+    PBKDF2-HMAC, with a configurable number of rounds and digest.
+    """
+
+    scheme = "pbkdf2"
+    params = {"rounds": 100000, "digest": "sha512"}
+
+    def digest(self, password, salt, settings):
+        return binascii.hexlify(hashlib.pbkdf2_hmac(
+            str(settings["digest"]), to_bytes(password), to_bytes(salt),
+            int(settings["rounds"])
+        ))
+
+
+class ScryptHasher(Hasher):
+    """
+    scrypt, with configurable cost (n), block size (r) and parallelism (p).
+    """
+
+    scheme = "scrypt"
+    params = {"n": 16384, "r": 8, "p": 1}
+
+    def digest(self, password, salt, settings):
+        n, r, p = int(settings["n"]), int(settings["r"]), int(settings["p"])
+
+        return binascii.hexlify(hashlib.scrypt(
+            to_bytes(password), salt=to_bytes(salt), n=n, r=r, p=p,
+            maxmem=256 * n * r + 1024 * 1024
+        ))
+
+
+SCHEMES = {
+    LegacyHasher.scheme: LegacyHasher,
+    PBKDF2Hasher.scheme: PBKDF2Hasher,
+}
+
+if SCRYPT_AVAILABLE:
+    SCHEMES[ScryptHasher.scheme] = ScryptHasher
+
+
+def get_hasher(scheme=PBKDF2Hasher.scheme, **settings):
+    """
+    Get a hasher for a scheme, with the given work factor settings.
+
+    :param scheme: The name of the scheme
+    :type scheme: str
+
+    :raises: KeyError if the scheme isn't available
+
+    :rtype: Hasher
+    """
+
+    return SCHEMES[scheme](**settings)
+
+
+def verify(password, record):
+    """
+    Check a password against an account's password data, using the scheme
+    and work factor it was hashed with.
+
+    :param password: The attempted password
+    :param record: The account's password data
+
+    :type password: str
+    :type record: dict
+
+    :raises: KeyError if the account's scheme isn't available
+
+    :return: Whether the password was correct
+    :rtype: bool
+    """
+
+    hasher = SCHEMES[record.get("scheme", LegacyHasher.scheme)]
+    settings = dict(hasher.params)
+
+    for key in settings:
+        if key in record:
+            settings[key] = record[key]
+
+    calculated = hasher().digest(password, record["salt"], settings)
+    return compare(calculated, record["password"])
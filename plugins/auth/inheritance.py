@@ -0,0 +1,206 @@
+"""
+Flattened group inheritance.
+
+Each group may inherit from one other group, which may inherit from another,
+and so on. Rather than following that chain on every permissions check, the
+chain for each group is worked out once, and the effective permissions for
+each (group, protocol, source) are flattened into a frozenset the first time
+they're needed.
+
+When a group changes, only the groups that inherit from it (directly or
+otherwise) are thrown away. Inheritance loops are found when the chains are
+built, and are logged and broken there instead of being handled on every
+check.
+"""
+
+__author__ = 'Gareth Coles'
+
+from system.translations import Translations
+_ = Translations().get()
+
+EMPTY = frozenset()
+
+
+class GroupTree(object):
+    """
+    Resolves group inheritance for a permissions data file.
+
+    :param data: The permissions data, with a "groups" key
+    :param logger: A logger to report inheritance loops to, or None
+
+    :type data: Data, dict
+    """
+
+    def __init__(self, data, logger=None):
+        self.data = data
+        self.logger = logger
+
+        self._chains = None  # {group: (group, inherited, ...)}
+        self._flat = {}  # {group: {(protocol, source): frozenset}}
+
+        #: Inheritance loops found the last time the chains were built
+        self.loops = []
+
+    def invalidate(self):
+        """
+        Throw everything away - for when the data file has been reloaded.
+        """
+
+        self._chains = None
+        self._flat.clear()
+
+    @property
+    def chains(self):
+        """
+        The inheritance chain for every group, built if needed.
+
+        Each chain starts with the group itself, and is followed by the
+        groups it inherits from, in order. If the chain ends with a group
+        that doesn't exist, that group is included, so we know to rebuild
+        the chain when it's created.
+
+        :rtype: dict
+        """
+
+        if self._chains is None:
+            self._build_chains()
+        return self._chains
+
+    def _build_chains(self):
+        groups = self.data["groups"]
+        chains = {}
+        loops = []
+
+        for group in groups:
+            chain = [group]
+            seen = set(chain)
+            current = group
+
+            while current in groups:
+                inherit = groups[current].get("inherit", None)
+
+                if not inherit:
+                    break
+
+                inherit = inherit.lower()
+
+                if inherit in seen:
+                    loops.append(tuple(chain) + (inherit,))
+                    break
+
+                chain.append(inherit)
+                seen.add(inherit)
+                current = inherit
+
+            chains[group] = tuple(chain)
+
+        for loop in loops:
+            if self.logger is not None:
+                self.logger.warn(_("Group inheritance loop, ignoring the "
+                                   "last step: %s") % " -> ".join(loop))
+
+        self._chains = chains
+        self.loops = loops
+
+    def chain(self, group):
+        """
+        Get the inheritance chain for a group.
+
+        :param group: The group, lowercased
+        :type group: str
+
+        :return: The chain, or an empty tuple if the group doesn't exist
+        :rtype: tuple
+        """
+
+        return self.chains.get(group, ())
+
+    def dependents(self, group):
+        """
+        Get the groups that inherit from a group, including itself.
+
+        :param group: The group, lowercased
+        :type group: str
+
+        :rtype: set
+        """
+
+        return set(
+            name for name, chain in self.chains.iteritems() if group in chain
+        )
+
+    def changed(self, group, inheritance=False):
+        """
+        Throw away the flattened permissions for a group and anything that
+        inherits from it.
+
+        :param group: The group that changed, lowercased
+        :param inheritance: Whether the group's inheritance changed, or it
+            was created or removed - if so, the chains are rebuilt too
+
+        :type group: str
+        :type inheritance: bool
+        """
+
+        affected = self.dependents(group)
+
+        if inheritance:
+            self._chains = None
+            affected.update(self.dependents(group))
+
+        for name in affected:
+            self._flat.pop(name, None)
+
+    def permissions(self, group, protocol=None, source=None):
+        """
+        Get the effective permissions for a group in a specific context,
+        including everything it inherits.
+
+        :param group: The group, lowercased
+        :param protocol: The protocol, lowercased
+        :param source: The source, lowercased
+
+        :type group: str
+        :type protocol: str, None
+        :type source: str, None
+
+        :return: The permission nodes
+        :rtype: frozenset
+        """
+
+        key = (protocol, source)
+        flat = self._flat.get(group, None)
+
+        if flat is not None and key in flat:
+            return flat[key]
+
+        groups = self.data["groups"]
+        nodes = set()
+
+        for name in self.chain(group):
+            if name not in groups:
+                break
+
+            data = groups[name]
+            nodes.update(data.get("permissions", None) or [])
+
+            if not protocol:
+                continue
+
+            proto = (data.get("protocols", None) or {}).get(protocol, None)
+
+            if not proto:
+                continue
+
+            nodes.update(proto.get("permissions", None) or [])
+
+            if source:
+                sources = proto.get("sources", None) or {}
+                nodes.update(sources.get(source, None) or [])
+
+        result = frozenset(nodes) if nodes else EMPTY
+
+        if group in groups:
+            self._flat.setdefault(group, {})[key] = result
+
+        return result
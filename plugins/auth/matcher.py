@@ -0,0 +1,239 @@
+"""
+Compiled permission matching.
+
+Permission nodes come in three flavours - exact nodes ("auth.login"),
+wildcard nodes ("factoids.*") and regex nodes ("/factoids.+/i"). Any of
+them may be prefixed with "^" to deny a permission instead of granting it.
+
+Rather than trying every node against every permission we check, a list of
+nodes is compiled once into a `PermissionMatcher`, which keeps exact nodes
+in a set, merges the wildcard nodes into a single regex and compiles each
+regex node up front. Deny nodes are compiled separately and always win.
+"""
+
+__author__ = 'Gareth Coles'
+
+import fnmatch
+import re
+
+from collections import OrderedDict
+
+from utils.misc import str_to_regex_flags as s2rf
+
+#: Matches regex nodes, giving the pattern and the flags
+REGEX_NODE = re.compile(r"/(.*)/(.*)")
+
+#: Characters that make a node a wildcard node
+WILDCARD_CHARS = re.compile(r"[*?\[]")
+
+
+def wildcard_to_regex(node):
+    """
+    Translate a wildcard node into a regex pattern, without the inline
+    flags that `fnmatch` adds - we can't have those in the middle of a
+    merged pattern.
+
+    :param node: The wildcard node
+    :type node: str
+
+    :rtype: str
+    """
+
+    pattern = fnmatch.translate(node)
+
+    if pattern.endswith("(?ms)"):
+        pattern = pattern[:-5]
+
+    return pattern
+
+
+class NodeSet(object):
+    """
+    A compiled set of permission nodes, without any deny nodes.
+
+    :param nodes: The nodes to compile
+    :param wildcard: Whether to handle wildcard nodes - if not, they're
+        treated as exact nodes
+    :param regex: Whether to handle regex nodes - if not, they're treated
+        as wildcard or exact nodes
+
+    :type nodes: list
+    :type wildcard: bool
+    :type regex: bool
+    """
+
+    def __init__(self, nodes, wildcard=True, regex=True):
+        self.exact = set()
+        self.wildcard = None
+        self.regexes = []
+
+        #: Regex nodes that couldn't be compiled, as (node, error)
+        self.invalid = []
+
+        wildcards = []
+
+        for node in nodes:
+            if regex:
+                result = REGEX_NODE.match(node)
+
+                if result:
+                    pattern, flags = result.groups()
+
+                    try:
+                        self.regexes.append(re.compile(pattern, s2rf(flags)))
+                    except (re.error, KeyError) as e:
+                        self.invalid.append((node, e))
+                    continue
+
+            node = node.lower()
+
+            if wildcard and WILDCARD_CHARS.search(node):
+                wildcards.append(wildcard_to_regex(node))
+            else:
+                self.exact.add(node)
+
+        if wildcards:
+            self.wildcard = re.compile(
+                "|".join("(?:%s)" % pattern for pattern in wildcards),
+                re.M | re.S
+            )
+
+    def __len__(self):
+        return len(self.exact) + len(self.regexes) + int(bool(self.wildcard))
+
+    def matches(self, perm):
+        """
+        Check whether a permission matches any of the nodes in this set.
+
+        :param perm: The permission, lowercased
+        :type perm: str
+
+        :rtype: bool
+        """
+
+        if perm in self.exact:
+            return True
+
+        if self.wildcard is not None and self.wildcard.match(perm):
+            return True
+
+        for pattern in self.regexes:
+            if pattern.match(perm):
+                return True
+
+        return False
+
+
+class PermissionMatcher(object):
+    """
+    A compiled list of permission nodes, including deny nodes.
+
+    Takes the same arguments as `permissionsHandler.compare_permissions`.
+    """
+
+    def __init__(self, nodes, wildcard=True, deny_nodes=True, regex=True):
+        grant = []
+        deny = []
+
+        for node in nodes:
+            if node.startswith("^"):
+                deny.append(node[1:])
+            else:
+                grant.append(node)
+
+        self.grant = NodeSet(grant, wildcard, regex)
+
+        if deny_nodes and deny:
+            self.deny = NodeSet(deny, wildcard, regex)
+        else:
+            self.deny = None
+
+    @property
+    def invalid(self):
+        """
+        Regex nodes that couldn't be compiled, as (node, error).
+
+        :rtype: list
+        """
+
+        if self.deny is None:
+            return self.grant.invalid
+        return self.deny.invalid + self.grant.invalid
+
+    def matches(self, perm):
+        """
+        Check whether a permission is granted, and not denied.
+
+        :param perm: The permission to check
+        :type perm: str
+
+        :rtype: bool
+        """
+
+        perm = perm.lower()
+
+        if self.deny is not None and self.deny.matches(perm):
+            return False
+
+        return self.grant.matches(perm)
+
+
+class DecisionCache(object):
+    """
+    Small LRU cache for permissions decisions and compiled matchers.
+
+    :param size: The maximum number of entries to keep
+    :type size: int
+    """
+
+    def __init__(self, size=1000):
+        self.size = size
+        self.entries = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, default=None):
+        """
+        Get an entry, marking it as recently used.
+
+        :param key: The cache key
+        :param default: What to return if there's no such entry
+        """
+
+        try:
+            value = self.entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        self.entries[key] = value
+        return value
+
+    def set(self, key, value):
+        """
+        Add an entry, evicting the least recently used ones if we're full.
+
+        :param key: The cache key
+        :param value: The value to store
+        """
+
+        self.entries.pop(key, None)
+        self.entries[key] = value
+
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Remove every entry.
+        """
+
+        self.entries.clear()
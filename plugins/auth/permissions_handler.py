@@ -6,20 +6,25 @@ the CommandManager - otherwise you'll have to get it from the plugin instance.
 
 The permissions handler supports inheritance, patterns and other useful stuff.
 If you want to write your own, be sure to implement all the documented methods.
+
+Permission nodes are compiled into matchers (see `plugins.auth.matcher`), and
+decisions are cached per user or group, protocol, source and permission.
+Group inheritance is flattened ahead of time (see `plugins.auth.inheritance`).
+The caches are updated whenever the permissions are changed through this
+handler, or the data file is reloaded - if you edit the data directly, call
+`invalidate` when you're done.
 """
 
 __author__ = 'Gareth Coles'
 
 # Required: check(permission, caller, source, protocol)
 
-import fnmatch
-import re
-
+from plugins.auth.inheritance import GroupTree
+from plugins.auth.matcher import DecisionCache, PermissionMatcher, \
+    REGEX_NODE
 from system.protocols.generic.user import User
 from system.translations import Translations
 
-from utils.misc import str_to_regex_flags as s2rf
-
 _ = Translations().get()
 __ = Translations().get_m()
 
@@ -29,7 +34,10 @@ class permissionsHandler(object):
     Permissions handler class
     """
 
-    pattern = re.compile(r"/(.*)/(.*)")
+    pattern = REGEX_NODE
+
+    #: How many compiled matchers, and how many decisions, to keep cached
+    cache_size = 1000
 
     def __init__(self, plugin, data):
         """
@@ -41,6 +49,12 @@ class permissionsHandler(object):
         self.data = data
         self.plugin = plugin
 
+        self.matchers = DecisionCache(self.cache_size)
+        self.decisions = DecisionCache(self.cache_size)
+        self.inheritance = GroupTree(self.data, self.plugin.logger)
+
+        self.data.add_callback(self.invalidate)
+
         with self.data:
             if "users" not in self.data:
                 self.data["users"] = {}
@@ -100,6 +114,35 @@ class permissionsHandler(object):
 
         return self.data.reload()
 
+    def invalidate(self):
+        """
+        Throw away all cached decisions and flattened group permissions.
+
+        This is called when the data file is reloaded. If you change the
+        data directly, you'll need to call it yourself.
+        """
+
+        self.decisions.clear()
+        self.inheritance.invalidate()
+
+    def group_changed(self, group, inheritance=False):
+        """
+        Throw away cached decisions, and the flattened permissions for a
+        group and the groups that inherit from it.
+
+        This is called by the methods that change groups.
+
+        :param group: The group that changed
+        :param inheritance: Whether the group's inheritance changed, or the
+            group was created or removed
+
+        :type group: str
+        :type inheritance: bool
+        """
+
+        self.decisions.clear()
+        self.inheritance.changed(group.lower(), inheritance)
+
     def check(self, permission, caller, source, protocol):
         """
         Check whether someone has a specified permission.
@@ -193,6 +236,7 @@ class permissionsHandler(object):
                 }
 
                 self.data["users"][user] = newuser
+                self.decisions.clear()
 
                 self.plugin.logger.debug(_("User created: %s") % user)
 
@@ -218,6 +262,7 @@ class permissionsHandler(object):
             if user not in self.data["users"]:
                 return False
             del self.data["users"][user]
+            self.decisions.clear()
         return True
 
     def set_user_option(self, user, option, value):
@@ -251,6 +296,7 @@ class permissionsHandler(object):
         with self.data:
             if user in self.data["users"]:
                 self.data["users"][user]["options"][option] = value
+                self.decisions.clear()
                 self.plugin.logger.debug(_("Option %s set to %s for user %s.")
                                          % (option, value, user))
 
@@ -313,11 +359,13 @@ class permissionsHandler(object):
                     proto["permissions"] = pperms
                     protos[protocol] = proto
                     self.data["users"][user]["protocols"] = protos
+                    self.decisions.clear()
 
                     return result
 
                 elif permission not in self.data["users"]["permissions"]:
                     self.data["users"]["permissions"].append(permission)
+                    self.decisions.clear()
                     return True
         return False
 
@@ -377,11 +425,13 @@ class permissionsHandler(object):
                     proto["permissions"] = pperms
                     protos[protocol] = proto
                     self.data["users"][user]["protocols"] = protos
+                    self.decisions.clear()
 
                     return result
 
                 elif permission not in self.data["users"]["permissions"]:
                     self.data["users"]["permissions"].remove(permission)
+                    self.decisions.clear()
                     return True
         return False
 
@@ -409,6 +459,7 @@ class permissionsHandler(object):
         with self.data:
             if user in self.data["users"]:
                 self.data["users"][user]["group"] = group
+                self.decisions.clear()
                 return True
         return False
 
@@ -469,6 +520,20 @@ class permissionsHandler(object):
         user = user.lower()
         permission = permission.lower()
 
+        key = ("user", user, protocol, source, permission, check_group,
+               check_superadmin)
+        result = self.decisions.get(key)
+
+        if result is None:
+            result = self._user_has_permission(user, permission, protocol,
+                                               source, check_group,
+                                               check_superadmin)
+            self.decisions.set(key, result)
+
+        return result
+
+    def _user_has_permission(self, user, permission, protocol, source,
+                             check_group, check_superadmin):
         user_group = "default"
 
         if user in self.data["users"]:
@@ -479,6 +544,39 @@ class permissionsHandler(object):
                 if superadmin:
                     return True
 
+            matcher = self.get_user_matcher(user, protocol, source)
+
+            if matcher.matches(permission):
+                return True
+
+        if check_group:
+            has_perm = self.group_has_permission(user_group, permission,
+                                                 protocol, source)
+            if has_perm:
+                return True
+        return False
+
+    def get_user_matcher(self, user, protocol=None, source=None):
+        """
+        Get the compiled permissions for a user in a specific context,
+        not including the permissions they get from their group.
+
+        :param user: Username to get the permissions for
+        :param protocol: Protocol to get the permissions for
+        :param source: Source to get the permissions for
+
+        :type user: str, unicode
+        :type protocol: str, unicode, None
+        :type source: str, unicode, None
+
+        :return: The compiled permissions
+        :rtype: PermissionMatcher
+        """
+
+        user = user.lower()
+        user_perms = []
+
+        if user in self.data["users"]:
             user_perms = self.data["users"][user]["permissions"]
 
             _protos = self.data["users"][user].get("protocols", {})
@@ -487,20 +585,12 @@ class permissionsHandler(object):
                 _proto = _protos.get(protocol, {})
                 user_perms = user_perms + _proto.get("permissions", [])
 
-                _sources = _protos.get("sources", {})
+                _sources = _proto.get("sources", {})
 
                 if source:
                     user_perms = user_perms + _sources.get(source, [])
 
-            if self.compare_permissions(permission, user_perms):
-                return True
-
-        if check_group:
-            has_perm = self.group_has_permission(user_group, permission,
-                                                 protocol, source)
-            if has_perm:
-                return True
-        return False
+        return self.get_matcher(user_perms)
 
     # Group operations
     #  Modification
@@ -519,6 +609,7 @@ class permissionsHandler(object):
                     "options": {}
                 }
                 self.data["groups"][group] = new_group
+                self.group_changed(group, True)
                 return True
         return False
 
@@ -532,6 +623,7 @@ class permissionsHandler(object):
         with self.data:
             if group in self.data["groups"]:
                 del self.data["groups"][group]
+                self.group_changed(group, True)
                 return True
         return False
 
@@ -579,6 +671,7 @@ class permissionsHandler(object):
         with self.data:
             if group in self.data["groups"]:
                 self.data["groups"][group]["inherit"] = inherit
+                self.group_changed(group, True)
                 return True
         return False
 
@@ -596,6 +689,7 @@ class permissionsHandler(object):
                 if permission not in self.data["groups"][group]["permissions"]:
                     self.data["groups"][group]["permissions"]\
                         .append(permission)
+                    self.group_changed(group)
                     return True
         return False
 
@@ -628,6 +722,7 @@ class permissionsHandler(object):
                 if permission in self.data["groups"][group]["permissions"]:
                     self.data["groups"][group]["permissions"]\
                         .remove(permission)
+                    self.group_changed(group)
                     return True
         return False
 
@@ -677,55 +772,99 @@ class permissionsHandler(object):
         group = group.lower()
         permission = permission.lower()
 
-        groups = []
-        all_perms = set()
+        key = ("group", group, protocol, source, permission)
+        result = self.decisions.get(key)
 
-        self.plugin.logger.debug(_("Checking group perms..."))
-        self.plugin.logger.debug(_("GROUP | %s") % group)
-        self.plugin.logger.debug(_("PERMI | %s") % permission)
-        self.plugin.logger.debug(_("SOURC | %s") % source)
-        self.plugin.logger.debug(_("PROTO | %s") % protocol)
+        if result is None:
+            self.plugin.logger.debug(_("Checking group perms..."))
+            self.plugin.logger.debug(_("GROUP | %s") % group)
+            self.plugin.logger.debug(_("PERMI | %s") % permission)
+            self.plugin.logger.debug(_("SOURC | %s") % source)
+            self.plugin.logger.debug(_("PROTO | %s") % protocol)
 
-        def _recur(_group):
-            if _group is None:
-                self.plugin.logger.debug(_("Group is None."))
-                return
-            if _group in self.data["groups"]:
-                if _group not in groups:
-                    groups.append(_group)
-                    perms_list = self.data["groups"][_group]["permissions"]
-                    all_perms.update(set(perms_list))
+            result = False
 
-                    _protos = self.data["groups"][_group].get("protocols", {})
+            if group in self.data["groups"]:
+                matcher = self.get_group_matcher(group, protocol, source)
+                result = matcher.matches(permission)
 
-                    if _protos is None:
-                        self.plugin.logger.debug(_("Protocols are None."))
-                        return
+            self.decisions.set(key, result)
 
-                    if protocol:
-                        _proto = _protos.get(protocol, {})
+        return result
 
-                        all_perms.update(set(_proto.get("permissions", [])))
+    def get_group_matcher(self, group, protocol=None, source=None):
+        """
+        Get the compiled permissions for a group in a specific context,
+        including the permissions it inherits.
 
-                        _sources = _proto.get("sources", {})
+        :param group: Group to get the permissions for
+        :param protocol: Protocol to get the permissions for
+        :param source: Source to get the permissions for
 
-                        if _sources is None:
-                            self.plugin.logger.debug(_("Sources are None."))
-                            return
+        :type group: str, unicode
+        :type protocol: str, unicode, None
+        :type source: str, unicode, None
 
-                        if source:
-                            all_perms.update(set(_sources.get(source, [])))
+        :return: The compiled permissions
+        :rtype: PermissionMatcher
+        """
 
-                    inherit = self.get_group_inheritance(_group)
-                    if inherit:
-                        _recur(inherit)
+        group = group.lower()
 
-        if group in self.data["groups"]:
-            _recur(group)
-            return self.compare_permissions(permission, list(all_perms))
-        return False
+        return self.get_matcher(
+            self.inheritance.permissions(group, protocol, source)
+        )
 
     # Permissions comparisons
+    def compile_permissions(self, permissions, wildcard=True,
+                            deny_nodes=True, regex=True):
+        """
+        Compile a list of permissions, for matching permissions against them
+        quickly. Invalid regex permissions are logged and ignored.
+
+        Takes the same arguments as `compare_permissions`, without *perm*.
+
+        :return: The compiled permissions
+        :rtype: PermissionMatcher
+        """
+
+        matcher = PermissionMatcher(permissions, wildcard, deny_nodes, regex)
+
+        for node, error in matcher.invalid:
+            self.plugin.logger.warn(_("Invalid regex permission %s: %s")
+                                    % (node, error))
+
+        return matcher
+
+    def get_matcher(self, permissions, wildcard=True, deny_nodes=True,
+                    regex=True):
+        """
+        Get the compiled form of a list of permissions, compiling it if it
+        isn't cached.
+
+        Matchers are cached by the permissions they contain, so they never
+        go stale - lists that aren't used any more just fall out of the
+        cache.
+
+        Takes the same arguments as `compare_permissions`, without *perm*.
+
+        :return: The compiled permissions
+        :rtype: PermissionMatcher
+        """
+
+        if not isinstance(permissions, frozenset):
+            permissions = frozenset(permissions)
+
+        key = (permissions, wildcard, deny_nodes, regex)
+        matcher = self.matchers.get(key)
+
+        if matcher is None:
+            matcher = self.compile_permissions(permissions, wildcard,
+                                               deny_nodes, regex)
+            self.matchers.set(key, matcher)
+
+        return matcher
+
     def compare_permissions(self, perm, permissions, wildcard=True,
                             deny_nodes=True, regex=True):
         """
@@ -733,6 +872,8 @@ class permissionsHandler(object):
         permission.
 
         This is used a lot internally, but you may find it useful as well.
+        The compiled permissions are cached, so comparing against the same
+        permissions again is cheap.
 
         :param perm: The permissions to attempt to match
         :param permissions: A list of permission to match,
@@ -750,47 +891,6 @@ class permissionsHandler(object):
         :return: Whether the permission has been matched or not
         :rtype: bool
         """
-        perm = perm.lower()
-
-        grant = []
-        deny = []
-        for element in permissions:
-            if element.startswith("^"):
-                deny.append(element[1:])
-            else:
-                grant.append(element)
-
-        if deny_nodes:
-            for element in deny:
-                result = False
-
-                if regex:
-                    result = self.pattern.match(element)
-
-                    if result:
-                        pattern, flags = result.groups()
-                        if re.match(pattern, perm, s2rf(flags)):
-                            return False
-                if not result:
-                    if wildcard and fnmatch.fnmatch(perm, element.lower()):
-                        return False
-                    elif (not wildcard) and perm == element.lower():
-                        return False
-
-        for element in grant:
-            result = False
 
-            if regex:
-                result = self.pattern.match(element)
-
-                if result:
-                    pattern, flags = result.groups()
-                    if re.match(pattern, perm, s2rf(flags)):
-                        return True
-            if not result:
-                if wildcard and fnmatch.fnmatch(perm, element.lower()):
-                    return True
-                elif (not wildcard) and perm == element.lower():
-                    return True
-
-        return False
+        return self.get_matcher(permissions, wildcard, deny_nodes,
+                                regex).matches(perm)
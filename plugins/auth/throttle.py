@@ -0,0 +1,145 @@
+"""
+Throttling for login and register attempts.
+
+Every attempt takes a token from a bucket for the host it came from, and
+login attempts take one from a bucket for the username being tried as well.
+When either bucket is empty, the attempt is refused before any passwords
+are hashed.
+
+Only the host is used, as idents and nicknames are chosen by the client and
+can be changed with every reconnect. On protocols that don't tell us users'
+hosts, there's no host limit at all - only the username limit applies.
+
+Buckets refill slowly over time, and are thrown away once they're full
+again, so only recent attempts take up any memory.
+"""
+
+__author__ = 'Gareth Coles'
+
+from system.decorators.ratelimit import TokenBucketTable
+
+
+def get_hostmask(user, protocol):
+    """
+    Get a key identifying the host a user is connecting from, for the host
+    limit.
+
+    :param user: The user
+    :param protocol: The protocol the user is on
+
+    :type user: User
+    :type protocol: Protocol
+
+    :return: The key, or None if we don't know the user's host (in which
+        case only the username limit applies)
+    :rtype: str, None
+    """
+
+    host = getattr(user, "host", None)
+
+    if not host:
+        return None
+
+    return "%s/%s" % (getattr(protocol, "name", protocol), host.lower())
+
+
+class LoginThrottle(object):
+    """
+    Token buckets for login attempts, per username and per hostmask.
+
+    :param config: The "throttle" section of the auth plugin's config
+    :param clock: Something with a seconds() method, like the reactor
+
+    :type config: dict
+    """
+
+    #: Default settings, used for anything missing from the config
+    defaults = {
+        "username": {"attempts": 5, "per": 300},
+        "hostmask": {"attempts": 10, "per": 300},
+        "max-entries": 10000,
+        "sweep-interval": 60
+    }
+
+    def __init__(self, config=None, clock=None):
+        config = config or {}
+
+        def setting(name, key=None):
+            value = config.get(name, None) or {}
+
+            if key is None:
+                return value or self.defaults[name]
+            return value.get(key, self.defaults[name][key])
+
+        max_entries = setting("max-entries")
+
+        self.sweep_interval = setting("sweep-interval")
+
+        self.usernames = self._make_table(setting("username", "attempts"),
+                                          setting("username", "per"),
+                                          max_entries, clock)
+        self.hostmasks = self._make_table(setting("hostmask", "attempts"),
+                                          setting("hostmask", "per"),
+                                          max_entries, clock)
+
+    @staticmethod
+    def _make_table(attempts, per, max_entries, clock):
+        return TokenBucketTable(attempts, attempts / float(per), max_entries,
+                                clock)
+
+    def __len__(self):
+        return len(self.usernames) + len(self.hostmasks)
+
+    def start(self):
+        """
+        Start sweeping full buckets periodically.
+        """
+
+        self.usernames.start(self.sweep_interval)
+        self.hostmasks.start(self.sweep_interval)
+
+    def stop(self):
+        """
+        Stop sweeping full buckets.
+        """
+
+        self.usernames.stop()
+        self.hostmasks.stop()
+
+    def attempt(self, hostmask, username=None):
+        """
+        Record an attempt, checking whether it's allowed.
+
+        The hostmask is checked first, so someone that's being throttled
+        can't use up the tokens for a username that isn't theirs.
+
+        :param hostmask: Where the attempt came from, from `get_hostmask`,
+            or None to only apply the username limit
+        :param username: The username being tried, or None if the attempt
+            isn't for an existing account
+
+        :type hostmask: str, None
+        :type username: str, None
+
+        :return: Whether the attempt is allowed
+        :rtype: bool
+        """
+
+        if hostmask is not None and not self.hostmasks.consume(hostmask):
+            return False
+
+        if username is not None:
+            return self.usernames.consume(username.lower())
+
+        return True
+
+    def succeeded(self, username):
+        """
+        Forget about failed attempts for a username, once someone's managed
+        to log in to it.
+
+        :param username: The username that was logged in to
+        :type username: str
+        """
+
+        self.usernames.reset(username.lower())
@@ -23,6 +23,8 @@ from system.events.mumble import UserJoined, UserMoved, UserRemove
 
 import system.plugin as plugin
 
+from plugins.bridge.rules import RoutingTable
+
 from system.protocols.generic.channel import Channel
 from system.protocols.generic.user import User
 
@@ -43,6 +45,7 @@ class BridgePlugin(plugin.PluginObject):
     events = None
     commands = None
     storage = None
+    routes = None
 
     rules = {}
 
@@ -79,6 +82,10 @@ class BridgePlugin(plugin.PluginObject):
         self.commands = CommandManager()
         self.events = EventManager()
 
+        self.routes = RoutingTable()
+        self.compile_rules()
+        self.config.add_callback(self.compile_rules)
+
         # General
 
         self.events.add_callback("PreMessageReceived", self, self.handle_msg,
@@ -124,6 +131,20 @@ class BridgePlugin(plugin.PluginObject):
         self.events.add_callback("Mumble/UserMoved", self,
                                  self.handle_mumble_move, 1000)
 
+    def compile_rules(self):
+        """
+        Compile the bridging rules into a routing table. This is done
+        whenever the configuration is loaded.
+        """
+
+        errors = self.routes.compile(self.rules or {})
+
+        for name, error in errors:
+            self.logger.error(_("Invalid bridging rule '%s': %s")
+                              % (name, error))
+
+        self.logger.debug(_("Compiled %s bridging rules.") % len(self.routes))
+
     def handle_irc_join(self, event=UserJoinedEvent):
         """
         Event handler for IRC join events
@@ -253,7 +274,8 @@ class BridgePlugin(plugin.PluginObject):
         :param source: Protocol the message relates to
         :param target: User or Channel the message was sent to
         :param from_user: Whether to relay from a PM
-        :param to_user: Whether to relay to a PM
+        :param to_user: Whether to relay to a PM - that is, with rules that
+            have a target-type of "user"
         :param f_str: Definition of the formatting string to use. For example,
             ["general", "action"] or ["irc", "quit"]
         :param tokens: Dict of extra tokens to replace
@@ -283,97 +305,63 @@ class BridgePlugin(plugin.PluginObject):
 
         c_name = caller.name.lower()  # Protocol
         s_name = source.nickname  # User
-        if isinstance(target, Channel):
+
+        if isinstance(target, User):
+            # We ignore the source name since there can only ever be one
+            #     user: us.
+            if not from_user:
+                self.logger.trace(_("Function was called with relaying "
+                                    "from users disabled."))
+                return
+
+            t_name = target.nickname
+            rules = self.routes.match(c_name, "user")
+        elif isinstance(target, Channel):
             t_name = target.name  # Channel
+            rules = self.routes.match(c_name, "channel", t_name.lower())
         else:
-            t_name = target.nickname
-
-        for rule, data in self.rules.items():
-            self.logger.debug(_("Checking rule: %s - %s") % (rule, data))
-            from_ = data["from"]
-            to_ = data["to"]
+            self.logger.trace(_("Target isn't a known type."))
+            return
 
-            if c_name != from_["protocol"].lower():
-                self.logger.trace(_("Protocol doesn't match."))
+        for rule in rules:
+            if rule.target_type == "user" and not to_user:
+                self.logger.trace(_("Function was called with relaying to "
+                                    "users disabled."))
                 continue
 
-            if not self.factory_manager.get_protocol(to_["protocol"]):
-                self.logger.trace(_("Target protocol doesn't exist."))
-                continue
+            template = rule.get_template(f_str)
 
-            if isinstance(target, User):
-                # We ignore the source name since there can only ever be one
-                #     user: us.
-                if not from_user:
-                    self.logger.trace(_("Function was called with relaying "
-                                        "from users disabled."))
-                    continue
-                if from_["source-type"].lower() != "user":
-                    self.logger.trace(_("Target type isn't a user."))
-                    continue
-            elif isinstance(target, Channel):
-                if from_["source-type"].lower() != "channel":
-                    self.logger.trace(_("Target type isn't a Channel."))
-                    continue
-                if from_["source"].lower() != "*" \
-                   and from_["source"].lower() != t_name.lower():
-                    self.logger.trace(_("Target name doesn't match the "
-                                        "source."))
-                    continue
-            else:
-                self.logger.trace(_("Target isn't a known type."))
+            if template is None:
+                self.logger.trace(_("Not relaying message as the format "
+                                    "string was empty or missing."))
                 continue
 
-            if to_["target"] == "user" and not to_user:
-                self.logger.trace(_("Function was called with relaying to "
-                                    "users disabled."))
+            prot = self.factory_manager.get_protocol(rule.to_protocol)
+
+            if not prot:
+                self.logger.trace(_("Target protocol doesn't exist."))
                 continue
 
             # If we get this far, we've matched the incoming rule.
 
-            format_string = None
+            values = {
+                "USER": s_name,
+                "TARGET": t_name,
+                "PROTOCOL": caller.name
+            }
+            values.update(tokens)
 
-            formatting = data["formatting"]
-            if f_str[0] in formatting:
-                if f_str[1] in formatting[f_str[0]]:
-                    format_string = formatting[f_str[0]][f_str[1]]
+            if rule.obfuscate_source:
+                _u = values["USER"]
+                values["USER"] = _u[:-1] + "_" + _u[-1]
 
-            if not format_string:
-                self.logger.trace(_("Not relaying message as the format "
-                                    "string was empty or missing."))
-                continue
+            if rule.obfuscate_target:
+                _u = values["TARGET"]
+                values["TARGET"] = _u[:-1] + "_" + _u[-1]
+
+            # Fill in the template once, then drop each line into it
+            chunks = template.split(values)
+            lines = [line.join(chunks) for line in msg.strip("\r").split("\n")]
 
-            else:
-                sf_name = s_name
-                tf_name = t_name
-                if from_.get("obfuscate-names", False):
-                    sf_name = s_name[:-1] + "_" + s_name[-1]
-                    if "USER" in tokens:
-                        _u = tokens["USER"]
-                        tokens["USER"] = _u[:-1] + "_" + _u[-1]
-
-                if to_.get("obfuscate-names", False):
-                    tf_name = t_name[:-1] + "_" + t_name[-1]
-                    if "TARGET" in tokens:
-                        _u = tokens["TARGET"]
-                        tokens["TARGET"] = _u[:-1] + "_" + _u[-1]
-
-                if "disconnected" in format_string:
-                    pass
-
-                for line in msg.strip("\r").split("\n"):
-                    format_string = formatting[f_str[0]][f_str[1]]
-
-                    for k, v in tokens.items():
-                        format_string = format_string.replace("{%s}" % k, v)
-
-                    format_string = format_string.replace("{MESSAGE}", line)
-                    format_string = format_string.replace("{USER}", sf_name)
-                    format_string = format_string.replace("{TARGET}", tf_name)
-                    format_string = format_string.replace("{PROTOCOL}",
-                                                          caller.name)
-
-                    prot = self.factory_manager.get_protocol(to_["protocol"])
-                    prot.send_msg(to_["target"], format_string,
-                                  target_type=to_["target-type"],
-                                  use_event=use_event)
+            prot.send_msgs(rule.target, lines, target_type=rule.target_type,
+                           use_event=use_event)
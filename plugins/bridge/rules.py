@@ -0,0 +1,270 @@
+# coding=utf-8
+
+"""
+Compiled bridge rules.
+
+Rules are compiled into a routing table when the configuration is loaded,
+so relaying a message only has to look at the rules that match where it
+came from, instead of checking every rule. Their format strings are parsed
+into templates the first time they're used.
+"""
+
+__author__ = "Gareth Coles"
+
+import re
+
+from system.translations import Translations
+_ = Translations().get()
+
+WILDCARD = "*"
+
+TOKEN = re.compile(r"\{([^{}]+)\}")
+
+
+class Template(object):
+    """
+    A format string, parsed into literal text and {TOKENS}.
+
+    Tokens are filled in from a dict of values in a single pass, so a value
+    that happens to contain something that looks like a token is left
+    alone. Tokens that aren't given a value are left as they are.
+    """
+
+    def __init__(self, format_string):
+        self.format_string = format_string
+        self.parts = []  # Literal text, and tokens as they were written
+        self.tokens = {}  # {index in parts: token name}
+
+        pos = 0
+
+        for match in TOKEN.finditer(format_string):
+            if match.start() > pos:
+                self.parts.append(format_string[pos:match.start()])
+
+            self.tokens[len(self.parts)] = match.group(1)
+            self.parts.append(match.group(0))
+            pos = match.end()
+
+        if pos < len(format_string):
+            self.parts.append(format_string[pos:])
+
+    def split(self, values, token="MESSAGE"):
+        """
+        Fill in every token except one, returning the text around it.
+
+        This is for rendering lots of lines with the same values - join
+        the chunks with each line, and the template only has to be filled
+        in once. ::
+
+            chunks = template.split({"USER": "gdude"})
+            lines = [line.join(chunks) for line in message.split("\\n")]
+
+        :param values: Dict of token names to values
+        :param token: The token to split on - if it's in *values*, it's
+            filled in like any other token
+        :type values: dict
+        :type token: str
+
+        :return: A list of chunks, one more than the number of times the
+            token appears
+        :rtype: list
+        """
+
+        chunks = []
+        current = []
+
+        for index, part in enumerate(self.parts):
+            name = self.tokens.get(index, None)
+
+            if name is None:
+                current.append(part)
+            elif name in values:
+                current.append(values[name])
+            elif name == token:
+                chunks.append("".join(current))
+                current = []
+            else:
+                current.append(part)
+
+        chunks.append("".join(current))
+        return chunks
+
+    def render(self, values):
+        """
+        Fill in the template.
+
+        :param values: Dict of token names to values
+        :type values: dict
+
+        :rtype: str
+        """
+
+        return "".join(self.split(values, None))
+
+    def __repr__(self):
+        return "<Bridge template: %r>" % self.format_string
+
+
+class Rule(object):
+    """
+    A single bridge rule, with its configuration normalized for matching.
+    """
+
+    def __init__(self, name, data, index=0):
+        from_ = data["from"]
+        to_ = data["to"]
+
+        self.name = name
+        self.data = data
+        self.index = index  # Keeps rules in a stable order
+
+        self.from_protocol = from_["protocol"].lower()
+        self.source_type = from_["source-type"].lower()
+        self.obfuscate_source = from_.get("obfuscate-names", False)
+
+        if self.source_type == "user":
+            # There can only ever be one user - us
+            self.source = WILDCARD
+        else:
+            self.source = from_.get("source", WILDCARD).lower()
+
+        self.to_protocol = to_["protocol"]
+        self.target = to_["target"]
+        self.target_type = to_["target-type"]
+        self.obfuscate_target = to_.get("obfuscate-names", False)
+
+        self.formatting = data.get("formatting", None) or {}
+        self.templates = {}  # {(section, name): Template or None}
+
+    def get_template(self, f_str):
+        """
+        Get the template for a type of message, if there is one.
+
+        :param f_str: Definition of the format string, for example
+            ["general", "action"]
+        :type f_str: list
+
+        :return: The template, or None if the format string is empty or
+            missing
+        :rtype: Template
+        """
+
+        key = tuple(f_str)
+
+        try:
+            return self.templates[key]
+        except KeyError:
+            pass
+
+        section = self.formatting.get(f_str[0], None)
+        format_string = None
+
+        if section:
+            format_string = section.get(f_str[1], None)
+
+        template = Template(format_string) if format_string else None
+        self.templates[key] = template
+        return template
+
+    def __repr__(self):
+        return "<Bridge rule %s: %s/%s/%s -> %s/%s>" % (
+            self.name, self.from_protocol, self.source_type, self.source,
+            self.to_protocol, self.target
+        )
+
+
+class RoutingTable(object):
+    """
+    Index of compiled rules, keyed by (protocol, source type, source).
+
+    Rules with a wildcard source, and rules for private messages (where
+    the source is ignored), live in a wildcard bucket that's merged with
+    the named source's rules when they're looked up.
+    """
+
+    def __init__(self, rules=None):
+        self.rules = []
+        self._routes = {}  # {(protocol, type): {source: [rules]}}
+        self._cache = {}  # {(protocol, type, source): [rules]}
+
+        if rules:
+            self.compile(rules)
+
+    def __len__(self):
+        return len(self.rules)
+
+    def compile(self, rules):
+        """
+        Compile a set of rules from the configuration, replacing the
+        current ones.
+
+        :param rules: Dict of rule names to rule definitions
+        :type rules: dict
+
+        :return: A list of (name, error) for rules that couldn't be compiled
+        :rtype: list
+        """
+
+        compiled = []
+        errors = []
+
+        for index, name in enumerate(sorted(rules.iterkeys())):
+            try:
+                compiled.append(Rule(name, rules[name], index))
+            except (KeyError, AttributeError, TypeError) as e:
+                errors.append((name, e))
+
+        routes = {}
+
+        for rule in compiled:
+            sources = routes.setdefault((rule.from_protocol,
+                                         rule.source_type), {})
+            sources.setdefault(rule.source, []).append(rule)
+
+        self.rules = compiled
+        self._routes = routes
+        self._cache = {}
+
+        return errors
+
+    def match(self, protocol, source_type, source=WILDCARD):
+        """
+        Get the rules that apply to messages from somewhere.
+
+        :param protocol: The name of the protocol, lowercased
+        :param source_type: "user" or "channel"
+        :param source: The name of the channel, lowercased - this is
+            ignored for users
+
+        :return: A list of matching rules, in order
+        :rtype: list
+        """
+
+        if source_type == "user":
+            source = WILDCARD
+
+        key = (protocol, source_type, source)
+
+        try:
+            return self._cache[key]
+        except KeyError:
+            pass
+
+        sources = self._routes.get((protocol, source_type), None)
+
+        if not sources:
+            matched = []
+        elif source == WILDCARD:
+            matched = list(sources.get(WILDCARD, []))
+        else:
+            matched = sorted(
+                sources.get(source, []) + sources.get(WILDCARD, []),
+                key=lambda r: r.index
+            )
+
+        if sources:
+            # Only cache lookups for protocols we have rules for, so
+            # unrelated traffic can't grow the cache
+            self._cache[key] = matched
+
+        return matched
@@ -50,7 +50,8 @@ class DebugPlugin(plugin.PluginObject):
         self.reload()
 
         self.commands.register_command("debug", self.debug_cmd,
-                                       self, "debug.debug", aliases=["dbg"])
+                                       self, "debug.debug", aliases=["dbg"],
+                                       parse_args=False)
 
     def output(self, message):
         """
@@ -56,13 +56,15 @@ class DialectizerPlugin(plugin.PluginObject):
         self.storage = StorageManager()
 
         self.data = self.storage.get_file(self, "data", YAML,
-                                          "plugins/dialectizer/settings.yml")
+                                          "plugins/dialectizer/settings.yml",
+                                          save_delay=5)
 
         self.events.add_callback("MessageSent", self, self.handle_msg_sent,
                                  1)
         self.commands.register_command("dialectizer", self.dialectizer_command,
                                        self, "dialectizer.set",
-                                       aliases=["dialectiser"])
+                                       aliases=["dialectiser"],
+                                       parse_args=False)
 
     def handle_msg_sent(self, event=MessageSent):
         """Handler for general message sent event"""
@@ -14,6 +14,9 @@ from system.storage.manager import StorageManager
 
 from utils import tokens
 
+from .cache import FactoidCache
+from .migrations import migrate, normalize_key
+
 # Hah, eat it, line length limit.
 from .events import FactoidAddedEvent, FactoidDeletedEvent, FactoidUpdatedEvent
 
@@ -52,6 +55,8 @@ class FactoidsPlugin(plugin.PluginObject):
         self.storage = StorageManager()
         self.plugman = PluginManager()
 
+        self.cache = FactoidCache()
+
         # ## Set up database
         self.database = self.storage.get_file(
             self,
@@ -71,20 +76,24 @@ class FactoidsPlugin(plugin.PluginObject):
         self.commands.register_command("addfactoid",
                                        self.factoid_add_command,
                                        self,
-                                       None)
+                                       None,
+                                       parse_args=False)
         self.commands.register_command("setfactoid",
                                        self.factoid_set_command,
                                        self,
-                                       None)
+                                       None,
+                                       parse_args=False)
         self.commands.register_command("deletefactoid",
                                        self.factoid_delete_command,
                                        self,
                                        None,
-                                       ["delfactoid"])
+                                       ["delfactoid"],
+                                       parse_args=False)
         self.commands.register_command("getfactoid",
                                        self.factoid_get_command,
                                        self,
-                                       None, default=True)
+                                       None, default=True,
+                                       parse_args=False)
 
         # ## Register events
         self.events.add_callback("MessageReceived",
@@ -99,15 +108,40 @@ class FactoidsPlugin(plugin.PluginObject):
 
     def reload(self):
         with self.database as db:
-            db.runQuery("CREATE TABLE IF NOT EXISTS factoids ("
-                        "factoid_key TEXT, "
-                        "location TEXT, "
-                        "protocol TEXT, "
-                        "channel TEXT, "
-                        "factoid_name TEXT, "
-                        "info TEXT, "
-                        "UNIQUE(factoid_key, location, protocol, channel) "
-                        "ON CONFLICT REPLACE)")
+            d = db.runInteraction(migrate, self.logger)
+
+        d.addCallbacks(lambda _: self.warm_cache(), self._migrate_failure)
+
+    def _migrate_failure(self, failure):
+        self.logger.error(_("Unable to migrate factoids database: %s")
+                          % failure)
+
+    def warm_cache(self):
+        """
+        Load every factoid into the cache. Until this is done, lookups go
+        to the database.
+        """
+
+        self.cache.clear()
+        generation = self.cache.generation
+
+        with self.database as db:
+            d = db.runInteraction(self._get_all_factoids_interaction, True)
+
+        d.addCallbacks(self._warm_cache_success, self._warm_cache_failure,
+                       callbackArgs=(generation,))
+        return d
+
+    def _warm_cache_success(self, rows, generation):
+        if self.cache.load(rows, generation):
+            self.logger.debug(_("Cached %s factoids.") % len(self.cache))
+        else:
+            # Something was written while we were loading, so start again
+            self.logger.trace(_("Factoids changed while caching, retrying."))
+            return self.warm_cache()
+
+    def _warm_cache_failure(self, failure):
+        self.logger.error(_("Unable to cache factoids: %s") % failure)
 
     # region Util functions
 
@@ -250,31 +284,39 @@ class FactoidsPlugin(plugin.PluginObject):
                           protocol,
                           channel)
         if location is None:
-            self.logger.trace(_("Location is None - getting all factoids with "
-                                "key '%s'"), factoid_key)
+            # Channel factoids first, then protocol, then global - each part
+            # is an index search, and we take the best match by priority
             txn.execute("SELECT location, protocol, channel, factoid_name, "
-                        "info FROM factoids WHERE factoid_key = ?",
+                        "info FROM ("
+                        "SELECT * FROM (SELECT 0 AS priority, location, "
+                        "protocol, channel, factoid_name, info FROM factoids "
+                        "WHERE factoid_key = ? AND location = ? AND "
+                        "protocol = ? AND channel = ?) "
+                        "UNION ALL SELECT * FROM (SELECT 1 AS priority, "
+                        "location, protocol, channel, factoid_name, info "
+                        "FROM factoids WHERE factoid_key = ? AND "
+                        "location = ? AND protocol = ? "
+                        "ORDER BY channel LIMIT 1) "
+                        "UNION ALL SELECT * FROM (SELECT 2 AS priority, "
+                        "location, protocol, channel, factoid_name, info "
+                        "FROM factoids WHERE factoid_key = ? AND "
+                        "location = ? ORDER BY protocol, channel LIMIT 1)"
+                        ") ORDER BY priority LIMIT 1",
                         (
                             to_unicode(factoid_key),
+                            self.CHANNEL,
+                            to_unicode(protocol),
+                            to_unicode(channel),
+                            to_unicode(factoid_key),
+                            self.PROTOCOL,
+                            to_unicode(protocol),
+                            to_unicode(factoid_key),
+                            self.GLOBAL
                         ))
-            results = txn.fetchall()
-            if len(results) > 0:
-                # Check for channel match
-                for row in results:
-                    if ((row[0] == self.CHANNEL and row[1] == protocol and
-                         row[2] == channel)):
-                        self.logger.trace(_("Match found (channel)!"))
-                        return (row[3], row[4].split("\n"))
-                # Check for protocol match
-                for row in results:
-                    if row[0] == self.PROTOCOL and row[1] == protocol:
-                        self.logger.trace(_("Match found (protocol)!"))
-                        return (row[3], row[4].split("\n"))
-                # Check for global match
-                for row in results:
-                    if row[0] == self.GLOBAL:
-                        self.logger.trace(_("Match found (global)!"))
-                        return (row[3], row[4].split("\n"))
+            row = txn.fetchone()
+            if row is not None:
+                self.logger.trace(_("Match found (%s)!"), row[0])
+                return (row[3], row[4].split("\n"))
         else:
             txn.execute("SELECT location, protocol, channel, factoid_name, "
                         "info FROM factoids WHERE factoid_key = ? AND "
@@ -291,14 +333,19 @@ class FactoidsPlugin(plugin.PluginObject):
         raise MissingFactoidError(_("Factoid '%s' does not exist")
                                   % factoid_key)
 
-    def _get_all_factoids_interaction(self, txn):
+    def _get_all_factoids_interaction(self, txn, keys=False):
         """
         Gets all factoids
-        :return: (factoid_name, [entry, entry, ...])
+        :param keys: Whether to include the factoid_key column first
+        :return: [(location, protocol, channel, factoid_name, info), ...]
         """
         self.logger.trace("Getting all factoids.")
-        txn.execute("SELECT location, protocol, channel, factoid_name, "
-                    "info FROM factoids")
+        if keys:
+            txn.execute("SELECT factoid_key, location, protocol, channel, "
+                        "factoid_name, info FROM factoids")
+        else:
+            txn.execute("SELECT location, protocol, channel, factoid_name, "
+                        "info FROM factoids")
         results = txn.fetchall()
         return results
 
@@ -308,7 +355,7 @@ class FactoidsPlugin(plugin.PluginObject):
 
     def add_factoid(self, caller, source, protocol, location, factoid, info):
         location = location.lower()
-        factoid_key = factoid.lower()
+        factoid_key = normalize_key(factoid)
         protocol_key = protocol.name.lower()
         channel_key = source.name.lower()
         try:
@@ -323,17 +370,21 @@ class FactoidsPlugin(plugin.PluginObject):
                 NoPermissionError(_("User does not have required permission"))
             )
         with self.database as db:
-            return db.runInteraction(self._add_factoid_interaction,
-                                     factoid_key,
-                                     location,
-                                     protocol_key,
-                                     channel_key,
-                                     factoid,
-                                     info)
+            d = db.runInteraction(self._add_factoid_interaction,
+                                  factoid_key,
+                                  location,
+                                  protocol_key,
+                                  channel_key,
+                                  factoid,
+                                  info)
+
+        d.addCallback(self._cache_write, self.cache.append, factoid_key,
+                      location, protocol_key, channel_key, factoid, info)
+        return d
 
     def set_factoid(self, caller, source, protocol, location, factoid, info):
         location = location.lower()
-        factoid_key = factoid.lower()
+        factoid_key = normalize_key(factoid)
         protocol_key = protocol.name.lower()
         channel_key = source.name.lower()
         try:
@@ -348,7 +399,7 @@ class FactoidsPlugin(plugin.PluginObject):
                 NoPermissionError(_("User does not have required permission"))
             )
         with self.database as db:
-            return db.runQuery(
+            d = db.runQuery(
                 "INSERT INTO factoids VALUES(?, ?, ?, ?, ?, ?)",
                 (
                     to_unicode(factoid_key),
@@ -359,9 +410,13 @@ class FactoidsPlugin(plugin.PluginObject):
                     to_unicode(info)
                 ))
 
+        d.addCallback(self._cache_write, self.cache.set, factoid_key,
+                      location, protocol_key, channel_key, factoid, info)
+        return d
+
     def delete_factoid(self, caller, source, protocol, location, factoid):
         location = location.lower()
-        factoid_key = factoid.lower()
+        factoid_key = normalize_key(factoid)
         protocol_key = protocol.name.lower()
         channel_key = source.name.lower()
         try:
@@ -376,16 +431,23 @@ class FactoidsPlugin(plugin.PluginObject):
                 NoPermissionError(_("User does not have required permission"))
             )
         with self.database as db:
-            return db.runInteraction(self._delete_factoid_interaction,
-                                     factoid_key,
-                                     location,
-                                     protocol_key,
-                                     channel_key)
+            d = db.runInteraction(self._delete_factoid_interaction,
+                                  factoid_key,
+                                  location,
+                                  protocol_key,
+                                  channel_key)
+
+        if location != self.CHANNEL:
+            channel_key = None  # Deleted from every channel
+
+        d.addCallback(self._cache_write, self.cache.delete, factoid_key,
+                      location, protocol_key, channel_key)
+        return d
 
     def get_factoid(self, caller, source, protocol, location, factoid):
         if location is not None:
             location = location.lower()
-        factoid_key = factoid.lower()
+        factoid_key = normalize_key(factoid)
         protocol_key = protocol.name.lower()
         channel_key = source.name.lower()
         try:
@@ -399,6 +461,21 @@ class FactoidsPlugin(plugin.PluginObject):
             return defer.fail(
                 NoPermissionError(_("User does not have required permission"))
             )
+        if self.cache.loaded:
+            if location is None:
+                result = self.cache.resolve(factoid_key, protocol_key,
+                                            channel_key)
+            else:
+                result = self.cache.get(factoid_key, location, protocol_key,
+                                        channel_key)
+
+            if result is None:
+                return defer.fail(MissingFactoidError(
+                    _("Factoid '%s' does not exist") % factoid_key
+                ))
+
+            return defer.succeed((result[0], result[1].split("\n")))
+
         with self.database as db:
             return db.runInteraction(self._get_factoid_interaction,
                                      factoid_key,
@@ -406,6 +483,13 @@ class FactoidsPlugin(plugin.PluginObject):
                                      protocol_key,
                                      channel_key)
 
+    def _cache_write(self, result, func, *args):
+        """
+        Apply a write to the cache, once it's made it to the database.
+        """
+        func(*args)
+        return result
+
     # endregion
 
     # region Command handlers for interacting with factoids
@@ -0,0 +1,190 @@
+"""
+In-memory index of factoids.
+
+Every factoid row is kept here, keyed by (key, location, protocol, channel),
+along with a couple of secondary indexes so that a lookup can be resolved to
+the channel, protocol or global factoid with dictionary lookups, instead of
+a trip to the database.
+
+Where there's more than one candidate (for example, global factoids set
+from different channels), ties are broken the same way as the database
+query - by protocol, then by channel.
+"""
+
+__author__ = 'Gareth Coles'
+
+from kitchen.text.converters import to_unicode
+
+CHANNEL = "channel"
+PROTOCOL = "protocol"
+GLOBAL = "global"
+
+
+class FactoidCache(object):
+    """
+    Index of factoids, keyed by (key, location, protocol, channel).
+
+    The cache isn't used for lookups until it's been loaded. Writes that
+    happen while it's being loaded bump the generation, so that a load that
+    started before them can be thrown away instead of clobbering them.
+    """
+
+    loaded = False
+    generation = 0
+
+    def __init__(self):
+        self._rows = {}  # {(key, loc, proto, chan): (name, info)}
+        self._groups = {}  # {(key, loc, proto): set of row keys}
+        self._global = {}  # {key: set of row keys}
+
+    def __len__(self):
+        return len(self._rows)
+
+    def clear(self):
+        """
+        Empty the cache, and stop using it for lookups until it's loaded
+        again.
+        """
+
+        self._rows.clear()
+        self._groups.clear()
+        self._global.clear()
+
+        self.loaded = False
+        self.generation += 1
+
+    def load(self, rows, generation=None):
+        """
+        Fill the cache with factoid rows, replacing what was there.
+
+        :param rows: Rows of (key, location, protocol, channel, name, info)
+        :param generation: The generation when the rows were fetched - if
+            anything's been written since, the rows are ignored
+
+        :type rows: list
+        :type generation: int
+
+        :return: Whether the rows were loaded
+        :rtype: bool
+        """
+
+        if generation is not None and generation != self.generation:
+            return False
+
+        self._rows.clear()
+        self._groups.clear()
+        self._global.clear()
+
+        for row in rows:
+            self._add(*row)
+
+        self.loaded = True
+        return True
+
+    def _add(self, key, location, protocol, channel, name, info):
+        row_key = (to_unicode(key), to_unicode(location),
+                   to_unicode(protocol), to_unicode(channel))
+
+        self._rows[row_key] = (to_unicode(name), to_unicode(info))
+        self._groups.setdefault(row_key[:3], set()).add(row_key)
+
+        if row_key[1] == GLOBAL:
+            self._global.setdefault(row_key[0], set()).add(row_key)
+
+    def _remove(self, row_key):
+        if self._rows.pop(row_key, None) is None:
+            return False
+
+        group = row_key[:3]
+
+        self._groups[group].discard(row_key)
+
+        if not self._groups[group]:
+            del self._groups[group]
+
+        if row_key[1] == GLOBAL:
+            self._global[row_key[0]].discard(row_key)
+
+            if not self._global[row_key[0]]:
+                del self._global[row_key[0]]
+
+        return True
+
+    def set(self, key, location, protocol, channel, name, info):
+        """
+        Add or replace a factoid.
+        """
+
+        self.generation += 1
+        self._add(key, location, protocol, channel, name, info)
+
+    def append(self, key, location, protocol, channel, name, info):
+        """
+        Add a line to a factoid, creating it if it doesn't exist.
+        """
+
+        current = self.get(key, location, protocol, channel)
+
+        if current is not None:
+            name = current[0]
+            info = current[1] + u"\n" + to_unicode(info)
+
+        self.set(key, location, protocol, channel, name, info)
+
+    def delete(self, key, location, protocol, channel=None):
+        """
+        Remove a factoid. If no channel is given, the factoid is removed
+        for every channel, as the database does for protocol and global
+        factoids.
+
+        :return: How many rows were removed
+        :rtype: int
+        """
+
+        self.generation += 1
+        group = (to_unicode(key), to_unicode(location), to_unicode(protocol))
+
+        if channel is not None:
+            return int(self._remove(group + (to_unicode(channel),)))
+
+        removed = 0
+
+        for row_key in list(self._groups.get(group, ())):
+            removed += self._remove(row_key)
+
+        return removed
+
+    def get(self, key, location, protocol, channel):
+        """
+        Get a factoid from a specific location.
+
+        :return: (name, info), or None if it doesn't exist
+        :rtype: tuple
+        """
+
+        return self._rows.get((to_unicode(key), to_unicode(location),
+                               to_unicode(protocol), to_unicode(channel)))
+
+    def resolve(self, key, protocol, channel):
+        """
+        Find the most specific factoid for a key - the channel's factoid if
+        there is one, otherwise the protocol's, otherwise a global one.
+
+        :return: (name, info), or None if there's no such factoid
+        :rtype: tuple
+        """
+
+        key = to_unicode(key)
+        protocol = to_unicode(protocol)
+
+        row = self._rows.get((key, CHANNEL, protocol, to_unicode(channel)))
+
+        if row is not None:
+            return row
+
+        for candidates in (self._groups.get((key, PROTOCOL, protocol)),
+                           self._global.get(key)):
+            if candidates:
+                return self._rows[min(candidates)]
+
+        return None
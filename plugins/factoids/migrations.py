@@ -0,0 +1,140 @@
+"""
+Schema migrations for the factoids database.
+
+The schema version is kept in SQLite's user_version pragma. Each migration
+is a function that takes a cursor and a logger (which may be None), and
+they're run in order, starting from
+the first one the database hasn't had yet. Databases from before migrations
+existed are at version 0, so they start from the beginning - make sure
+every migration can cope with that.
+
+Never change a migration once it's been released - add a new one instead.
+"""
+
+__author__ = 'Gareth Coles'
+
+from kitchen.text.converters import to_unicode
+
+from system.translations import Translations
+_ = Translations().get()
+
+
+def normalize_key(factoid):
+    """
+    Get the key a factoid is stored under - its name, lowercased.
+
+    :param factoid: The factoid's name
+    :type factoid: str, unicode
+
+    :rtype: unicode
+    """
+
+    return to_unicode(factoid).lower()
+
+
+def create_table(txn, logger=None):
+    """
+    Version 1: Create the factoids table.
+
+    The UNIQUE constraint is backed by an index on (factoid_key, location,
+    protocol, channel), which covers every lookup we do.
+    """
+
+    txn.execute("CREATE TABLE IF NOT EXISTS factoids ("
+                "factoid_key TEXT, "
+                "location TEXT, "
+                "protocol TEXT, "
+                "channel TEXT, "
+                "factoid_name TEXT, "
+                "info TEXT, "
+                "UNIQUE(factoid_key, location, protocol, channel) "
+                "ON CONFLICT REPLACE)")
+
+
+def normalize_keys(txn, logger=None):
+    """
+    Version 2: Lowercase non-ASCII characters in factoid keys.
+
+    Keys used to be lowercased as byte strings, which left anything outside
+    of ASCII alone.
+
+    If there's already a factoid under the new key in the same place, the
+    table's ON CONFLICT REPLACE would silently delete it - so those are
+    logged and left alone instead, for someone to sort out by hand.
+    """
+
+    txn.execute("SELECT rowid, factoid_key, location, protocol, channel, "
+                "factoid_name FROM factoids")
+
+    for rowid, key, location, protocol, channel, name in txn.fetchall():
+        normalized = normalize_key(key)
+
+        if normalized == key:
+            continue
+
+        txn.execute("SELECT factoid_name FROM factoids WHERE "
+                    "factoid_key = ? AND location IS ? AND protocol IS ? "
+                    "AND channel IS ?",
+                    (normalized, location, protocol, channel))
+        existing = txn.fetchone()
+
+        if existing is not None:
+            if logger is not None:
+                logger.warn(_("Not renaming factoid '%s' (%s %s %s), it "
+                              "would replace '%s'")
+                            % (name, location, protocol, channel,
+                               existing[0]))
+            continue
+
+        txn.execute("UPDATE factoids SET factoid_key = ? "
+                    "WHERE rowid = ?", (normalized, rowid))
+
+
+def analyze(txn, logger=None):
+    """
+    Version 3: Gather statistics for the query planner.
+    """
+
+    txn.execute("ANALYZE factoids")
+
+
+MIGRATIONS = [create_table, normalize_keys, analyze]
+
+#: The schema version that the plugin expects
+VERSION = len(MIGRATIONS)
+
+
+def get_version(txn):
+    txn.execute("PRAGMA user_version")
+    return txn.fetchone()[0]
+
+
+def migrate(txn, logger=None):
+    """
+    Bring the database up to date, for use with runInteraction.
+
+    :param txn: The cursor to run the migrations with
+    :param logger: A logger to report progress to
+
+    :return: The schema version the database started at
+    :rtype: int
+    """
+
+    version = get_version(txn)
+
+    if version > VERSION:
+        raise RuntimeError(_("Factoids database is at schema version %s, "
+                             "which is newer than this plugin supports (%s)")
+                           % (version, VERSION))
+
+    for number, migration in enumerate(MIGRATIONS[version:], version + 1):
+        if logger is not None:
+            logger.info(_("Migrating factoids database to version %s: %s")
+                        % (number, migration.__name__))
+
+        migration(txn, logger)
+
+        # PRAGMA doesn't support parameters, but this is always an int
+        txn.execute("PRAGMA user_version = %d" % number)
+
+    return version
@@ -11,19 +11,21 @@ __author__ = 'Gareth Coles'
 
 import fnmatch
 import re
-import socket
 import urlparse
 import urllib
 import urllib2
 
-from httplib import IncompleteRead
-
-from bs4 import BeautifulSoup
 from kitchen.text.converters import to_unicode
 from netaddr import all_matching_cidrs
+from twisted.internet import reactor
+from twisted.internet.defer import CancelledError, maybeDeferred
+from twisted.internet.threads import blockingCallFromThread, \
+    deferToThreadPool
+from twisted.names.error import DNSNameError, DomainError
+from twisted.python import threadable
 
 from system.command_manager import CommandManager
-from system.decorators.threads import run_async_threadpool
+from system.decorators.threads import pool
 from system.event_manager import EventManager
 from system.events.general import MessageReceived
 
@@ -35,7 +37,9 @@ from system.protocols.generic.user import User
 from system.storage.formats import YAML, DBAPI
 from system.storage.manager import StorageManager
 
+from .cache import TitleCache
 from .catcher import Catcher
+from .fetcher import TitleFetcher
 
 from system.translations import Translations
 _ = Translations().get()
@@ -47,11 +51,13 @@ class URLsPlugin(plugin.PluginObject):
     URLs plugin object
     """
 
+    cache = None
     catcher = None
     channels = None
     commands = None
     config = None
     events = None
+    fetcher = None
     shortened = None
     storage = None
 
@@ -63,6 +69,15 @@ class URLsPlugin(plugin.PluginObject):
     content_types = ["text/html", "text/webviewhtml", "message/rfc822",
                      "text/x-server-parsed-html", "application/xhtml+xml"]
 
+    private_networks = ["10.0.0.0/8", "0.0.0.0/8", "172.16.0.0/12",
+                        "192.168.0.0/16", "127.0.0.0/8", "::1/128",
+                        "::/128", "::ffff:0:0/96", "fc00::/7", "fe80::/10"]
+
+    redirect_codes = [301, 302, 303, 307, 308]
+
+    user_agent = "Mozilla/5.0 (X11; U; Linux i686; en-US; rv:1.9.0.1) " \
+                 "Gecko/2008071615 Fedora/3.0.1-1.fc9-1.fc9 Firefox/3.0.1"
+
     def setup(self):
         """
         Called when the plugin is loaded. Performs initial setup.
@@ -85,7 +100,8 @@ class URLsPlugin(plugin.PluginObject):
         self.logger.debug(_("Spoofing: %s") % self.spoofing)
 
         self.channels = self.storage.get_file(self, "data", YAML,
-                                              "plugins/urls/channels.yml")
+                                              "plugins/urls/channels.yml",
+                                              save_delay=5, journal=True)
         self.shortened = self.storage.get_file(
             self,
             "data",
@@ -113,10 +129,22 @@ class URLsPlugin(plugin.PluginObject):
         self.events.add_callback("MessageReceived", self, self.message_handler,
                                  1, message_event_filter)
         self.commands.register_command("urls", self.urls_command, self,
-                                       "urls.manage")
+                                       "urls.manage", parse_args=False)
         self.commands.register_command("shorten", self.shorten_command, self,
                                        "urls.shorten", default=True)
 
+    def deactivate(self):
+        """
+        Called when the plugin is unloaded. Closes pooled HTTP connections
+        and writes out any URLs the catcher has buffered.
+        """
+
+        if self.fetcher is not None:
+            self.fetcher.close()
+
+        if self.catcher is not None:
+            self.catcher.stop()
+
     def reload(self):
         """
         Reload files and create tables as necessary
@@ -127,8 +155,42 @@ class URLsPlugin(plugin.PluginObject):
                                 "shortener TEXT, "
                                 "result TEXT)")
 
+        if self.catcher is not None:
+            self.catcher.stop()
+
         self.catcher = Catcher(self, self.config, self.storage, self.logger)
 
+        if self.fetcher is not None:
+            self.fetcher.close()
+
+        fetcher = self.config.get("fetcher", {})
+        self.fetcher = TitleFetcher(
+            timeout=fetcher.get("timeout", 10),
+            max_bytes=fetcher.get("max_bytes", 65536),
+            max_redirects=fetcher.get("max_redirects", 5),
+            connections=fetcher.get("connections", 2)
+        )
+
+        cache = self.config.get("cache", {})
+        db = None
+
+        if cache.get("persist", False):
+            db = self.shortened
+            db.runInteraction(TitleCache.create_interaction).addErrback(
+                lambda f: self.logger.error(
+                    _("Failed to create title cache table: %s")
+                    % f.getErrorMessage()
+                )
+            )
+
+        self.cache = TitleCache(
+            size=cache.get("size", 1000),
+            ttl=cache.get("ttl", 3600),
+            negative_ttl=cache.get("negative_ttl", 300),
+            db=db,
+            logger=self.logger
+        )
+
         self.blacklist = []
         blacklist = self.config.get("blacklist", [])
 
@@ -160,7 +222,6 @@ class URLsPlugin(plugin.PluginObject):
                 return False
         return False
 
-    @run_async_threadpool
     def message_handler(self, event=MessageReceived):
         """
         Event handler for general messages
@@ -217,10 +278,6 @@ class URLsPlugin(plugin.PluginObject):
                     except Exception:
                         self.logger.exception(_("Error catching URL"))
 
-                title, domain = self.parse_title(url)
-
-                self.logger.trace(_("Title: %s") % title)
-
                 if isinstance(target, Channel):
                     if protocol.name not in self.channels:
                         with self.channels:
@@ -242,28 +299,48 @@ class URLsPlugin(plugin.PluginObject):
                         with self.channels:
                             self.channels[protocol.name][target.name]["last"] \
                                 = url
-                    if title is None:
-                        return
-
-                    if domain is not None and "/" in domain:
-                        domain = domain.split("/")[0]
-                    if domain is None:
-                        target.respond(title)
-                    else:
-                        target.respond("\"%s\" at %s" % (title, domain))
-                elif isinstance(target, User):
-                    if title is None:
-                        return
-
-                    if domain is not None and "/" in domain:
-                        domain = domain.split("/")[0]
-                    if domain is None:
-                        source.respond(title)
-                    else:
-                        source.respond("\"%s\" at %s" % (title, domain))
-                else:
+                elif not isinstance(target, User):
                     self.logger.warn(_("Unknown target type: %s [%s]")
                                      % (target, target.__class__))
+                    return
+
+                d = self.parse_title(url)
+                d.addCallbacks(self._respond_title, self._respond_title_fail,
+                               callbackArgs=(source, target))
+
+    def _respond_title(self, result, source, target):
+        """
+        Respond with a parsed title, after a successful Deferred
+        """
+
+        title, domain = result
+
+        self.logger.trace(_("Title: %s") % title)
+
+        if title is None:
+            return
+
+        if domain is not None and "/" in domain:
+            domain = domain.split("/")[0]
+
+        if isinstance(target, Channel):
+            responder = target
+        else:
+            responder = source
+
+        if domain is None:
+            responder.respond(title)
+        else:
+            responder.respond("\"%s\" at %s" % (title, domain))
+
+    def _respond_title_fail(self, failure):
+        """
+        Log a failure to respond with a title, after a failed Deferred
+        """
+
+        self.logger.error(_("Error responding with title: %s")
+                          % failure.getErrorMessage())
+        self.logger.debug(failure.getTraceback())
 
     def urls_command(self, protocol, caller, source, command, raw_args,
                      parsed_args):
@@ -284,11 +361,31 @@ class URLsPlugin(plugin.PluginObject):
                                                  "for the current channel"))
             caller.respond("            %s" % __("Shorteners: %s")
                            % ", ".join(self.shorteners.keys()))
+            caller.respond("            %s" % __("cache <stats/clear> - Show "
+                                                 "or clear the title cache"))
             return
 
         operation = args[0].lower()
         value = args[1].lower()
 
+        if operation == "cache":
+            if value == "stats":
+                stats = self.cache.stats()
+                caller.respond(__("Title cache: %s/%s entries, %s hits (%s "
+                                  "negative), %s misses, %s coalesced, %s in "
+                                  "flight - %.1f%% hit rate")
+                               % (stats["size"], stats["max_size"],
+                                  stats["hits"], stats["negative_hits"],
+                                  stats["misses"], stats["coalesced"],
+                                  stats["in_flight"],
+                                  stats["hit_rate"] * 100))
+            elif value == "clear":
+                self.cache.clear()
+                caller.respond(__("Title cache cleared."))
+            else:
+                caller.respond(__("Usage: {CHARS}urls cache <stats|clear>"))
+            return
+
         if protocol.name not in self.channels:
             with self.channels:
                 self.channels[protocol.name] = {
@@ -419,7 +516,8 @@ class URLsPlugin(plugin.PluginObject):
         Get and return the page title for a URL, or the title from a
         specialized handler, if one is registered.
 
-        This function returns a tuple which may be one of these forms..
+        This returns a Deferred that fires with a tuple, which may be one of
+        these forms..
 
         * (title, None) if the title was fetched by a specialized handler
         * (title, domain) if the title was parsed from the HTML
@@ -428,166 +526,242 @@ class URLsPlugin(plugin.PluginObject):
 
             * When a portscan is detected and stopped
             * When the page simply has no title
+            * When the request timed out
             * When there is an exception in the chain somewhere
 
+        Pages are fetched without blocking the reactor. If you call this
+        from another thread (from a specialized handler, for example), it
+        will wait for the result and return the tuple directly instead.
+
         :param url: The URL to check
         :param use_handler: Whether to use specialized handlers
 
         :type url: str
         :type use_handler: bool
 
-        :returns: A tuple containing the result
-        :rtype: tuple(None, None), tuple(str, str), tuple(str, None)
+        :returns: A Deferred, or a tuple containing the result if called
+            from another thread
+        :rtype: Deferred, tuple(None, None), tuple(str, str),
+            tuple(str, None)
+        """
+
+        if threadable.ioThread is not None and not threadable.isInIOThread():
+            return blockingCallFromThread(reactor, self.parse_title, url,
+                                          use_handler)
+
+        d = self.cache.fetch(url, self._fetch_title, use_handler)
+        d.addCallback(lambda result: result[:2])
+
+        return d
+
+    def _fetch_title(self, url, use_handler):
+        """
+        Fetch the title for a URL that isn't cached.
+
+        This returns a Deferred that fires with a (title, domain, final_url)
+        tuple, with a final_url of None if there was an error.
         """
 
-        domain = ""
         self.logger.trace(_("Url: %s") % url)
-        try:
-            parsed = urlparse.urlparse(url)
-            domain = parsed.hostname
-
-            ip = socket.gethostbyname(domain)
-
-            matches = all_matching_cidrs(ip, ["10.0.0.0/8", "0.0.0.0/8",
-                                              "172.16.0.0/12",
-                                              "192.168.0.0/16", "127.0.0.0/8"])
-
-            if matches:
-                self.logger.warn(_("Prevented a portscan: %s") % url)
-                return None, None
-
-            if domain.startswith("www."):
-                domain = domain[4:]
-
-            if use_handler:
-                for pattern in self.handlers:
-                    if fnmatch.fnmatch(domain, pattern):
-                        try:
-                            result = self.handlers[domain](url)
-                            if result:
-                                return to_unicode(result), None
-                        except Exception:
-                            self.logger.exception(_("Error running handler, "
-                                                    "parsing title normally."))
-
-            self.logger.trace(_("Parsed domain: %s") % domain)
-
-            request = urllib2.Request(url)
-            if domain in self.spoofing:
-                self.logger.debug(_("Custom spoofing for this domain found."))
-                user_agent = self.spoofing[domain]
-                if user_agent:
-                    self.logger.debug(_("Spoofing user-agent: %s")
-                                      % user_agent)
-                    request.add_header("User-agent", user_agent)
-                else:
-                    self.logger.debug(_("Not spoofing user-agent."))
-            else:
-                self.logger.debug(_("Spoofing Firefox as usual."))
-                request.add_header('User-agent', 'Mozilla/5.0 (X11; U; Linux '
-                                                 'i686; en-US; rv:1.9.0.1) '
-                                                 'Gecko/2008071615 Fedora/3.0.'
-                                                 '1-1.fc9-1.fc9 Firefox/3.0.1')
 
-            # Deal with Accept-Language
-            language_value = None
-            language = self.config.get("accept_language", {})
-            language_domains = language.get("domains", {})
-            if domain in language_domains:
-                language_value = language_domains[domain]
-            elif domain.lower() in language_domains:
-                language_value = language_domains[domain.lower()]
-            elif "default" in language:
-                language_value = language["default"]
+        d = maybeDeferred(self._get_title, url, use_handler, 0)
+        d.addErrback(self._parse_title_fail, url)
 
-            if language_value is not None:
-                request.add_header("Accept-Language", language_value)
+        return d
 
-            response = urllib2.urlopen(request)
+    def _parse_title_fail(self, failure, url):
+        """
+        Handle a failure somewhere in the title parsing chain.
+        """
 
-            self.logger.trace(_("Info: %s") % response.info())
+        if failure.check(CancelledError):
+            self.logger.debug(_("Timed out parsing title: %s") % url)
+            return None, None, None
 
-            headers = response.info().headers
-            new_url = response.geturl()
+        if failure.check(DNSNameError, DomainError):
+            self.logger.debug(_("Unable to resolve domain: %s") % url)
+            return None, None, None
 
-            _domain = domain
+        self.logger.error(_("Error parsing title: %s")
+                          % failure.getErrorMessage())
+        self.logger.debug(failure.getTraceback())
 
-            parsed = urlparse.urlparse(new_url)
-            domain = parsed.hostname
+        domain = urlparse.urlparse(url).hostname
+        return failure.getErrorMessage(), to_unicode(domain), None
 
-            if _domain != domain:
-                self.logger.info(_("URL: %s") % new_url)
-                self.logger.info(_("Domain: %s") % domain)
+    def _get_title(self, url, use_handler, redirects):
+        """
+        Resolve a URL's domain, and carry on to fetching the title if it's
+        not on a private network.
+        """
 
-                if self.check_blacklist(new_url):
-                    self.logger.debug(_("Not parsing, URL is blacklisted."))
-                    return
+        domain = urlparse.urlparse(url).hostname
 
-                ip = socket.gethostbyname(domain)
+        if not domain:
+            raise ValueError(_("No domain in URL: %s") % url)
 
-                matches = all_matching_cidrs(ip, ["10.0.0.0/8", "0.0.0.0/8",
-                                                  "172.16.0.0/12",
-                                                  "192.168.0.0/16",
-                                                  "127.0.0.0/8"])
+        d = self.fetcher.resolve(domain)
+        d.addCallback(self._title_resolved, url, domain, use_handler,
+                      redirects)
 
-                if matches:
-                    self.logger.warn(_("Prevented a portscan: %s") % new_url)
-                    return None, None
+        return d
 
-                if domain.startswith("www."):
-                    domain = domain[4:]
+    def _title_resolved(self, ip, url, domain, use_handler, redirects):
+        """
+        Check the resolved IP for a URL, and then get its title with a
+        handler or by requesting the page.
+        """
 
-                if domain in self.handlers and use_handler:
-                    try:
-                        result = self.handlers[domain](new_url)
-                        if result:
-                            return to_unicode(result), None
-                    except Exception:
-                        self.logger.exception(_("Error running handler,"
-                                                " parsing title normally."))
+        if all_matching_cidrs(ip, self.private_networks):
+            self.logger.warn(_("Prevented a portscan: %s") % url)
+            return None, None, None
+
+        if domain.startswith("www."):
+            domain = domain[4:]
 
-            headers_dict = {}
+        self.logger.trace(_("Parsed domain: %s") % domain)
 
-            for x in headers:
-                k, v = x.split(": ", 1)
+        if use_handler:
+            for pattern in self.handlers:
+                if fnmatch.fnmatch(domain, pattern):
+                    # Handlers may block, so they get a thread
+                    d = deferToThreadPool(reactor, pool,
+                                          self.handlers[pattern], url)
+                    d.addCallbacks(self._title_handled,
+                                   self._title_handler_fail,
+                                   callbackArgs=(url, domain, ip, redirects),
+                                   errbackArgs=(url, domain, ip, redirects))
+                    return d
 
-                headers_dict[k.lower()] = v.strip("\r\n")
+        return self._request_title(url, domain, ip, redirects)
 
-            status_code = response.getcode()
+    def _title_handled(self, result, url, domain, ip, redirects):
+        """
+        Use the result of a specialized handler, or request the page if it
+        didn't give us anything.
+        """
 
-            if status_code in [301, 302, 303, 307, 308]:
-                return self.parse_title(headers["location"])
+        if result:
+            return to_unicode(result), None, url
 
-            ct = headers_dict["content-type"]
-            if ";" in ct:
-                ct = ct.split(";")[0]
+        return self._request_title(url, domain, ip, redirects)
 
-            self.logger.trace(_("Content-type: %s") % repr(ct))
+    def _title_handler_fail(self, failure, url, domain, ip, redirects):
+        """
+        Log a failed specialized handler, and request the page instead.
+        """
 
-            if ct not in self.content_types:
-                self.logger.debug(_("Content-type is not allowed."))
-                return None, None
+        self.logger.error(_("Error running handler, parsing title normally: "
+                            "%s") % failure.getErrorMessage())
+        self.logger.debug(failure.getTraceback())
 
-            page = response.read()
-            soup = BeautifulSoup(page)
-            if soup.title and soup.title.string:
-                title = soup.title.string.strip()
-                title = re.sub("\s+", " ", title)
-                title = to_unicode(title)
-                domain = to_unicode(domain)
-                return title, domain
+        return self._request_title(url, domain, ip, redirects)
+
+    def _request_title(self, url, domain, ip, redirects):
+        """
+        Request a page from the IP we checked, with the right headers for
+        its domain.
+        """
+
+        headers = {}
+
+        if domain in self.spoofing:
+            self.logger.debug(_("Custom spoofing for this domain found."))
+            user_agent = self.spoofing[domain]
+            if user_agent:
+                self.logger.debug(_("Spoofing user-agent: %s")
+                                  % user_agent)
+                headers["User-Agent"] = user_agent
             else:
-                return None, None
-        except IncompleteRead as e:
-            partial = e.partial
-            self.logger.exception(_("Error parsing title."))
-            self.logger.debug("Data: {}".format(partial))
-            return str(e), domain
-        except Exception as e:
-            if not str(e).lower() == "not viewing html":
-                self.logger.exception(_("Error parsing title."))
-                return str(e), domain
-            return None, None
+                self.logger.debug(_("Not spoofing user-agent."))
+        else:
+            self.logger.debug(_("Spoofing Firefox as usual."))
+            headers["User-Agent"] = self.user_agent
+
+        # Deal with Accept-Language
+        language_value = None
+        language = self.config.get("accept_language", {})
+        language_domains = language.get("domains", {})
+        if domain in language_domains:
+            language_value = language_domains[domain]
+        elif domain.lower() in language_domains:
+            language_value = language_domains[domain.lower()]
+        elif "default" in language:
+            language_value = language["default"]
+
+        if language_value is not None:
+            headers["Accept-Language"] = language_value
+
+        d = self.fetcher.request(url, ip, headers)
+        d.addCallback(self._title_response, url, domain, redirects)
+
+        return d
+
+    def _title_response(self, response, url, domain, redirects):
+        """
+        Deal with a page response - follow it if it's a redirect, otherwise
+        read and parse the title if it's a type of page we understand.
+        """
+
+        headers = response.headers
+
+        self.logger.trace(_("Info: %s") % list(headers.getAllRawHeaders()))
+
+        if response.code in self.redirect_codes:
+            self.fetcher.discard(response)
+
+            location = headers.getRawHeaders("location", [None])[0]
+
+            if location is None:
+                return None, None, None
+
+            if redirects >= self.fetcher.max_redirects:
+                self.logger.debug(_("Too many redirects: %s") % url)
+                return None, None, None
+
+            new_url = urlparse.urljoin(url, location)
+            new_domain = urlparse.urlparse(new_url).hostname or ""
+
+            if new_domain.startswith("www."):
+                new_domain = new_domain[4:]
+
+            if new_domain != domain:
+                self.logger.info(_("URL: %s") % new_url)
+                self.logger.info(_("Domain: %s") % new_domain)
+
+            if self.check_blacklist(new_url):
+                self.logger.debug(_("Not parsing, URL is blacklisted."))
+                return None, None, None
+
+            # Only bother with handlers again if we changed domain
+            return self._get_title(new_url, new_domain != domain,
+                                   redirects + 1)
+
+        ct = headers.getRawHeaders("content-type", [""])[0]
+        if ";" in ct:
+            ct = ct.split(";")[0]
+
+        self.logger.trace(_("Content-type: %s") % repr(ct))
+
+        if ct not in self.content_types:
+            self.logger.debug(_("Content-type is not allowed."))
+            self.fetcher.discard(response)
+            return None, None, None
+
+        d = self.fetcher.read(response)
+        d.addCallback(self._title_parse, url, domain)
+
+        return d
+
+    def _title_parse(self, title, url, domain):
+        """
+        Put together the result for a title parsed out of a page.
+        """
+
+        if title:
+            return title, to_unicode(domain), url
+        else:
+            return None, None, url
 
     def _shorten(self, txn, url, handler):
         """
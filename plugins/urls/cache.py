@@ -0,0 +1,298 @@
+"""
+Cache for parsed URL titles.
+
+Titles are kept in memory in an LRU with a TTL, keyed by normalized URL.
+Failed lookups are cached too, but for a shorter time, and concurrent
+lookups for the same URL are coalesced into a single fetch. Successful
+lookups can also be persisted to a DBAPI database, so they survive restarts.
+"""
+
+__author__ = 'Gareth Coles'
+
+import time
+import urlparse
+
+from collections import OrderedDict
+
+from twisted.internet.defer import Deferred, maybeDeferred, succeed
+
+from system.translations import Translations
+_ = Translations().get()
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def normalize_url(url):
+    """
+    Normalize a URL for use as a cache key.
+
+    The scheme and hostname are lowercased, default ports and fragments are
+    dropped and an empty path becomes "/".
+
+    >>> normalize_url("HTTP://Example.COM:80#top")
+    'http://example.com/'
+
+    :param url: The URL to normalize
+    :type url: str
+
+    :return: The normalized URL
+    :rtype: str
+    """
+
+    url = url.strip()
+
+    try:
+        parsed = urlparse.urlsplit(url)
+        port = parsed.port
+    except ValueError:
+        # A bad port or IPv6 address - use the URL as it is, the fetch will
+        # fail on its own
+        return url
+
+    scheme = parsed.scheme.lower()
+    netloc = (parsed.hostname or "").lower()
+
+    if port and port != DEFAULT_PORTS.get(scheme):
+        netloc = "%s:%s" % (netloc, port)
+
+    if parsed.username:
+        netloc = "%s@%s" % (parsed.username, netloc)
+
+    return urlparse.urlunsplit(
+        (scheme, netloc, parsed.path or "/", parsed.query, "")
+    )
+
+
+class TitleCache(object):
+    """
+    LRU and TTL cache of parsed URL titles, with negative caching and
+    request coalescing.
+
+    Entries are (title, domain, final_url) tuples. A lookup that failed -
+    one without a title or a final URL - is cached for `negative_ttl`
+    seconds instead of `ttl`.
+
+    :param size: The maximum number of entries to keep in memory
+    :param ttl: Seconds to keep successful lookups for
+    :param negative_ttl: Seconds to keep failed lookups for
+    :param db: A DBAPI data object to persist successful lookups to, with a
+        table created by `create_interaction`, or None
+    :param logger: A logger to report persistence errors to
+    """
+
+    def __init__(self, size=1000, ttl=3600, negative_ttl=300, db=None,
+                 logger=None):
+        self.size = size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.db = db
+        self.logger = logger
+
+        self.entries = OrderedDict()
+        self.pending = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """
+        Get an entry from the in-memory cache.
+
+        :param key: The cache key
+        :return: The entry, or None if it's missing or expired
+        """
+
+        entry = self.entries.pop(key, None)
+
+        if entry is None:
+            return None
+
+        if entry[0] < time.time():
+            return None
+
+        self.entries[key] = entry  # Move to the end, most recently used
+        return entry[1]
+
+    def set(self, key, value):
+        """
+        Add an entry to the cache, evicting the least recently used entries
+        if we're full. Successful entries are persisted if we have a
+        database.
+
+        :param key: The cache key
+        :param value: A (title, domain, final_url) tuple
+        """
+
+        title, domain, final_url = value
+
+        if title is None or final_url is None:
+            expires = time.time() + self.negative_ttl
+        else:
+            expires = time.time() + self.ttl
+
+            if self.db is not None:
+                self._persist(key, value, expires)
+
+        self._add(key, expires, value)
+
+    def _add(self, key, expires, value):
+        self.entries.pop(key, None)
+        self.entries[key] = (expires, value)
+
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Clear the in-memory cache and reset the statistics.
+        """
+
+        self.entries.clear()
+
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.coalesced = 0
+
+    def fetch(self, url, fetch_func, *args):
+        """
+        Get the entry for a URL, fetching it if it's not cached.
+
+        If the URL is already being fetched, we wait for that fetch instead
+        of starting another.
+
+        :param url: The URL to get the entry for
+        :param fetch_func: A function that takes the URL (and *args) and
+            returns a Deferred firing with a (title, domain, final_url)
+            tuple. It shouldn't fail.
+
+        :return: A Deferred firing with the entry
+        :rtype: Deferred
+        """
+
+        key = (normalize_url(url),) + args
+        value = self.get(key)
+
+        if value is not None:
+            self.hits += 1
+
+            if value[0] is None or value[2] is None:
+                self.negative_hits += 1
+
+            return succeed(value)
+
+        if key in self.pending:
+            self.coalesced += 1
+
+            d = Deferred()
+            self.pending[key].append(d)
+            return d
+
+        self.misses += 1
+
+        d = Deferred()
+        self.pending[key] = [d]
+
+        if self.db is None:
+            fetched = maybeDeferred(fetch_func, url, *args)
+        else:
+            fetched = self._load(key)
+            fetched.addCallback(self._loaded, url, fetch_func, args)
+
+        fetched.addBoth(self._fetched, key)
+
+        return d
+
+    def _fetched(self, result, key):
+        waiting = self.pending.pop(key, [])
+
+        # Entries loaded from the database are already in memory
+        if isinstance(result, tuple) and key not in self.entries:
+            self.set(key, result)
+
+        for d in waiting:
+            d.callback(result)
+
+    def _loaded(self, result, url, fetch_func, args):
+        if result is not None:
+            return result
+
+        return maybeDeferred(fetch_func, url, *args)
+
+    # Persistence
+
+    def _log_failure(self, failure, message):
+        if self.logger is not None:
+            self.logger.error(message % failure.getErrorMessage())
+
+    def _load(self, key):
+        d = self.db.runQuery(
+            "SELECT title, domain, final_url, expires FROM titles "
+            "WHERE url = ? AND use_handler = ? AND expires > ?",
+            (key[0], int(any(key[1:])), time.time())
+        )
+
+        def loaded(rows):
+            if not rows:
+                return None
+
+            value = tuple(rows[0][:3])
+            self._add(key, rows[0][3], value)
+
+            return value
+
+        def failed(failure):
+            self._log_failure(failure, _("Failed to load cached title: %s"))
+
+        return d.addCallbacks(loaded, failed)
+
+    def _persist(self, key, value, expires):
+        d = self.db.runOperation(
+            "INSERT OR REPLACE INTO titles VALUES (?, ?, ?, ?, ?, ?)",
+            (key[0], int(any(key[1:]))) + value + (expires,)
+        )
+
+        d.addErrback(self._log_failure, _("Failed to persist title: %s"))
+
+    @staticmethod
+    def create_interaction(txn):
+        """
+        DBAPI interaction for creating the persistence table, and clearing
+        out expired entries.
+        """
+
+        txn.execute("CREATE TABLE IF NOT EXISTS titles ("
+                    "url TEXT, "
+                    "use_handler INTEGER, "
+                    "title TEXT, "
+                    "domain TEXT, "
+                    "final_url TEXT, "
+                    "expires REAL, "
+                    "PRIMARY KEY (url, use_handler))")
+        txn.execute("DELETE FROM titles WHERE expires < ?", (time.time(),))
+
+    def stats(self):
+        """
+        Get some statistics about the cache.
+
+        :return: A dict of statistics
+        :rtype: dict
+        """
+
+        lookups = self.hits + self.misses
+
+        return {
+            "size": len(self.entries),
+            "max_size": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "negative_hits": self.negative_hits,
+            "coalesced": self.coalesced,
+            "in_flight": len(self.pending),
+            "hit_rate": float(self.hits) / lookups if lookups else 0.0
+        }
@@ -3,6 +3,11 @@ Class designed for logging caught URLs. It doesn't work very well right now.
 
 This uses a configured dbapi source along with some SQL defined in the sql/
 folder. You can always add SQL there if you need another dialect.
+
+Caught URLs are buffered and written in batches, either when enough of them
+have been caught or every so often. A dialect may provide an insert_batch.sql
+that only inserts URLs that aren't already in the table - if it doesn't, we
+fall back to checking for each URL with find.sql before inserting it.
 """
 
 __author__ = 'Gareth Coles'
@@ -10,8 +15,10 @@ __author__ = 'Gareth Coles'
 import datetime
 import os
 
+from collections import OrderedDict
 from socket import error as SocketError
-from system.protocols.generic.channel import Channel
+from twisted.internet.task import LoopingCall
+
 from system.storage.formats import DBAPI
 
 from system.translations import Translations
@@ -33,6 +40,10 @@ class Catcher(object):
     sql = None
     db = None
 
+    buffer = None
+    seen = None
+    task = None
+
     pipe_breakages = 0
 
     @property
@@ -62,6 +73,31 @@ class Catcher(object):
 
         return self.config.get("ignored", [])
 
+    @property
+    def batch_size(self):
+        """
+        How many URLs to buffer before writing them to the database.
+        """
+
+        return self.config.get("batch_size", 50)
+
+    @property
+    def flush_interval(self):
+        """
+        How often to write buffered URLs to the database, in seconds.
+        """
+
+        return self.config.get("flush_interval", 30)
+
+    @property
+    def seen_size(self):
+        """
+        How many recently-caught URLs to remember, so that we don't have to
+        ask the database about them.
+        """
+
+        return self.config.get("seen_size", 10000)
+
     def __init__(self, plugin, config, storage, logger):
         self._config = config
 
@@ -78,7 +114,10 @@ class Catcher(object):
         self.logger = logger
 
         self.where = os.path.dirname(os.path.abspath(__file__))
-        self.sql = dict(create="", find="", insert="")
+        self.sql = dict(create="", find="", insert="", insert_batch=None)
+
+        self.buffer = []
+        self.seen = OrderedDict()
 
         self.reload()
 
@@ -117,8 +156,6 @@ class Catcher(object):
         Reload the catcher entirely.
         """
 
-        self.load_sql(self.config["dialect"])
-
         params = self.config["params"]
 
         if isinstance(params, dict):  # Standard dictionary access
@@ -134,6 +171,8 @@ class Catcher(object):
                 *params
             )
 
+        self.load_sql(self.config["dialect"])
+
         d = self.db.runInteraction(self.create_interaction)
 
         d.addCallbacks(self._log_callback_success,
@@ -141,6 +180,24 @@ class Catcher(object):
                        callbackArgs=(_("Created table."), False),
                        errbackArgs=(_("Failed to create table: %s"), True))
 
+        if self.task is not None and self.task.running:
+            self.task.stop()
+
+        self.task = LoopingCall(self.flush)
+        self.task.start(self.flush_interval, now=False)
+
+    def stop(self):
+        """
+        Stop flushing periodically, and write out anything left in the
+        buffer.
+        """
+
+        if self.task is not None and self.task.running:
+            self.task.stop()
+
+        if self.buffer:
+            return self.flush()
+
     def load_sql(self, dialect):
         """
         Load the SQL for a certain dialect.
@@ -149,9 +206,20 @@ class Catcher(object):
         base_path = "%s/sql/%s/" % (self.where, dialect)
         self.logger.debug(_("Looking for SQL in %s") % base_path)
         if os.path.exists(base_path):
-            self.sql["create"] = open(base_path + "create.sql").read()
-            self.sql["find"] = open(base_path + "find.sql").read()
-            self.sql["insert"] = open(base_path + "insert.sql").read()
+            table = self.config["table_prefix"] + "_urls"
+
+            for name in ["create", "find", "insert"]:
+                with open(base_path + name + ".sql") as fh:
+                    self.sql[name] = self.db.statement(fh.read(),
+                                                       TABLE=table)
+
+            if os.path.exists(base_path + "insert_batch.sql"):
+                with open(base_path + "insert_batch.sql") as fh:
+                    self.sql["insert_batch"] = self.db.statement(
+                        fh.read(), TABLE=table
+                    )
+            else:
+                self.sql["insert_batch"] = None
         else:
             raise ValueError(_("No SQL found for dialect '%s'.") % dialect)
 
@@ -160,22 +228,14 @@ class Catcher(object):
         DBAPI interaction for creating the table.
         """
 
-        sql = self.sql["create"].replace(
-            "{TABLE}", self.config["table_prefix"] + "_urls"
-        )
-
-        txn.execute(sql)
+        txn.execute(self.sql["create"])
 
     def find_interaction(self, txn, url):
         """
         DBAPI interaction for finding a URL.
         """
 
-        sql = self.sql["find"].replace(
-            "{TABLE}", self.config["table_prefix"] + "_urls"
-        )
-
-        txn.execute(sql, (url,))
+        txn.execute(self.sql["find"], (url,))
         r = txn.fetchone()
 
         return r is not None
@@ -189,27 +249,93 @@ class Catcher(object):
         self.pipe_breakages = 0
 
         if not found:
-            sql = self.sql["insert"].replace(
-                "{TABLE}", self.config["table_prefix"] + "_urls"
-            )
             now = datetime.datetime.utcnow()
 
-            txn.execute(sql, (url, now, user, target, protocol))
+            txn.execute(self.sql["insert"], (url, now, user, target, protocol))
+
+    def insert_batch_interaction(self, txn, rows):
+        """
+        DBAPI interaction for inserting a batch of URLs in one transaction.
+
+        :param rows: A list of (url, submitted, user, target, protocol) tuples
+        """
+
+        self.pipe_breakages = 0
+
+        if self.sql["insert_batch"] is not None:
+            # The batch insert only inserts URLs that aren't there already
+            txn.executemany(self.sql["insert_batch"],
+                            [row + (row[0],) for row in rows])
+        else:
+            for row in rows:
+                if not self.find_interaction(txn, row[0]):
+                    txn.execute(self.sql["insert"], row)
 
     def insert_url(self, url, user, target, protocol):
         """
-        Insert a URL into the database.
+        Queue a URL to be inserted into the database.
+
+        URLs we've seen recently are skipped, and the rest are written out
+        in a batch once there's enough of them, or at the next flush.
+
+        :param url: The URL that was caught
+        :param user: The nickname of the user that sent it
+        :param target: The name of the channel it was sent to
+        :param protocol: The name of the protocol it was sent on
         """
 
-        if self.enabled:
-            if isinstance(target, Channel):
-                if "%s:%s" % (protocol.name, target.name) in self.ignored:
-                    return
-            d = self.db.runInteraction(self.insert_interaction,
-                                       url, user, target, protocol)
+        if not self.enabled:
+            return
 
-            d.addErrback(
-                self._log_callback_failure,
-                _("Failed to insert URL: %s"),
-                True
-            )
+        if "%s:%s" % (protocol, target) in self.ignored:
+            return
+
+        if url in self.seen:
+            return
+
+        self.seen[url] = True
+
+        while len(self.seen) > self.seen_size:
+            self.seen.popitem(last=False)
+
+        self.buffer.append(
+            (url, datetime.datetime.utcnow(), user, target, protocol)
+        )
+
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Write all the buffered URLs to the database.
+
+        :return: A Deferred that fires when they've been written, or None
+            if there was nothing to write
+        """
+
+        if not self.buffer:
+            return None
+
+        rows, self.buffer = self.buffer, []
+
+        d = self.db.runInteraction(self.insert_batch_interaction, rows)
+
+        d.addErrback(self._forget_rows, rows)
+        d.addErrback(
+            self._log_callback_failure,
+            _("Failed to insert URLs: %s"),
+            True
+        )
+
+        return d
+
+    def _forget_rows(self, failure, rows):
+        """
+        Forget that we've seen the URLs from a batch that failed to be
+        written, so they aren't skipped next time they're caught.
+        """
+
+        for row in rows:
+            self.seen.pop(row[0], None)
+
+        return failure
@@ -0,0 +1,296 @@
+"""
+Non-blocking HTTP fetching for URL titles.
+
+This wraps up Twisted's HTTP client so that the URLs plugin can fetch pages
+without tying up a thread for each one. Connections are pooled, DNS lookups
+are done asynchronously, every request is subject to a timeout and page
+bodies are only parsed up to the end of the title (or a byte cap).
+
+Requests connect to the address the caller resolved (and checked) rather
+than looking the hostname up again, so a hostname can't resolve to a public
+address for the check and a private one for the connection.
+"""
+
+__author__ = 'Gareth Coles'
+
+import socket
+
+from twisted.internet import reactor
+from twisted.internet.abstract import isIPAddress, isIPv6Address
+from twisted.internet.defer import Deferred, succeed
+from twisted.internet.endpoints import TCP4ClientEndpoint, \
+    TCP6ClientEndpoint, wrapClientTLS
+from twisted.internet.protocol import Protocol
+from twisted.names import client as dns
+from twisted.names.dns import A, AAAA
+from twisted.names.error import DomainError
+from twisted.web.client import Agent, BrowserLikePolicyForHTTPS, \
+    HTTPConnectionPool, ResponseDone
+from twisted.web.http import PotentialDataLoss
+from twisted.web.http_headers import Headers
+from twisted.web.iweb import IAgentEndpointFactory
+from zope.interface import implementer
+
+from system.translations import Translations
+from utils.html import CHARSET_REGEX, HTMLTitleExtractor
+_ = Translations().get()
+
+
+class TitleReader(Protocol):
+    """
+    Protocol that parses a response body until the end of the page title.
+
+    Chunks are fed to a `HTMLTitleExtractor` as they arrive. As soon as it's
+    found the title, or we've read more than `max_bytes` bytes, we stop
+    reading and fire the Deferred with the title (or None).
+    """
+
+    def __init__(self, finished, max_bytes, charset=None):
+        self.finished = finished
+        self.max_bytes = max_bytes
+        self.extractor = HTMLTitleExtractor(charset)
+
+        self.length = 0
+        self.done = False
+
+    def dataReceived(self, data):
+        if self.done:
+            return
+
+        self.length += len(data)
+
+        if self.extractor.feed(data) or self.length >= self.max_bytes:
+            self.done = True
+            self.transport.stopProducing()
+            self.finished.callback(self.extractor.get_title())
+
+    def connectionLost(self, reason=ResponseDone):
+        if self.done:
+            return
+
+        self.done = True
+
+        if reason.check(ResponseDone, PotentialDataLoss):
+            self.finished.callback(self.extractor.get_title())
+        else:
+            self.finished.errback(reason)
+
+    def cancel(self, d):
+        """
+        Canceller for our Deferred - stops reading the body.
+        """
+
+        if not self.done:
+            self.done = True
+            self.transport.stopProducing()
+
+
+class Discard(Protocol):
+    """
+    Protocol that throws away a response body we don't want, by stopping
+    the transfer as soon as it starts.
+    """
+
+    def connectionMade(self):
+        self.transport.stopProducing()
+
+    def connectionLost(self, reason=ResponseDone):
+        pass
+
+
+@implementer(IAgentEndpointFactory)
+class PinnedEndpointFactory(object):
+    """
+    Endpoint factory that connects to an address we've already resolved,
+    instead of resolving the URL's hostname again.
+
+    Set `address` right before asking the Agent for a request - the Agent
+    asks us for an endpoint before it returns. The Host header, and the
+    hostname checked against HTTPS certificates, still come from the URL.
+
+    :param timeout: Seconds to wait for connections
+    """
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.policy = BrowserLikePolicyForHTTPS()
+
+        #: The address to connect to for the next request
+        self.address = None
+
+    def endpointForURI(self, uri):
+        address = self.address
+
+        if address is None:
+            raise ValueError(_("No address to connect to: %s") % uri.host)
+
+        if isIPv6Address(address):
+            endpoint = TCP6ClientEndpoint(reactor, address, uri.port,
+                                          timeout=self.timeout)
+        else:
+            endpoint = TCP4ClientEndpoint(reactor, address, uri.port,
+                                          timeout=self.timeout)
+
+        if uri.scheme == "https":
+            creator = self.policy.creatorForNetloc(uri.host, uri.port)
+            endpoint = wrapClientTLS(creator, endpoint)
+
+        return endpoint
+
+
+class TitleFetcher(object):
+    """
+    Pooled, non-blocking HTTP fetcher used for URL titles.
+
+    :param timeout: Seconds to wait for each step of a request
+    :param max_bytes: The maximum number of body bytes to read
+    :param max_redirects: The maximum number of redirects to follow
+    :param connections: Persistent connections to keep per host
+    """
+
+    def __init__(self, timeout=10, max_bytes=65536, max_redirects=5,
+                 connections=2):
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.max_redirects = max_redirects
+
+        self.pool = HTTPConnectionPool(reactor, persistent=True)
+        self.pool.maxPersistentPerHost = connections
+
+        self.endpoints = PinnedEndpointFactory(timeout)
+        self.agent = Agent.usingEndpointFactory(reactor, self.endpoints,
+                                                pool=self.pool)
+
+    def _timeout(self, d):
+        """
+        Cancel a Deferred if it doesn't fire within our timeout.
+        """
+
+        call = reactor.callLater(self.timeout, d.cancel)
+
+        def cancel_call(result):
+            if call.active():
+                call.cancel()
+            return result
+
+        return d.addBoth(cancel_call)
+
+    def resolve(self, host):
+        """
+        Asynchronously look up the IP address for a hostname. IPv4 addresses
+        are preferred, but IPv6 addresses are used if there are none.
+
+        :param host: The hostname to look up
+        :type host: str
+
+        :return: A Deferred that fires with the IP address
+        :rtype: Deferred
+        """
+
+        if isIPAddress(host) or isIPv6Address(host):
+            return succeed(host)
+
+        d = dns.lookupAddress(host)
+        d.addCallback(self._resolved, host, True)
+
+        return self._timeout(d)
+
+    def _resolved(self, result, host, fallback=False):
+        """
+        Pick an address out of a lookup's answers, looking up IPv6 addresses
+        if there weren't any IPv4 ones and we haven't already.
+        """
+
+        answers = result[0]
+
+        for record in answers:
+            if record.type == A:
+                return record.payload.dottedQuad()
+            if record.type == AAAA:
+                return socket.inet_ntop(socket.AF_INET6,
+                                        record.payload.address)
+
+        if fallback:
+            d = dns.lookupIPV6Address(host)
+            d.addCallback(self._resolved, host)
+
+            return d
+
+        raise DomainError(host)
+
+    def request(self, url, address, headers=None):
+        """
+        Make a GET request. Redirects are not followed, so that the caller
+        can check where they lead first.
+
+        :param url: The URL to request
+        :param address: The IP address to connect to, from `resolve`
+        :param headers: A dict of headers to send
+
+        :type url: str
+        :type address: str
+        :type headers: dict
+
+        :return: A Deferred that fires with the response
+        :rtype: Deferred
+        """
+
+        if headers is None:
+            headers = {}
+
+        if isinstance(url, unicode):
+            url = url.encode("UTF-8")
+
+        headers = Headers(
+            dict((k, [v]) for k, v in headers.iteritems())
+        )
+
+        self.endpoints.address = address
+
+        try:
+            d = self.agent.request("GET", url, headers)
+        finally:
+            self.endpoints.address = None
+
+        return self._timeout(d)
+
+    def read(self, response):
+        """
+        Read a response body up to the end of the page title, and parse
+        the title out of it.
+
+        :param response: The response to read
+
+        :return: A Deferred that fires with the title, or None
+        :rtype: Deferred
+        """
+
+        charset = None
+        content_type = response.headers.getRawHeaders("content-type", [""])
+        match = CHARSET_REGEX.search(content_type[0])
+
+        if match:
+            charset = match.group(1)
+
+        d = Deferred(lambda d: reader.cancel(d))
+        reader = TitleReader(d, self.max_bytes, charset)
+
+        response.deliverBody(reader)
+        return self._timeout(d)
+
+    def discard(self, response):
+        """
+        Throw away a response body we don't want to read.
+        """
+
+        response.deliverBody(Discard())
+
+    def close(self):
+        """
+        Close all of our pooled connections.
+
+        :return: A Deferred that fires once they're closed
+        :rtype: Deferred
+        """
+
+        return self.pool.closeCachedConnections()
@@ -0,0 +1,6 @@
+INSERT INTO {TABLE} (
+  url, submitted, username, target, protocol
+) SELECT %s, %s, %s, %s, %s FROM DUAL
+WHERE NOT EXISTS (
+  SELECT url FROM {TABLE} WHERE url=%s
+)
\ No newline at end of file
@@ -0,0 +1,210 @@
+__author__ = 'Gareth Coles'
+
+"""
+Benchmark command parsing on a stream of mixed chat traffic.
+
+Usage: python profiling/commands.py [number of lines]
+
+Most lines aren't commands at all, so spotting those quickly matters most.
+Of the commands, half are registered with parse_args=False and only use
+their raw arguments, and some have quoted arguments.
+
+The old way of doing things (lowercasing every line, and running every
+command's arguments through shlex) is timed against the command manager's
+prefix cache and argument splitter, and then the command manager is timed
+running the commands, events and all.
+"""
+
+import os
+import sys
+print os.getcwd()
+
+sys.path.append(os.getcwd())  # Because herp derp
+
+import itertools
+import logging
+import random
+import shlex
+import timeit
+
+from system.command_manager import CommandManager, split_args
+
+#: How many lines to process, unless given on the command line
+LINES = 1000000
+
+#: What proportion of lines are commands
+COMMAND_RATIO = 0.1
+
+CONTROL_CHARS = "{NAME}: "
+NICKNAME = "Ultros"
+
+CHAT = [
+    "hello everyone",
+    "has anyone seen the new release? http://example.com/releases/1.2.3",
+    "lol",
+    "Ultros is a bot, isn't it?",
+    "I \"think\" so, but I'm not sure",
+    "brb, getting coffee",
+    "ultros what are you?",
+    "Some considerably longer message, the kind that people write when "
+    "they've got a lot to say about something and want everyone to know",
+]
+
+COMMANDS = [
+    ("parsed", 'parsed add "some factoid" with some info'),
+    ("parsed", "parsed http://example.com/some/long/url tinyurl"),
+    ("parsed", "parsed"),
+    ("raw", "raw global hello Hello, world!"),
+    ("raw", 'raw login user "password with quotes'),
+    ("raw", "raw"),
+]
+
+
+class Thing(object):
+    """
+    Stands in for users, channels and protocols - they only need a name.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.nickname = name
+
+    def __str__(self):
+        return self.name
+
+
+def handler(protocol, caller, source, command, raw_args, parsed_args):
+    pass
+
+
+def generate_lines():
+    rng = random.Random(0)
+    lines = []
+
+    for i in xrange(10000):
+        if rng.random() < COMMAND_RATIO:
+            prefix = rng.choice(["Ultros: ", "ULTROS: ", "ultros: "])
+            lines.append(prefix + rng.choice(COMMANDS)[1])
+        else:
+            lines.append(rng.choice(CHAT))
+
+    return lines
+
+
+def old_process(in_str, control_char, our_name):
+    """
+    Command detection and argument parsing, as it used to be done.
+    """
+
+    control_char = control_char.replace("{NAME}", our_name)
+    control_char = control_char.replace("{NICK}", our_name)
+
+    if len(in_str) < len(control_char):
+        return None
+
+    if in_str.lower().startswith(control_char.lower()):
+        split = in_str[len(control_char):].split(None, 1)
+
+        if not split:
+            return None
+
+        args = ""
+
+        if len(split) > 1:
+            args = split[1]
+
+        try:
+            lex = shlex.shlex(args, posix=True)
+            lex.whitespace_split = True
+            lex.quotes = '"'
+            lex.commenters = ""
+            return split[0], list(lex)
+        except ValueError:
+            return split[0], None
+
+    return None
+
+
+def new_process(manager, in_str, control_char, our_name):
+    """
+    Command detection and argument parsing, as the command manager does it.
+    """
+
+    try:
+        prefix, length = manager.prefixes[control_char, our_name]
+    except KeyError:
+        prefix, length = manager.get_prefix(control_char, our_name)
+
+    if in_str[:length].lower() == prefix:
+        split = in_str[length:].split(None, 1)
+
+        if not split:
+            return None
+
+        if not manager.commands[split[0]]["parse_args"]:
+            return split[0], None
+
+        args = ""
+
+        if len(split) > 1:
+            args = split[1]
+
+        try:
+            return split[0], split_args(args)
+        except ValueError:
+            return split[0], None
+
+    return None
+
+
+def do_benchmark(count):
+    manager = CommandManager()
+    manager.logger.setLevel(logging.CRITICAL)
+
+    manager.register_command("parsed", handler, "profiling")
+    manager.register_command("raw", handler, "profiling", parse_args=False)
+
+    lines = generate_lines()
+    commands = sum(1 for line in lines if line.lower().startswith("ultros: "))
+
+    print "%s lines, %.1f%% commands" % (
+        count, commands * 100.0 / len(lines)
+    )
+
+    caller = Thing("gdude")
+    source = Thing("#ultros")
+    protocol = Thing("irc")
+
+    def old_parsing():
+        for line in itertools.islice(itertools.cycle(lines), count):
+            old_process(line, CONTROL_CHARS, NICKNAME)
+
+    def new_parsing():
+        for line in itertools.islice(itertools.cycle(lines), count):
+            new_process(manager, line, CONTROL_CHARS, NICKNAME)
+
+    def process_input():
+        for line in itertools.islice(itertools.cycle(lines), count):
+            manager.process_input(line, caller, source, protocol,
+                                  CONTROL_CHARS, NICKNAME)
+
+    results = [
+        ("Lowercase and shlex (old)", timeit.timeit(old_parsing, number=1)),
+        ("Prefix cache and split_args", timeit.timeit(new_parsing, number=1)),
+        ("CommandManager.process_input",
+         timeit.timeit(process_input, number=1)),
+    ]
+
+    for title, taken in results:
+        print "    %-35s %8.2f s, %8.2f us per line" % (
+            title, taken, (taken / count) * 1000000
+        )
+
+
+if __name__ == "__main__":
+    logging.disable(logging.CRITICAL)
+
+    if len(sys.argv) > 1:
+        do_benchmark(int(sys.argv[1]))
+    else:
+        do_benchmark(LINES)
@@ -7,24 +7,42 @@ print os.getcwd()
 sys.path.append(os.getcwd())  # Because herp derp
 
 import cProfile
+import logging
+import timeit
 
 from profiling.fakes import FakePlugin, FakePluginEvent
 
 from system.event_manager import EventManager
 
 events = EventManager()
+events.logger.setLevel(logging.INFO)  # Debug output would swamp the timings
+
+#: How many events to fire per benchmark
+ITERATIONS = 100000
+
+#: How many handlers to register for the multi-handler benchmarks
+HANDLERS = 20
 
 
 class EventPlugin(FakePlugin):
-    def __init__(self, info):
+    def __init__(self, info, callback="Test", fltr=None, cancelled=False):
         super(EventPlugin, self).__init__(info)
 
-        events.add_callback("Test", self, self.event_callback, 0)
+        events.add_callback(callback, self, self.event_callback, 0,
+                            fltr=fltr, cancelled=cancelled)
 
     def event_callback(self, event):
         pass
 
 
+def accept(event):
+    return True
+
+
+def reject(event):
+    return False
+
+
 def do_profile():
     plugin = EventPlugin({"name": "FAAAAAAAAKE!"})
     cProfile.run("run()")
@@ -36,5 +54,58 @@ def run():
         events.run_callback("Test", e)
 
 
+def setup_benchmarks():
+    """
+    Register the handlers used by the benchmarks. Each benchmark uses its own
+    callback name so that they don't interfere with each other.
+    """
+
+    EventPlugin({"name": "Single"}, "Bench/Single")
+
+    for i in xrange(0, HANDLERS):
+        EventPlugin({"name": "Many %s" % i}, "Bench/Many")
+        EventPlugin({"name": "Filtered %s" % i}, "Bench/Filtered",
+                    fltr=accept if i % 2 else reject)
+        EventPlugin({"name": "Cancelled %s" % i}, "Bench/Cancelled",
+                    cancelled=bool(i % 2))
+
+
+def bench(callback, cancelled=False):
+    """
+    Fire an event at a callback a bunch of times and return the average
+    cost of each event in microseconds.
+    """
+
+    event = FakePluginEvent()
+    event.cancelled = cancelled
+
+    taken = timeit.timeit(
+        lambda: events.run_callback(callback, event), number=ITERATIONS
+    )
+
+    return (taken / ITERATIONS) * 1000000
+
+
+def do_benchmark():
+    setup_benchmarks()
+
+    results = [
+        ("No handlers", bench("Bench/Nothing")),
+        ("1 handler", bench("Bench/Single")),
+        ("%s handlers" % HANDLERS, bench("Bench/Many")),
+        ("%s filtered handlers" % HANDLERS, bench("Bench/Filtered")),
+        ("%s handlers, cancelled event" % HANDLERS,
+         bench("Bench/Cancelled", True)),
+    ]
+
+    print "Per-event cost over %s events:" % ITERATIONS
+
+    for name, taken in results:
+        print "    %-35s %8.2f us" % (name, taken)
+
+
 if __name__ == "__main__":
-    do_profile()
+    if "--profile" in sys.argv:
+        do_profile()
+    else:
+        do_benchmark()
@@ -0,0 +1,220 @@
+__author__ = 'Gareth Coles'
+
+"""
+Benchmark factoid lookups on a large synthetic factoids database.
+
+Usage: python profiling/factoids.py [number of factoids]
+
+The plugin's single ordered query is timed against fetching every row for
+the key and scanning them in Python, which is how lookups used to work.
+Lookups through the plugin itself, which adds logging and error handling,
+and through its in-memory cache, are timed as well.
+"""
+
+import os
+import sys
+print os.getcwd()
+
+sys.path.append(os.getcwd())  # Because herp derp
+
+import logging
+import random
+import shutil
+import sqlite3
+import tempfile
+import timeit
+
+from plugins.factoids import FactoidsPlugin
+from plugins.factoids.cache import FactoidCache
+from plugins.factoids.migrations import migrate
+from system.logging.logger import getLogger
+
+#: How many factoids to create, unless given on the command line
+FACTOIDS = 100000
+
+#: How many distinct factoid names to spread them across
+KEYS = 20000
+
+#: How many protocols and channels to spread them across
+PROTOCOLS = 4
+CHANNELS = 50
+
+#: How many lookups to do per benchmark
+ITERATIONS = 5000
+
+LOCATIONS = ["channel", "protocol", "global"]
+
+
+def generate_rows(count):
+    """
+    Generate a bunch of factoid rows, spread over a bunch of locations.
+    """
+
+    rng = random.Random(0)
+
+    for i in xrange(count):
+        key = u"factoid%s" % rng.randrange(KEYS)
+        yield (
+            key,
+            rng.choice(LOCATIONS),
+            u"protocol%s" % rng.randrange(PROTOCOLS),
+            u"#channel%s" % rng.randrange(CHANNELS),
+            key,
+            u"Some information about factoid number %s" % i
+        )
+
+
+class QueryRecorder(object):
+    """
+    Wraps a cursor, recording the queries that are run with it.
+    """
+
+    def __init__(self, cursor, queries):
+        self.cursor = cursor
+        self.queries = queries
+
+    def execute(self, sql, args=()):
+        self.queries.append((sql, args))
+        return self.cursor.execute(sql, args)
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+
+def old_lookup(txn, factoid_key, protocol, channel):
+    """
+    Lookups as they used to be done - every row for the key, scanned in
+    Python.
+    """
+
+    txn.execute("SELECT location, protocol, channel, factoid_name, "
+                "info FROM factoids WHERE factoid_key = ?", (factoid_key,))
+    results = txn.fetchall()
+
+    for row in results:
+        if row[0] == "channel" and row[1] == protocol and row[2] == channel:
+            return (row[3], row[4].split("\n"))
+    for row in results:
+        if row[0] == "protocol" and row[1] == protocol:
+            return (row[3], row[4].split("\n"))
+    for row in results:
+        if row[0] == "global":
+            return (row[3], row[4].split("\n"))
+
+
+def do_benchmark(count):
+    tmpdir = tempfile.mkdtemp()
+
+    try:
+        connection = sqlite3.connect(os.path.join(tmpdir, "factoids.sqlite"))
+        cursor = connection.cursor()
+
+        migrate(cursor)
+        cursor.executemany("INSERT INTO factoids VALUES (?, ?, ?, ?, ?, ?)",
+                           generate_rows(count))
+        connection.commit()
+
+        cursor.execute("SELECT COUNT(*) FROM factoids")
+        print "%s factoids (%s after duplicates were replaced)" % (
+            count, cursor.fetchone()[0]
+        )
+
+        plugin = FactoidsPlugin.__new__(FactoidsPlugin)
+        plugin.logger = getLogger("Factoids")
+
+        cursor.execute("SELECT factoid_key, location, protocol, channel, "
+                       "factoid_name, info FROM factoids")
+        cache = FactoidCache()
+        cache.load(cursor.fetchall())
+
+        rng = random.Random(1)
+        lookups = [
+            (u"factoid%s" % rng.randrange(KEYS),
+             u"protocol%s" % rng.randrange(PROTOCOLS),
+             u"#channel%s" % rng.randrange(CHANNELS))
+            for _ in xrange(ITERATIONS)
+        ]
+
+        # Make sure all three agree before timing them
+        for key, protocol, channel in lookups[:500]:
+            try:
+                new = plugin._get_factoid_interaction(cursor, key, None,
+                                                      protocol, channel)
+            except Exception:
+                new = None
+
+            old = old_lookup(cursor, key, protocol, channel)
+            cached = cache.resolve(key, protocol, channel)
+
+            assert new == (cached[0], cached[1].split("\n")) if cached \
+                else new is None
+
+            # The old scan didn't define which row won a tie, so only
+            # compare the scope it found
+            assert (old is None) == (new is None)
+
+        # Capture the plugin's query, so we can see how SQLite runs it
+        queries = []
+        plugin._get_factoid_interaction(QueryRecorder(cursor, queries),
+                                        u"factoid0", None, u"protocol0",
+                                        u"#channel0")
+        cursor.execute("EXPLAIN QUERY PLAN " + queries[0][0], queries[0][1])
+
+        print "Query plan:"
+
+        for row in cursor.fetchall():
+            print "    %s" % row[-1]
+
+        print ""
+
+        sql = queries[0][0]
+
+        def query_lookups():
+            for key, protocol, channel in lookups:
+                cursor.execute(sql, (key, u"channel", protocol, channel,
+                                     key, u"protocol", protocol,
+                                     key, u"global"))
+                cursor.fetchone()
+
+        def plugin_lookups():
+            for key, protocol, channel in lookups:
+                try:
+                    plugin._get_factoid_interaction(cursor, key, None,
+                                                    protocol, channel)
+                except Exception:
+                    pass
+
+        def old_lookups():
+            for key, protocol, channel in lookups:
+                old_lookup(cursor, key, protocol, channel)
+
+        def cached_lookups():
+            for key, protocol, channel in lookups:
+                cache.resolve(key, protocol, channel)
+
+        results = [
+            ("Rows for key, scanned in Python",
+             timeit.timeit(old_lookups, number=1)),
+            ("Single ordered query", timeit.timeit(query_lookups, number=1)),
+            ("Plugin lookup, database",
+             timeit.timeit(plugin_lookups, number=1)),
+            ("In-memory cache", timeit.timeit(cached_lookups, number=1)),
+        ]
+
+        for title, taken in results:
+            print "    %-35s %10.2f us per lookup" % (
+                title, (taken / ITERATIONS) * 1000000
+            )
+
+        connection.close()
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    logging.disable(logging.CRITICAL)
+
+    if len(sys.argv) > 1:
+        do_benchmark(int(sys.argv[1]))
+    else:
+        do_benchmark(FACTOIDS)
@@ -0,0 +1,69 @@
+__author__ = 'Gareth Coles'
+
+"""
+Benchmark password hashing with a range of schemes and work factors.
+
+Usage: python profiling/hashing.py [number of hashes per setting]
+
+Use this to pick settings for the auth plugin's "hashing" section - hashing
+should be slow enough to make cracking leaked hashes hard, but not so slow
+that the threadpool can't keep up with logins.
+"""
+
+import os
+import sys
+print os.getcwd()
+
+sys.path.append(os.getcwd())  # Because herp derp
+
+import logging
+import timeit
+
+from plugins.auth import hashing
+
+#: How many hashes to time for each setting, unless given on the command line
+ITERATIONS = 10
+
+SETTINGS = [
+    ("sha512", {}),
+    ("pbkdf2", {"rounds": 10000}),
+    ("pbkdf2", {"rounds": 50000}),
+    ("pbkdf2", {"rounds": 100000}),
+    ("pbkdf2", {"rounds": 200000}),
+    ("pbkdf2", {"rounds": 100000, "digest": "sha256"}),
+    ("scrypt", {"n": 8192}),
+    ("scrypt", {"n": 16384}),
+    ("scrypt", {"n": 32768}),
+]
+
+
+def do_benchmark(iterations):
+    for scheme, settings in SETTINGS:
+        try:
+            hasher = hashing.get_hasher(scheme, **settings)
+        except KeyError:
+            print "    %-45s not available" % scheme
+            continue
+
+        record = hasher.hash("correct horse battery staple")
+
+        assert hashing.verify("correct horse battery staple", record)
+
+        taken = timeit.timeit(
+            lambda: hashing.verify("correct horse battery staple", record),
+            number=iterations
+        )
+
+        print "    %-45s %10.2f ms per hash" % (
+            "%s %s" % (scheme, hasher.settings or ""),
+            (taken / iterations) * 1000
+        )
+
+
+if __name__ == "__main__":
+    logging.disable(logging.CRITICAL)
+
+    if len(sys.argv) > 1:
+        do_benchmark(int(sys.argv[1]))
+    else:
+        do_benchmark(ITERATIONS)
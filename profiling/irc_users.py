@@ -0,0 +1,171 @@
+__author__ = 'Gareth Coles'
+
+"""
+Benchmark user lookups in the IRC protocol on a simulated large network.
+
+Usage: python profiling/irc_users.py [number of users]
+
+Lookups go through the protocol's indexed user registry. For comparison,
+the same lookups are also done with a linear scan of every user, which is
+how get_users used to work.
+"""
+
+import os
+import sys
+print os.getcwd()
+
+sys.path.append(os.getcwd())  # Because herp derp
+
+import logging
+import random
+import timeit
+
+from system.event_manager import EventManager
+from system.logging.logger import getLogger
+from system.protocols.irc.channel import Channel
+from system.protocols.irc.protocol import Protocol
+from system.protocols.irc.users import Users
+
+from utils.irc import IRCUtils
+
+#: How many users to simulate, unless given on the command line
+USERS = 50000
+
+#: How many channels to spread them across
+CHANNELS = 200
+
+#: How many lookups to do per benchmark
+ITERATIONS = 2000
+
+
+class BenchProtocol(Protocol):
+    """
+    An IRC protocol that doesn't connect anywhere.
+    """
+
+    def __init__(self):
+        self.log = getLogger("Benchmark")
+        self.log.setLevel(logging.INFO)
+        self.event_manager = EventManager()
+        self.event_manager.logger.setLevel(logging.INFO)
+        self.utils = IRCUtils(self.log)
+        self._users = Users(self.utils)
+        self._channels = {}
+        self.nickname = "Ultros"
+
+
+def make_protocol(users):
+    """
+    Create a protocol and fill it up with users joined to a bunch of
+    channels.
+    """
+
+    protocol = BenchProtocol()
+
+    channels = []
+
+    for i in xrange(CHANNELS):
+        channel = Channel(protocol, "#Channel-%s" % i)
+        protocol.set_channel(channel.name, channel)
+        channels.append(channel)
+
+    masks = []
+
+    for i in xrange(users):
+        nickname = "User[%s]" % i
+        ident = "~ident%s" % (i % 1000)
+        host = "host-%s.example.com" % i
+
+        for channel in random.sample(channels, 3):
+            protocol.user_join_channel(nickname, ident, host, channel)
+
+        masks.append((nickname, ident, host))
+
+    return protocol, channels, masks
+
+
+def linear_get_users(protocol, nickname=None, ident=None, host=None):
+    """
+    The old way of finding users - case-fold and compare every one of them.
+    """
+
+    matches = []
+
+    if ident:
+        ident = ident.lower()
+    if host:
+        host = host.lower()
+
+    for user in list(protocol._users):
+        if (nickname and
+                not protocol.utils.compare_nicknames(nickname, user.nickname)):
+            continue
+        if ident and ident != user.ident.lower():
+            continue
+        if host and host != user.host.lower():
+            continue
+        matches.append(user)
+
+    return matches
+
+
+def bench(func, masks, iterations=ITERATIONS):
+    """
+    Call a function with random hostmasks and return the average cost of
+    each call in microseconds.
+    """
+
+    sample = [random.choice(masks) for _ in xrange(iterations)]
+    sample = iter(sample)
+
+    taken = timeit.timeit(lambda: func(*next(sample)), number=iterations)
+
+    return (taken / iterations) * 1000000
+
+
+def do_benchmark(users):
+    print "Simulating %s users in %s channels.." % (users, CHANNELS)
+    protocol, channels, masks = make_protocol(users)
+
+    def nick_change(nickname, ident, host):
+        prefix = "%s!%s@%s" % (nickname, ident, host)
+        protocol.irc_NICK(prefix, ["Renamed"])
+        protocol.irc_NICK("Renamed!%s@%s" % (ident, host), [nickname])
+
+    def churn(nickname, ident, host):
+        channel = random.choice(channels)
+        user = protocol.user_join_channel(nickname, ident, host, channel)
+        protocol.user_channel_part(user, channel)
+
+        if not user.channels:  # We lost track of them; add them back
+            protocol.user_join_channel(nickname, ident, host, channel)
+
+    results = [
+        ("get_user(nickname)",
+         bench(lambda n, i, h: protocol.get_user(nickname=n), masks)),
+        ("get_user(nickname, ident, host)",
+         bench(lambda n, i, h: protocol.get_user(nickname=n, ident=i,
+                                                 host=h), masks)),
+        ("get_user(nickname), missing",
+         bench(lambda n, i, h: protocol.get_user(nickname=n + "_"), masks)),
+        ("user string (privmsg)",
+         bench(lambda n, i, h: protocol._get_user_from_user_string(
+             "%s!%s@%s" % (n, i, h)), masks)),
+        ("NICK there and back", bench(nick_change, masks)),
+        ("JOIN and PART", bench(churn, masks)),
+        ("Linear scan (old)",
+         bench(lambda n, i, h: linear_get_users(protocol, nickname=n),
+               masks, 20)),
+    ]
+
+    print "Per-call cost:"
+
+    for name, taken in results:
+        print "    %-35s %12.2f us" % (name, taken)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        do_benchmark(int(sys.argv[1]))
+    else:
+        do_benchmark(USERS)
@@ -0,0 +1,165 @@
+__author__ = 'Gareth Coles'
+
+"""
+Benchmark loading and saving data files with the storage system.
+
+Usage: python profiling/storage.py [number of entries]
+
+Files are shaped like the auth plugin's users and permissions data. The
+plain PyYAML/json functions the storage system used to call are timed
+alongside the storage system's own serializers, data classes, and their
+write-behind, journal and unchanged-reload paths.
+"""
+
+import os
+import sys
+print os.getcwd()
+
+sys.path.append(os.getcwd())  # Because herp derp
+
+import json
+import shutil
+import tempfile
+import timeit
+import yaml
+
+from system.storage import serializers
+from system.storage.data import JSONData, YamlData
+
+#: How many entries to put in each file, unless given on the command line
+ENTRIES = 10000
+
+#: How many times to repeat each benchmark
+ITERATIONS = 3
+
+
+def generate_data(entries):
+    """
+    Generate a users file and a permissions file with a bunch of entries.
+    """
+
+    users = {}
+    permissions = {"users": {}, "groups": {}}
+
+    for i in xrange(entries):
+        username = u"user%s" % i
+
+        users[username] = {
+            "password": "%064x" % (i * 7919),
+            "salt": "%032x" % i,
+            "algorithm": "pbkdf2_sha256",
+            "iterations": 100000
+        }
+
+        permissions["users"][username] = {
+            "group": "default" if i % 10 else "admin",
+            "permissions": ["urls.shorten", "factoids.get.#channel%s" % i],
+            "options": {"superadmin": False, "theme": u"dark"},
+            "protocols": {"irc-esper": {"#channel%s" % (i % 50): [
+                "factoids.set", "urls.title"
+            ]}}
+        }
+
+    for i in xrange(entries / 100):
+        permissions["groups"]["group%s" % i] = {
+            "inherit": "default",
+            "permissions": ["group.permission.%s" % x for x in xrange(20)],
+            "options": {"rank": i}
+        }
+
+    return [("users", users), ("permissions", permissions)]
+
+
+def bench(func):
+    """
+    Run something a few times and return the average time taken in
+    milliseconds.
+    """
+
+    return (timeit.timeit(func, number=ITERATIONS) / ITERATIONS) * 1000
+
+
+def do_benchmark(entries):
+    tmpdir = tempfile.mkdtemp()
+
+    try:
+        print "Serializers: %s/%s, JSON: %s/%s" % (
+            serializers.BaseLoader.__name__, serializers.BaseDumper.__name__,
+            getattr(serializers.fast_json, "__name__", "json"),
+            serializers.pretty_json.__name__
+        )
+
+        for name, data in generate_data(entries):
+            yml = os.path.join(tmpdir, name + ".yml")
+            jsn = os.path.join(tmpdir, name + ".json")
+
+            with open(yml, "w") as fh:
+                fh.write(yaml.dump(data, default_flow_style=False))
+
+            with open(jsn, "w") as fh:
+                fh.write(json.dumps(data, indent=4, sort_keys=True,
+                                    separators=(",", ": ")))
+
+            print ""
+            print "%s (%s entries, %s KB YAML, %s KB JSON)" % (
+                name, entries, os.path.getsize(yml) / 1024,
+                os.path.getsize(jsn) / 1024
+            )
+
+            yaml_data = YamlData(yml)
+            json_data = JSONData(jsn)
+            journaled = YamlData(yml, journal=True)
+            key = sorted(data.keys())[-1]
+
+            def journal_save():
+                with journaled:
+                    journaled[key] = data[key]
+
+            def write_behind_save():
+                behind = YamlData(yml, save_delay=60)
+
+                for _ in xrange(100):
+                    with behind:
+                        behind[key] = data[key]
+
+                behind.flush()
+
+            results = [
+                ("YAML load (yaml.load)",
+                 bench(lambda: yaml.load(open(yml)))),
+                ("YAML load (storage)",
+                 bench(lambda: serializers.yaml_load(open(yml)))),
+                ("YAML dump (yaml.dump)",
+                 bench(lambda: yaml.dump(data, default_flow_style=False))),
+                ("YAML dump (storage)",
+                 bench(lambda: serializers.yaml_dump(
+                     data, default_flow_style=False))),
+                ("JSON load (json.load)",
+                 bench(lambda: json.load(open(jsn)))),
+                ("JSON load (storage)",
+                 bench(lambda: serializers.json_load(open(jsn)))),
+                ("JSON dump (json.dumps)",
+                 bench(lambda: json.dumps(data, indent=4, sort_keys=True,
+                                          separators=(",", ": ")))),
+                ("JSON dump (storage)",
+                 bench(lambda: serializers.json_dumps(data, pretty=True))),
+                ("YamlData save", bench(yaml_data.save)),
+                ("YamlData reload, unchanged", bench(yaml_data.reload)),
+                ("JSONData save", bench(json_data.save)),
+                ("JSONData reload, unchanged", bench(json_data.reload)),
+                ("YamlData save, journaled", bench(journal_save)),
+                ("YamlData 100 saves, write-behind",
+                 bench(write_behind_save)),
+            ]
+
+            for title, taken in results:
+                print "    %-35s %10.2f ms" % (title, taken)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        do_benchmark(int(sys.argv[1]))
+    else:
+        do_benchmark(ENTRIES)
@@ -0,0 +1,106 @@
+__author__ = 'Gareth Coles'
+
+"""
+Compare the streaming title extractor with parsing whole pages using
+BeautifulSoup, which is what the URLs plugin used to do.
+
+Usage: python profiling/titles.py [directory of saved .html pages]
+
+Without a directory, a set of generated pages of various sizes is used.
+"""
+
+import os
+import sys
+print os.getcwd()
+
+sys.path.append(os.getcwd())  # Because herp derp
+
+import glob
+import timeit
+
+from bs4 import BeautifulSoup
+
+from utils.html import HTMLTitleExtractor
+
+#: How many times to parse each page
+ITERATIONS = 20
+
+#: Chunk size to feed the extractor with, like a network read would
+CHUNK_SIZE = 8192
+
+
+def generate_pages():
+    """
+    Generate some pages of various sizes, with the title near the top as
+    it usually is.
+    """
+
+    body = "<p>Some body that I used to know &amp; love.</p>\n"
+    head = ("<!DOCTYPE html><html><head><meta charset=\"utf-8\">"
+            "<script>var x = '<title>Not this</title>';</script>"
+            "<link rel=\"stylesheet\" href=\"style.css\">"
+            "<title>  A page\n with a title &#8212; %s </title></head><body>")
+
+    pages = []
+
+    for name, size in [("small", 10), ("medium", 2000), ("large", 50000)]:
+        page = (head % name) + (body * size) + "</body></html>"
+        pages.append(("generated-%s" % name, page))
+
+    return pages
+
+
+def load_pages(directory):
+    pages = []
+
+    for filename in sorted(glob.glob(os.path.join(directory, "*.htm*"))):
+        with open(filename, "rb") as fh:
+            pages.append((os.path.basename(filename), fh.read()))
+
+    return pages
+
+
+def soup_title(page):
+    soup = BeautifulSoup(page, "html.parser")
+
+    if soup.title and soup.title.string:
+        return u" ".join(soup.title.string.split())
+    return None
+
+
+def extractor_title(page):
+    extractor = HTMLTitleExtractor()
+
+    for i in xrange(0, len(page), CHUNK_SIZE):
+        if extractor.feed(page[i:i + CHUNK_SIZE]):
+            break
+
+    return extractor.get_title()
+
+
+def do_benchmark(pages):
+    print "%-30s %10s %12s %12s %8s" % ("Page", "Bytes", "Soup (ms)",
+                                        "Stream (ms)", "Speedup")
+
+    for name, page in pages:
+        soup = timeit.timeit(lambda: soup_title(page), number=ITERATIONS)
+        stream = timeit.timeit(lambda: extractor_title(page),
+                               number=ITERATIONS)
+
+        soup = (soup / ITERATIONS) * 1000
+        stream = (stream / ITERATIONS) * 1000
+
+        print "%-30s %10s %12.3f %12.3f %7.1fx" % (
+            name[:30], len(page), soup, stream, soup / max(stream, 0.000001)
+        )
+
+        if soup_title(page) != extractor_title(page):
+            print "    Titles differ: %r / %r" % (soup_title(page),
+                                                  extractor_title(page))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        do_benchmark(load_pages(sys.argv[1]))
+    else:
+        do_benchmark(generate_pages())
@@ -1,8 +1,6 @@
 # coding=utf-8
 __author__ = "Gareth Coles"
 
-import shlex
-
 from system.decorators.log import deprecated
 from system.decorators.ratelimit import RateLimitExceededError
 from system.enums import CommandState
@@ -15,6 +13,96 @@ from system.logging.logger import getLogger
 from system.translations import Translations
 _ = Translations().get()
 
+QUOTE = '"'
+ESCAPE = "\\"
+
+
+def split_args(args):
+    """Split a string of command arguments, honouring double quotes.
+
+    This works the same way as a POSIX-mode `shlex.shlex` with
+    `whitespace_split` enabled, double quotes as the only quote character
+    and no comments, which is what we used to use - but without all the
+    overhead, and it copes with unicode.
+
+    * Arguments are separated by whitespace
+    * Text within double quotes is kept together, and the quotes are
+      removed. Quoted text may be joined to the text around it, and ""
+      is an empty argument.
+    * A backslash outside of quotes escapes the next character. Within
+      quotes, it only escapes double quotes and backslashes.
+
+    >>> split_args('login "my user" pass\\ word')
+    ['login', 'my user', 'pass word']
+
+    :param args: The arguments to split
+    :type args: str
+
+    :raises: ValueError if there's an unclosed quote, or a backslash at the
+        end of the string
+
+    :return: The arguments
+    :rtype: list
+    """
+
+    if QUOTE not in args and ESCAPE not in args:
+        return args.split()  # Nothing special, so take the fast way out
+
+    result = []
+    token = []
+    in_token = False  # Whether we're in a token, even an empty one
+
+    i = 0
+    length = len(args)
+
+    while i < length:
+        char = args[i]
+
+        if char.isspace():
+            if in_token:
+                result.append("".join(token))
+                token = []
+                in_token = False
+        elif char == QUOTE:
+            in_token = True
+            end = i + 1
+
+            while True:
+                if end >= length:
+                    raise ValueError("No closing quotation")
+
+                char = args[end]
+
+                if char == QUOTE:
+                    break
+
+                if char == ESCAPE and end + 1 < length \
+                        and args[end + 1] in (QUOTE, ESCAPE):
+                    end += 1
+                    char = args[end]
+
+                token.append(char)
+                end += 1
+
+            i = end
+        elif char == ESCAPE:
+            if i + 1 >= length:
+                raise ValueError("No escaped character")
+
+            in_token = True
+            i += 1
+            token.append(args[i])
+        else:
+            in_token = True
+            token.append(char)
+
+        i += 1
+
+    if in_token:
+        result.append("".join(token))
+
+    return result
+
 
 class CommandManager(object):
     """This is the command manager. It's in charge of tracking commands that
@@ -30,7 +118,9 @@ class CommandManager(object):
     #:         "command": {
     #:             "f": func(),
     #:             "permission": "plugin.command",
-    #:             "owner": object
+    #:             "owner": object,
+    #:             "default": False,
+    #:             "parse_args": True
     #:         }
     #:     }
     commands = {}
@@ -66,6 +156,18 @@ class CommandManager(object):
     #: Storage for the factory manager, to avoid function call overhead.
     factory_manager = None
 
+    #: Command prefixes we've seen, so we don't have to work them out for
+    #: every message. ::
+    #:
+    #:     prefixes = {
+    #:         (control_char, our_name): (lowercased prefix, length)
+    #:     }
+    prefixes = {}
+
+    #: How many prefixes to remember before starting over - they change
+    #: when we change nickname, so they'd build up over time otherwise
+    max_prefixes = 100
+
     def __init__(self):
         self.logger = getLogger("Commands")
         self.event_manager = EventManager()
@@ -81,7 +183,7 @@ class CommandManager(object):
         self.factory_manager = factory_manager
 
     def register_command(self, command, handler, owner, permission=None,
-                         aliases=None, default=False):
+                         aliases=None, default=False, parse_args=True):
         """Register a command, provided it hasn't been registered already.
 
         The params should go like this.
@@ -93,6 +195,9 @@ class CommandManager(object):
         :param aliases: A list of aliases for the command being registered.
         :param default: Whether the command should be run when there is no
             permissions manager installed.
+        :param parse_args: Whether to split the arguments for the handler.
+            If your handler only uses the raw arguments, set this to False
+            and it'll be given None instead of a list.
 
         :type command: str
         :type handler: function
@@ -100,6 +205,7 @@ class CommandManager(object):
         :type permission: str, None
         :type aliases: list, None
         :type default: bool
+        :type parse_args: bool
 
         :returns: Whether the command was registered or not
         :rtype: Boolean
@@ -123,7 +229,8 @@ class CommandManager(object):
             "f": handler,
             "permission": permission,
             "owner": owner,
-            "default": default
+            "default": default,
+            "parse_args": parse_args
         }
 
         self.commands[command] = commandobj
@@ -203,18 +310,14 @@ class CommandManager(object):
             if hasattr(protocol, "nickname"):
                 our_name = protocol.nickname
 
-        if our_name is not None:
-            control_char = control_char.replace("{NAME}", our_name)
-            control_char = control_char.replace("{NICK}", our_name)
-
-        if len(in_str) < len(control_char):
-            self.logger.trace("Control character sequence is longer than the "
-                              "input string, so this cannot be a command.")
-            return CommandState.NotACommand, None
+        try:
+            prefix, length = self.prefixes[control_char, our_name]
+        except KeyError:
+            prefix, length = self.get_prefix(control_char, our_name)
 
-        if in_str.lower().startswith(control_char.lower()):  # It's a command!
+        if in_str[:length].lower() == prefix:  # It's a command!
             # Remove the command char(s) from the start
-            replaced = in_str[len(control_char):]
+            replaced = in_str[length:]
 
             split = replaced.split(None, 1)
             if not split:
@@ -240,9 +343,37 @@ class CommandManager(object):
 
             return result
 
-        self.logger.debug("Command not found.")
         return CommandState.NotACommand, None
 
+    def get_prefix(self, control_char, our_name=None):
+        """Work out the prefix for commands, given the control characters and
+        our name on a protocol, and remember it for next time.
+
+        :param control_char: The control characters, which may contain
+            {NAME} or {NICK}
+        :param our_name: The name of the bot on the protocol, or None
+
+        :type control_char: str
+        :type our_name: str, None
+
+        :return: Tuple containing the lowercased prefix and its length
+        :rtype: tuple(str, int)
+        """
+
+        key = (control_char, our_name)
+
+        if our_name is not None:
+            control_char = control_char.replace("{NAME}", our_name)
+            control_char = control_char.replace("{NICK}", our_name)
+
+        if len(self.prefixes) >= self.max_prefixes:
+            self.prefixes.clear()
+
+        result = (control_char.lower(), len(control_char))
+        self.prefixes[key] = result
+
+        return result
+
     def run_command(self, command, caller, source, protocol, args):
         """Run a command, provided it's been registered.
 
@@ -250,13 +381,13 @@ class CommandManager(object):
         :param caller: Who ran the command
         :param source: Where they ran the command
         :param protocol: The protocol they're part of
-        :param args: A list of arguments for the command
+        :param args: The arguments for the command, as a string
 
         :type command: str
         :type caller: User
         :type source: User
         :type protocol: Protocol
-        :type args: list
+        :type args: str
 
         :return: Tuple containing CommandState representing the state of
             the command, and either None or an Exception.
@@ -277,14 +408,13 @@ class CommandManager(object):
             command = self.aliases[command]
         # Parse args
         raw_args = args
-        try:
-            lex = shlex.shlex(args, posix=True)
-            lex.whitespace_split = True
-            lex.quotes = '"'
-            lex.commenters = ""
-            parsed_args = list(lex)
-        except ValueError:
-            parsed_args = None
+        parsed_args = None
+
+        if self.commands[command].get("parse_args", True):
+            try:
+                parsed_args = split_args(args)
+            except ValueError:
+                pass
         try:
             if self.commands[command]["permission"]:
                 if not self.perm_handler:
@@ -7,6 +7,7 @@ from functools import wraps
 import Queue
 import time
 
+from twisted.internet import reactor
 from twisted.internet.defer import Deferred
 from twisted.internet.task import LoopingCall
 from twisted.python.failure import Failure
@@ -135,3 +136,264 @@ class RateLimiter(object):
         self.allowance += time_passed * (self.soft_limit / self.time_period)
         if self.allowance > self.soft_limit:
             self.allowance = self.soft_limit
+
+
+def _refill(tokens, updated, now, capacity, rate):
+    """
+    Work out how many tokens a bucket has, given how many it had when it
+    was last updated.
+    """
+
+    if now > updated:
+        tokens += (now - updated) * rate
+
+        if tokens > capacity:
+            tokens = capacity
+
+    return tokens
+
+
+class TokenBucket(object):
+    """
+    A single token bucket.
+
+    The bucket holds up to *capacity* tokens, and is refilled at *rate*
+    tokens per second. Each action consumes a token, and is refused when
+    there aren't enough left - so bursts of up to *capacity* actions are
+    allowed, but the rate is limited to *rate* over time.
+
+    :param capacity: The most tokens the bucket can hold
+    :param rate: Tokens added per second
+    :param clock: Something with a seconds() method, like the reactor
+
+    :type capacity: int, float
+    :type rate: float
+    """
+
+    __slots__ = ("capacity", "rate", "tokens", "updated", "clock")
+
+    def __init__(self, capacity, rate, clock=None):
+        if clock is None:
+            clock = reactor
+
+        self.capacity = capacity
+        self.rate = float(rate)
+        self.clock = clock
+
+        self.tokens = capacity
+        self.updated = clock.seconds()
+
+    def update(self):
+        """
+        Refill the bucket, based on how much time has passed.
+
+        :return: How many tokens are in the bucket
+        :rtype: float
+        """
+
+        now = self.clock.seconds()
+        self.tokens = _refill(self.tokens, self.updated, now, self.capacity,
+                              self.rate)
+        self.updated = now
+        return self.tokens
+
+    def consume(self, tokens=1):
+        """
+        Take tokens from the bucket, if there are enough.
+
+        :param tokens: How many tokens to take
+        :type tokens: int, float
+
+        :return: Whether there were enough tokens
+        :rtype: bool
+        """
+
+        if self.update() < tokens:
+            return False
+
+        self.tokens -= tokens
+        return True
+
+
+class TokenBucketTable(object):
+    """
+    A set of token buckets, keyed by whatever you like - a username or a
+    hostmask, for example. They all share the same capacity and rate.
+
+    Buckets are stored as compact (tokens, updated) tuples, and only exist
+    while they're not full - a bucket that's refilled completely is the same
+    as one that doesn't exist, so `sweep` throws them away. If there are
+    ever more than *max_size* buckets, the fullest ones are thrown away
+    too, so memory use stays bounded even when someone's spraying keys at
+    us - and the buckets that are actually limiting someone are the last
+    to go.
+
+    Call `start` to sweep automatically every so often.
+
+    :param capacity: The most tokens each bucket can hold
+    :param rate: Tokens added to each bucket per second
+    :param max_size: The most buckets to keep, or None for no limit
+    :param clock: Something with a seconds() method, like the reactor
+
+    :type capacity: int, float
+    :type rate: float
+    :type max_size: int, None
+    """
+
+    def __init__(self, capacity, rate, max_size=None, clock=None):
+        if clock is None:
+            clock = reactor
+
+        self.capacity = capacity
+        self.rate = float(rate)
+        self.max_size = max_size
+        self.clock = clock
+
+        self._buckets = {}  # {key: (tokens, updated)}
+        self._looping_call = None
+
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def __contains__(self, key):
+        return key in self._buckets
+
+    def tokens(self, key):
+        """
+        Get how many tokens a bucket has, without taking any.
+
+        :param key: The bucket's key
+
+        :rtype: float
+        """
+
+        bucket = self._buckets.get(key, None)
+
+        if bucket is None:
+            return self.capacity
+
+        return _refill(bucket[0], bucket[1], self.clock.seconds(),
+                       self.capacity, self.rate)
+
+    def consume(self, key, tokens=1):
+        """
+        Take tokens from a bucket, if there are enough.
+
+        :param key: The bucket's key
+        :param tokens: How many tokens to take
+
+        :type tokens: int, float
+
+        :return: Whether there were enough tokens
+        :rtype: bool
+        """
+
+        now = self.clock.seconds()
+        bucket = self._buckets.get(key, None)
+
+        if bucket is None:
+            available = self.capacity
+        else:
+            available = _refill(bucket[0], bucket[1], now, self.capacity,
+                                self.rate)
+
+        if available < tokens:
+            return False
+
+        self._buckets[key] = (available - tokens, now)
+
+        if self.max_size is not None and len(self._buckets) > self.max_size:
+            self._evict()
+
+        return True
+
+    def reset(self, key):
+        """
+        Refill a bucket completely.
+
+        :param key: The bucket's key
+        """
+
+        self._buckets.pop(key, None)
+
+    def clear(self):
+        """
+        Refill every bucket.
+        """
+
+        self._buckets.clear()
+
+    def sweep(self):
+        """
+        Throw away buckets that have refilled completely.
+
+        :return: How many buckets were thrown away
+        :rtype: int
+        """
+
+        now = self.clock.seconds()
+        capacity = self.capacity
+        rate = self.rate
+
+        full = [
+            key for key, (tokens, updated) in self._buckets.iteritems()
+            if _refill(tokens, updated, now, capacity, rate) >= capacity
+        ]
+
+        for key in full:
+            del self._buckets[key]
+
+        return len(full)
+
+    def _evict(self):
+        self.sweep()
+
+        if len(self._buckets) <= self.max_size:
+            return
+
+        # Everything's in use, so throw away the fullest tenth of the
+        # buckets, oldest first - doing a few at once saves sorting on every
+        # new key. Refused attempts don't touch a bucket, so going by age
+        # alone would let a spray of new keys reset the emptiest ones.
+        now = self.clock.seconds()
+        capacity = self.capacity
+        rate = self.rate
+
+        def fullest(item):
+            tokens, updated = item[1]
+            return -_refill(tokens, updated, now, capacity, rate), updated
+
+        count = len(self._buckets) - self.max_size + self.max_size // 10
+        buckets = sorted(self._buckets.iteritems(), key=fullest)
+
+        for key, bucket in buckets[:count]:
+            del self._buckets[key]
+
+        self.evicted += count
+        _log.debug("Evicted %s token buckets" % count)
+
+    def start(self, interval=60):
+        """
+        Start sweeping periodically.
+
+        :param interval: Seconds between sweeps
+        :type interval: int, float
+        """
+
+        self.stop()
+
+        self._looping_call = LoopingCall(self.sweep)
+        self._looping_call.clock = self.clock
+        self._looping_call.start(interval, now=False)
+
+    def stop(self):
+        """
+        Stop sweeping periodically, if we were.
+        """
+
+        if self._looping_call is not None:
+            if self._looping_call.running:
+                self._looping_call.stop()
+            self._looping_call = None
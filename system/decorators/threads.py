@@ -3,16 +3,22 @@
 Various threading-related decorators. These allow you to use the threadpool.
 """
 
+import time
+
+from collections import deque
 from functools import wraps
-from threading import Thread
+from threading import Lock, Thread
 
 from twisted.python.threadpool import ThreadPool
 
 from system.decorators.log import deprecated
+from system.enums import QueuePolicy
+from system.logging.logger import getLogger
 from system.translations import Translations
 _ = Translations().get()
 
 pool = ThreadPool(name="Decorators")
+_log = getLogger(__name__)
 
 
 @deprecated("Use run_async_threadpool instead.")
@@ -148,3 +154,212 @@ def run_async_threadpool_callback(cb):
         return async_func
 
     return inner
+
+
+class BoundedQueue(object):
+    """
+    A bounded queue of work to be run in the decorator threadpool.
+
+    Work is run by at most `workers` threads from the threadpool at once, and
+    at most `max_depth` items may be waiting at any time. When the queue is
+    full, the `policy` decides what happens to new work - see `QueuePolicy`
+    for the available policies. This is useful when you may be handed a lot
+    of work in a very short time, and you'd rather lose some of it than tie
+    up every thread in the pool.
+
+    For example::
+
+        queue = BoundedQueue("MyPlugin", workers=2, max_depth=50)
+
+        @run_async_queue(queue)
+        def func():
+            # Something that takes forever to run
+            pass
+
+    :param name: A name for the queue, used for logging
+    :param workers: The maximum number of threads to use at once
+    :param max_depth: The maximum number of waiting items
+    :param policy: What to do with new work when the queue is full
+
+    :type name: str
+    :type workers: int
+    :type max_depth: int
+    :type policy: QueuePolicy
+    """
+
+    def __init__(self, name, workers=1, max_depth=100,
+                 policy=QueuePolicy.Drop):
+        self.name = name
+        self.workers = workers
+        self.max_depth = max_depth
+        self.policy = policy
+
+        self._lock = Lock()
+        self._queue = deque()
+        self._keys = {}
+        self._running = 0
+        self._warned = False
+
+        self.submitted = 0
+        self.completed = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def __len__(self):
+        return len(self._queue)
+
+    @property
+    def full(self):
+        """
+        Whether the queue is full. If it is, new work will be dropped or
+        coalesced, depending on the policy.
+        """
+
+        return len(self._queue) >= self.max_depth
+
+    def submit(self, key, func, *args, **kwargs):
+        """
+        Queue some work to be run in the threadpool.
+
+        :param key: A key identifying the work for the coalesce policy, or
+            None if it can't be coalesced
+        :param func: The function to call
+
+        :return: False if the work was dropped, otherwise True
+        :rtype: bool
+        """
+
+        with self._lock:
+            self.submitted += 1
+
+            if self.full:
+                item = self._keys.get(key)
+
+                if key is None or item is None \
+                        or self.policy is not QueuePolicy.Coalesce:
+                    self.dropped += 1
+
+                    if not self._warned:
+                        self._warned = True
+                        _log.warning(_("Work queue '%s' is full, work will be "
+                                       "dropped until it catches up")
+                                     % self.name)
+                    return False
+
+                # Keep the queue position and age of the original work
+                item[2:] = [func, args, kwargs]
+                self.coalesced += 1
+                return True
+
+            self._warned = False
+            item = [time.time(), key, func, args, kwargs]
+            self._queue.append(item)
+
+            if key is not None:
+                self._keys[key] = item
+
+            if self._running >= self.workers:
+                return True
+
+            self._running += 1
+
+        if not pool.started:
+            pool.start()
+
+        pool.callInThread(self._work)
+        return True
+
+    def _work(self):
+        while True:
+            with self._lock:
+                if not self._queue:
+                    self._running -= 1
+                    return
+
+                item = self._queue.popleft()
+                enqueued, key, func, args, kwargs = item
+
+                if key is not None and self._keys.get(key) is item:
+                    del self._keys[key]
+
+                waited = time.time() - enqueued
+                self.wait_total += waited
+
+                if waited > self.wait_max:
+                    self.wait_max = waited
+
+            try:
+                func(*args, **kwargs)
+            except Exception:
+                _log.exception(_("Error running work from queue '%s'")
+                               % self.name)
+
+            with self._lock:
+                self.completed += 1
+
+    def stats(self):
+        """
+        Get some statistics about the queue.
+
+        Wait times are in seconds, and are measured from when the work was
+        submitted to when a thread started running it.
+
+        :return: A dict of statistics
+        :rtype: dict
+        """
+
+        with self._lock:
+            started = self.submitted - self.dropped - self.coalesced \
+                - len(self._queue)
+
+            return {
+                "name": self.name,
+                "queued": len(self._queue),
+                "running": self._running,
+                "workers": self.workers,
+                "max_depth": self.max_depth,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "dropped": self.dropped,
+                "coalesced": self.coalesced,
+                "wait_avg": self.wait_total / started if started else 0.0,
+                "wait_max": self.wait_max
+            }
+
+
+def run_async_queue(queue, key=None):
+    """
+    Function decorator to run in a thread from the threadpool, by way of a
+    `BoundedQueue`.
+
+    This works like `run_async_threadpool`, but the number of threads used
+    and the amount of waiting work are limited by the queue. Calling the
+    decorated function returns False if the work was dropped because the
+    queue was full.
+
+    For example::
+
+        queue = BoundedQueue("Titles", workers=4, max_depth=20)
+
+        @run_async_queue(queue)
+        def func():
+            # Something that takes forever to run
+            pass
+
+    :param queue: The queue to submit work to
+    :param key: A key for coalescing work, if the queue uses that policy
+
+    :type queue: BoundedQueue
+    """
+
+    def inner(func):
+
+        @wraps(func)
+        def async_func(*args, **kwargs):
+            return queue.submit(key, func, *args, **kwargs)
+
+        return async_func
+
+    return inner
@@ -64,3 +64,15 @@ class ProtocolState(Enum):
     Loaded = 1
     AlreadyLoaded = 2
     Unloaded = 3
+
+
+class QueuePolicy(Enum):
+    """What a bounded work queue should do when it's full.
+
+    * Drop - New work is dropped.
+    * Coalesce - New work replaces queued work with the same key, and is
+        dropped if there isn't any.
+    """
+
+    Drop = 0
+    Coalesce = 1
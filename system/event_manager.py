@@ -1,12 +1,17 @@
 # coding=utf-8
 __author__ = "Gareth Coles"
 
+import logbook
+
 from operator import itemgetter
 
 from twisted.internet import reactor
+from twisted.internet.defer import CancelledError, Deferred
 
 from system.singleton import Singleton
 from system.decorators import run_async
+from system.decorators.threads import BoundedQueue
+from system.enums import QueuePolicy
 from system.logging.logger import getLogger
 
 from system.translations import Translations
@@ -58,20 +63,232 @@ class EventManager(object):
     #:                 "cancelled:" bool(),
     #:                 "filter": func() or None,  # For event filtering
     #:                 "extra_args": [],  # Extra args to pass
-    #:                 "extra_kwargs": {}  # Extra kwargs to pass
+    #:                 "extra_kwargs": {},  # Extra kwargs to pass
+    #:                 "event_type": tuple() or None,  # Event classes
+    #:                 "protocol": frozenset() or None,  # Protocol names
+    #:                 "protocol_type": frozenset() or None,  # Protocol TYPEs
+    #:                 "timeout": int() or None  # For returned Deferreds
     #:             }
     #:         ]
     #:     }
     callbacks = {}
 
+    #: Compiled dispatch plans, rebuilt whenever the callbacks for an event
+    #: change. Each plan is a tuple of tuples, already sorted by priority::
+    #:
+    #:     plans = {
+    #:         "callback_name": (
+    #:             (name, function, filter, cancelled, args, kwargs,
+    #:              timeout),
+    #:         )
+    #:     }
+    plans = {}
+
+    #: Routing indexes for callbacks that have typed subscriptions. Plans for
+    #: each combination of event class, protocol name and protocol type are
+    #: worked out the first time they're seen and stored here::
+    #:
+    #:     routes = {
+    #:         "callback_name": {
+    #:             (event_class, protocol_name, protocol_type): plan
+    #:         }
+    #:     }
+    routes = {}
+
+    #: The subscriptions for each entry in a plan, only stored for callbacks
+    #: with typed subscriptions. Entries are (event_types, protocols,
+    #: protocol_types) tuples, in the same order as the plan.
+    subscriptions = {}
+
+    #: Bounded work queues for plugins that want their threaded handlers run
+    #: on the threadpool, rather than in a new thread for every event::
+    #:
+    #:     queues = {
+    #:         "plugin_name": BoundedQueue()
+    #:     }
+    queues = {}
+
     def __init__(self):
         self.logger = getLogger("Events")
 
     def _sort(self, lst):
         return sorted(lst, key=itemgetter("priority", "name"), reverse=True)
 
+    def _compile(self, callback):
+        """
+        Rebuild the dispatch plan for a callback from its handler dicts.
+
+        Handlers with a filter that isn't callable are warned about here
+        and left out of the plan, so that we don't have to check this
+        every time an event is fired.
+
+        :param callback: The name of the callback
+        :type callback: str
+        """
+
+        self.routes.pop(callback, None)
+        self.subscriptions.pop(callback, None)
+
+        if callback not in self.callbacks:
+            self.plans.pop(callback, None)
+            return
+
+        plan = []
+        subscriptions = []
+
+        for cb in self.callbacks[callback]:
+            fltr = cb["filter"]
+
+            if fltr and not callable(fltr):
+                self.logger.warn(_("Not running event, filter is not "
+                                   "actually a callable. Bug the developers "
+                                   "of the %s plugin about it!") % cb["name"])
+                self.logger.warn(_("Value: %s") % fltr)
+                continue
+
+            plan.append((
+                cb["name"], cb["function"], fltr or None, cb["cancelled"],
+                tuple(cb["extra_args"]), dict(cb["extra_kwargs"]),
+                cb["timeout"]
+            ))
+            subscriptions.append((
+                cb["event_type"], cb["protocol"], cb["protocol_type"]
+            ))
+
+        self.plans[callback] = tuple(plan)
+
+        if any(any(sub) for sub in subscriptions):
+            self.routes[callback] = {}
+            self.subscriptions[callback] = tuple(subscriptions)
+
+    def _get_plan(self, callback, event):
+        """
+        Get the plan to run for a callback with an event, routed if the
+        callback has typed subscriptions.
+
+        :return: The plan, or None if there are no handlers
+        :rtype: tuple
+        """
+
+        plan = self.plans.get(callback)
+
+        if plan:
+            routes = self.routes.get(callback)
+
+            if routes is not None:
+                return self._route(callback, event, routes)
+
+        return plan
+
+    def _route(self, callback, event, routes):
+        """
+        Get the plan for a callback with typed subscriptions, containing
+        only the handlers that subscribed to this kind of event.
+
+        :param callback: The name of the callback
+        :param event: The event being fired
+        :param routes: The routing index for the callback
+
+        :return: The routed plan
+        :rtype: tuple
+        """
+
+        caller = event.caller
+        key = (event.__class__,
+               getattr(caller, "name", None),
+               getattr(caller, "TYPE", None))
+
+        plan = routes.get(key)
+
+        if plan is None:
+            mro = frozenset(key[0].__mro__)
+            plan = []
+
+            for entry, (event_types, protocols, protocol_types) in zip(
+                    self.plans[callback], self.subscriptions[callback]):
+                if event_types and mro.isdisjoint(event_types):
+                    continue
+                if protocols and key[1] not in protocols:
+                    continue
+                if protocol_types and key[2] not in protocol_types:
+                    continue
+
+                plan.append(entry)
+
+            plan = tuple(plan)
+            routes[key] = plan
+
+        return plan
+
+    def _watch(self, callback, name, d, timeout):
+        """
+        Log errors from a Deferred returned by a handler, and cancel it if
+        it doesn't fire within the timeout.
+
+        :param callback: The name of the callback
+        :param name: The name of the plugin the handler belongs to
+        :param d: The Deferred returned by the handler
+        :param timeout: Seconds to wait, or None to wait forever
+
+        :type d: Deferred
+        :return: The Deferred, which will always succeed with None
+        """
+
+        if timeout is not None:
+            call = reactor.callLater(timeout, d.cancel)
+
+            def cancel_call(result):
+                if call.active():
+                    call.cancel()
+                return result
+
+            d.addBoth(cancel_call)
+
+        def errback(failure):
+            if failure.check(CancelledError) and timeout is not None:
+                self.logger.warn(_("Handler for '%s' from plugin '%s' timed "
+                                   "out after %s seconds") %
+                                 (callback, name, timeout))
+            else:
+                self.logger.error(_("Error running callback '%s': %s") %
+                                  (callback, failure.getErrorMessage()))
+                self.logger.debug(failure.getTraceback())
+
+        d.addCallbacks(lambda _: None, errback)
+        return d
+
+    def _level_enabled(self, level):
+        """
+        Check whether our logger would actually output a message at the
+        given level, so we can avoid formatting messages nobody will see.
+        """
+
+        # Skip the forwarder's __getattr__, it's slow enough to matter here
+        logger = self.logger.logger
+
+        if logger.disabled or level < logger.level:
+            return False
+
+        if not logger.handlers:
+            # Not configured yet, so logbook's default handler gets it
+            return True
+
+        # The logger's own level is usually NOTSET - it's the handlers that
+        # decide what gets output. The null handler swallows everything
+        # that gets past the others, so it doesn't count.
+        for handler in logger.handlers:
+            if isinstance(handler, logbook.NullHandler):
+                continue
+
+            if level >= handler.level:
+                return True
+
+        return False
+
     def add_callback(self, callback, plugin, function, priority, fltr=None,
-                     cancelled=False, extra_args=None, extra_kwargs=None):
+                     cancelled=False, extra_args=None, extra_kwargs=None,
+                     event_type=None, protocol=None, protocol_type=None,
+                     timeout=None):
         """
         Add a callback. Call this from your plugin to handle events.
 
@@ -90,6 +307,27 @@ class EventManager(object):
         :param cancelled: Whether to handle cancelled events or not
         :param extra_args: Extra arguments to pass to the handler.
         :param extra_kwargs: Extra keyword arguments to pass to the handler.
+        :param event_type: An event class, or a list of them. If supplied,
+                           the handler will only be run for events that are
+                           instances of one of these classes.
+        :param protocol: A protocol name, or a list of them. If supplied,
+                         the handler will only be run for events thrown by
+                         these protocols.
+        :param protocol_type: A protocol type (for example, "irc"), or a list
+                              of them. If supplied, the handler will only be
+                              run for events thrown by protocols of these
+                              types.
+
+        :param timeout: If the handler returns a Deferred, the number of
+                        seconds to wait for it before cancelling it.
+
+        Handlers that make use of event_type, protocol or protocol_type are
+        routed to ahead of time, so they're much cheaper than doing the same
+        checks in a filter function.
+
+        Handlers may return a Deferred if they do their work asynchronously.
+        Errors from it will be logged, and `run_callback_async` will wait for
+        it before running the next handler.
 
         :type callback: str
         :type plugin: PluginObject
@@ -99,6 +337,10 @@ class EventManager(object):
         :type cancelled: bool
         :type extra_args: list
         :type extra_kwargs: dict
+        :type event_type: type, list
+        :type protocol: str, list
+        :type protocol_type: str, list
+        :type timeout: int, float
         """
         if extra_args is None:
             extra_args = []
@@ -119,13 +361,76 @@ class EventManager(object):
                 "cancelled": cancelled,
                 "filter": fltr,
                 "extra_args": extra_args,
-                "extra_kwargs": extra_kwargs}
+                "extra_kwargs": extra_kwargs,
+                "event_type": None,
+                "protocol": None,
+                "protocol_type": None,
+                "timeout": timeout}
+
+        if event_type is not None:
+            if isinstance(event_type, type):
+                event_type = [event_type]
+            data["event_type"] = tuple(event_type)
+        if protocol is not None:
+            if isinstance(protocol, basestring):
+                protocol = [protocol]
+            data["protocol"] = frozenset(protocol)
+        if protocol_type is not None:
+            if isinstance(protocol_type, basestring):
+                protocol_type = [protocol_type]
+            data["protocol_type"] = frozenset(protocol_type)
 
         self.logger.debug(_("Adding callback: %s") % data)
 
         current.append(data)
 
         self.callbacks[callback] = self._sort(current)
+        self._compile(callback)
+
+    def set_plugin_queue(self, plugin, workers=1, max_depth=100,
+                         policy=QueuePolicy.Drop):
+        """
+        Run a plugin's handlers for threaded events on a bounded queue.
+
+        By default, threaded events start a new thread for every handler.
+        Call this from your plugin to have your handlers run by at most
+        `workers` threads from the threadpool instead, with at most
+        `max_depth` events waiting. When the queue is full, new events are
+        dropped or coalesced with waiting events for the same callback,
+        depending on the policy.
+
+        :param plugin: Your plugin object's instance (aka self)
+        :param workers: The maximum number of threads to use at once
+        :param max_depth: The maximum number of waiting events
+        :param policy: What to do with new events when the queue is full
+
+        :type plugin: PluginObject
+        :type workers: int
+        :type max_depth: int
+        :type policy: QueuePolicy
+
+        :return: The queue, which you can get statistics from
+        :rtype: BoundedQueue
+        """
+
+        name = plugin.info.name
+        queue = BoundedQueue("Events/%s" % name, workers, max_depth, policy)
+
+        self.queues[name] = queue
+        return queue
+
+    def get_plugin_queue(self, plugin):
+        """
+        Get the bounded queue for a plugin's threaded handlers.
+
+        :param plugin: Name of the plugin
+        :type plugin: str
+
+        :return: The queue if the plugin has one, otherwise None
+        :rtype: BoundedQueue
+        """
+
+        return self.queues.get(plugin)
 
     def get_callback(self, callback, plugin):
         """
@@ -213,6 +518,8 @@ class EventManager(object):
             else:
                 del self.callbacks[callback]
 
+            self._compile(callback)
+
     def remove_callbacks(self, callback):
         """
         Remove a certain callback.
@@ -222,6 +529,7 @@ class EventManager(object):
         """
         if self.has_callback(callback):
             del self.callbacks[callback]
+            self._compile(callback)
 
     def remove_callbacks_for_plugin(self, plugin):
         """
@@ -236,6 +544,8 @@ class EventManager(object):
         if not isinstance(plugin, str):
             plugin = plugin.info.name
 
+        self.queues.pop(plugin, None)
+
         for key, value in current:
             done = []
             for cb in value:
@@ -246,6 +556,8 @@ class EventManager(object):
             else:
                 del self.callbacks[key]
 
+            self._compile(key)
+
     def run_callback(self, callback, event, threaded=False, from_thread=False):
         """
         Run all handlers for a certain callback with an event.
@@ -253,7 +565,7 @@ class EventManager(object):
         :param callback: The callback to run
         :param event: An instance of the event to pass through the handlers
         :param threaded: default False, Whether to run each callback in its own
-            thread
+            thread, or on its plugin's queue if it has one
         :param from_thread: default False, If the callback is being run from
             another thread, use this to specify that it should be run in the
             main reactor thread.
@@ -268,52 +580,113 @@ class EventManager(object):
             # to do any work.
             return reactor.callFromThread(self.run_callback, callback,
                                           event, threaded)
-        if self.has_callback(callback):
+        plan = self._get_plan(callback, event)
+
+        if plan:
             event.threaded = threaded  # So devs can detect it easily.
 
-            self.logger.trace("Event: %s" % event)
-
-            for cb in self.get_callbacks(callback):
-                if threaded:
-                    @run_async
-                    def go():
-                        """ Run the callback asynchronously """
-                        cb["function"](event, *cb["extra_args"],
-                                       **cb["extra_kwargs"])
-                else:
-                    def go():
-                        """ Run the callback synchronously """
-                        cb["function"](event, *cb["extra_args"],
-                                       **cb["extra_kwargs"])
+            trace = self._level_enabled(logbook.TRACE)
+            debug = trace or self._level_enabled(logbook.DEBUG)
+
+            if trace:
+                self.logger.trace("Event: %s" % event)
+
+            for name, function, fltr, cancelled, args, kwargs, timeout in plan:
                 try:
-                    self.logger.debug(_("Running callback: %s") % cb)
-                    if cb["filter"]:
-                        if callable(cb["filter"]):
-                            if not cb["filter"](event):
-                                self.logger.trace(_("Not running, filter "
-                                                    "function returned "
-                                                    "False."))
-                                continue
-                        else:
-                            self.logger.warn(_("Not running event, filter "
-                                               "is not actually a callable. "
-                                               "Bug the developers of the %s "
-                                               "plugin about it!") %
-                                             cb["name"])
-                            self.logger.warn(_("Value: %s") % cb["filter"])
-                            continue
-                    if event.cancelled:
-                        if cb["cancelled"]:
-                            go()
-                        else:
+                    if debug:
+                        self.logger.debug(_("Running callback: %s") % name)
+                    if fltr is not None and not fltr(event):
+                        if trace:
+                            self.logger.trace(_("Not running, filter "
+                                                "function returned "
+                                                "False."))
+                        continue
+                    if event.cancelled and not cancelled:
+                        if trace:
                             self.logger.trace(_("Not running, event is "
                                                 "cancelled and handler "
                                                 "doesn't accept cancelled "
                                                 "events"))
+                        continue
+                    if threaded:
+                        queue = self.queues.get(name)
+
+                        if queue is None:
+                            run_async(function)(event, *args, **kwargs)
+                        else:
+                            queue.submit(callback, function, event,
+                                         *args, **kwargs)
                     else:
-                        go()
+                        result = function(event, *args, **kwargs)
+
+                        if isinstance(result, Deferred):
+                            self._watch(callback, name, result, timeout)
                 except Exception as e:
                     self.logger.exception(_(
                         "Error running callback '%s': %s"
                     ) % (callback, e))
         return event
+
+    def run_callback_async(self, callback, event, timeout=None):
+        """
+        Run all handlers for a certain callback with an event, waiting for
+        any Deferreds they return.
+
+        Handlers are still run in order, and each one is only run once the
+        Deferred returned by the previous handler has fired, so cancelling
+        the event works just like it does with `run_callback`. Nothing here
+        blocks the reactor, though - the returned Deferred fires with the
+        event once every handler has finished.
+
+        :param callback: The callback to run
+        :param event: An instance of the event to pass through the handlers
+        :param timeout: default None, How many seconds to wait for each
+            handler's Deferred, for handlers that didn't specify a timeout
+            of their own
+
+        :type callback: str
+        :type event: BaseEvent
+        :type timeout: int, float
+
+        :return: A Deferred that fires with the event
+        :rtype: Deferred
+        """
+
+        done = Deferred()
+        plan = self._get_plan(callback, event)
+
+        if not plan:
+            done.callback(event)
+            return done
+
+        event.threaded = False
+        entries = iter(plan)
+
+        def run_next(_=None):
+            for entry in entries:
+                name, function, fltr, cancelled, args, kwargs = entry[:6]
+                handler_timeout = entry[6] if entry[6] is not None \
+                    else timeout
+
+                try:
+                    if fltr is not None and not fltr(event):
+                        continue
+                    if event.cancelled and not cancelled:
+                        continue
+
+                    result = function(event, *args, **kwargs)
+                except Exception as e:
+                    self.logger.exception(_(
+                        "Error running callback '%s': %s"
+                    ) % (callback, e))
+                    continue
+
+                if isinstance(result, Deferred):
+                    self._watch(callback, name, result, handler_timeout)
+                    result.addCallback(run_next)
+                    return
+
+            done.callback(event)
+
+        run_next()
+        return done
@@ -122,6 +122,7 @@ class Manager(object):
         self.commands.set_factory_manager(self)
 
         self.load_config()  # Load the configuration
+        self.watch_files()  # Reload files automatically when they change
 
         try:
             self.metrics = Metrics(self.main_config, self)
@@ -193,6 +194,26 @@ class Manager(object):
             return False
         return True
 
+    def watch_files(self):
+        """
+        Start watching config and data files for changes, if that's enabled
+        in the main configuration.
+        """
+
+        settings = self.main_config.get("file-watcher", {})
+
+        if not settings.get("enabled", True):
+            self.logger.debug(_("File watcher is disabled."))
+            return
+
+        try:
+            self.storage.start_watching(
+                settings.get("interval", 5), settings.get("debounce", 1),
+                settings.get("inotify", True)
+            )
+        except Exception:
+            self.logger.exception(_("Unable to start the file watcher."))
+
     def load_plugins(self):
         """
         Attempt to load all of the plugins.
@@ -410,6 +431,8 @@ class Manager(object):
             self.unload_protocol(name)
 
         self.plugman.unload_plugins()
+        self.storage.stop_watching()
+        self.storage.flush_files()
 
         if reactor.running:
             try:
@@ -107,7 +107,8 @@ class Metrics(object):
         self.events = EventManager()
         self.packages = Packages(get=False)
 
-        self.data = self.storage.get_file(self, "data", JSON, "metrics.json")
+        self.data = self.storage.get_file(self, "data", JSON, "metrics.json",
+                                          journal=True)
 
         self.task = LoopingCall(self.submit_metrics)
 
@@ -194,6 +194,27 @@ class Protocol(protocol.Protocol):
 
         raise NotImplementedError(_("This function needs to be implemented."))
 
+    def send_msgs(self, target, messages, target_type=None, use_event=True):
+        """
+        Send several messages to a user or a channel, in order.
+
+        By default, this just calls send_msg for each message. Protocols
+        should override it if they can do better - for example, by only
+        looking up the target once, or by combining the messages - as long
+        as they still respect their flood limits.
+
+        :param target: A string, User or Channel object.
+        :param messages: A list of messages to send.
+        :param target_type: The type of target
+        :param use_event: Whether to fire the MessageSent event or not.
+        :return: Boolean describing whether the target was found and messaged.
+        """
+
+        for message in messages:
+            if not self.send_msg(target, message, target_type, use_event):
+                return False
+        return True
+
     def send_action(self, target, message, target_type=None, use_event=True):
         """
         Send an action to a user of channel. (i.e. /me used action!)
@@ -17,6 +17,7 @@ from system.protocols.irc import constants
 from system.protocols.irc.channel import Channel
 from system.protocols.irc.rank import Ranks
 from system.protocols.irc.user import User
+from system.protocols.irc.users import Users
 
 from utils.irc import IRCUtils
 from system.logging.logger import getLogger
@@ -80,8 +81,7 @@ class Protocol(irc.IRCClient, ChannelsProtocol):
     def num_channels(self):
         return len(self._channels)
 
-    # TODO: Make users a set()?
-    _users = []
+    _users = None  # Users registry - use get_user(s) and user-tracking
     ourselves = None
 
     ssl = False
@@ -106,6 +106,7 @@ class Protocol(irc.IRCClient, ChannelsProtocol):
         self.event_manager = EventManager()
         self.command_manager = CommandManager()
         self.utils = IRCUtils(self.log)
+        self._users = Users(self.utils)
         # Three dicts for easier lookup
         self.ranks = Ranks()
         # Default prefixes in case the server doesn't send us a RPL_ISUPPORT
@@ -232,7 +233,7 @@ class Protocol(irc.IRCClient, ChannelsProtocol):
         # Reset users and channels when we connect, in case we still have them
         # from a previous connection.
         self.ourselves = None
-        self._users = []
+        self._users = Users(self.utils)
         self._channels = {}
 
         self.factory.clientConnected()
@@ -702,7 +703,7 @@ class Protocol(irc.IRCClient, ChannelsProtocol):
 
         if not user_obj:
             user_obj = User(self, newnick, is_tracked=False)
-        user_obj.nickname = newnick
+        self._users.rename(user_obj, newnick)
 
         self.log.info(_("%s is now known as %s") % (oldnick, newnick))
 
@@ -842,6 +843,7 @@ class Protocol(irc.IRCClient, ChannelsProtocol):
             if prm == "CASEMAPPING":
                 self.utils.case_mapping =\
                     self.supported.getFeature("CASEMAPPING")[0]  # Tuple
+                self._users.reindex()
             elif prm == "PREFIX":
                 # Remove the default prefixes before storing the new ones
                 self.ranks = Ranks()
@@ -1034,7 +1036,16 @@ class Protocol(irc.IRCClient, ChannelsProtocol):
             ident = ident.lower()
         if host:
             host = host.lower()
-        for user in self._users:
+
+        # Narrow things down with the registry's indexes where we can
+        if nickname:
+            users = self._users.by_nickname(nickname)
+        elif ident and host:
+            users = self._users.by_mask(ident, host)
+        else:
+            users = self._users
+
+        for user in users:
             if (nickname and
                     not self.utils.compare_nicknames(nickname, user.nickname)):
                 continue
@@ -1078,7 +1089,7 @@ class Protocol(irc.IRCClient, ChannelsProtocol):
         user = self.get_user(nickname=nickname, ident=ident, host=host)
         if user is None:
             user = User(self, nickname, ident, host, is_tracked=True)
-            self._users.append(user)
+            self._users.add(user)
         user.add_channel(channel)
         channel.add_user(user)
         # For convenience
@@ -1151,17 +1162,27 @@ class Protocol(irc.IRCClient, ChannelsProtocol):
     #   - get_user() and get_users()                                      #
     #######################################################################
 
-    def send_msg(self, target, message, target_type=None, use_event=True):
+    def _resolve_target(self, target):
+        """
+        Get the Channel or User object for a target name.
+
+        :return: The Channel or User, or None if it's a channel we don't
+            know about
+        """
+
         if isinstance(target, str):
             if self.utils.is_channel(target):
                 # Channel
-                target = self.get_channel(target)
-                if not target:
-                    return False
+                return self.get_channel(target)
             else:
-                target = self.get_user(target)
-                if not target:
-                    target = User(self, target)
+                user = self.get_user(target)
+                if not user:
+                    user = User(self, target)
+                return user
+        return target
+
+    def send_msg(self, target, message, target_type=None, use_event=True):
+        target = self._resolve_target(target)
 
         if isinstance(target, User):
             self.send_notice(target, message, use_event)
@@ -1171,17 +1192,24 @@ class Protocol(irc.IRCClient, ChannelsProtocol):
             return False
         return True
 
+    def send_msgs(self, target, messages, target_type=None, use_event=True):
+        # Only look the target up once. Lines go through sendLine, so they
+        # join the same rate-limited queue as everything else.
+        target = self._resolve_target(target)
+
+        if isinstance(target, User):
+            send = self.send_notice
+        elif isinstance(target, Channel):
+            send = self.send_privmsg
+        else:
+            return False
+
+        for message in messages:
+            send(target, message, use_event)
+        return True
+
     def send_action(self, target, message, target_type=None, use_event=True):
-        if isinstance(target, str):
-            if self.utils.is_channel(target):
-                # Channel
-                target = self.get_channel(target)
-                if not target:
-                    return False
-            else:
-                target = self.get_user(target)
-                if not target:
-                    target = User(self, target)
+        target = self._resolve_target(target)
 
         if isinstance(target, Channel) or isinstance(target, User):
             event = general_events.ActionSent(self, target, message)
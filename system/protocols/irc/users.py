@@ -0,0 +1,160 @@
+__author__ = 'Gareth Coles'
+
+"""
+Registry of the users being tracked by an IRC protocol.
+
+Users are indexed by their case-folded nickname and by their (ident, host)
+pair, so looking somebody up doesn't mean scanning and case-folding every
+user we know about.
+"""
+
+
+class Users(object):
+    """
+    A set of tracked users, with hash indexes for lookups.
+
+    Don't change a tracked user's nickname directly - use `rename()`, so the
+    nickname index stays correct.
+
+    :param utils: The protocol's IRCUtils, used for case-folding nicknames
+    """
+
+    def __init__(self, utils):
+        self.utils = utils
+
+        self._users = set()
+        self._by_nickname = {}
+        self._by_mask = {}
+
+    def __len__(self):
+        return len(self._users)
+
+    def __iter__(self):
+        return iter(list(self._users))
+
+    def __contains__(self, user):
+        return user in self._users
+
+    @staticmethod
+    def _mask_key(ident, host):
+        return (ident or "").lower(), (host or "").lower()
+
+    @staticmethod
+    def _index(index, key, user):
+        if key in index:
+            index[key].add(user)
+        else:
+            index[key] = {user}
+
+    @staticmethod
+    def _unindex(index, key, user):
+        users = index.get(key)
+
+        if users is not None:
+            users.discard(user)
+
+            if not users:
+                del index[key]
+
+    def add(self, user):
+        """
+        Start tracking a user.
+
+        :param user: The user to add
+        """
+
+        if user in self._users:
+            return
+
+        self._users.add(user)
+
+        self._index(
+            self._by_nickname, self.utils.lowercase_nick_chan(user.nickname),
+            user
+        )
+        self._index(self._by_mask, self._mask_key(user.ident, user.host), user)
+
+    def remove(self, user):
+        """
+        Stop tracking a user.
+
+        :param user: The user to remove
+
+        :raises KeyError: If the user isn't being tracked
+        """
+
+        self._users.remove(user)
+
+        self._unindex(
+            self._by_nickname, self.utils.lowercase_nick_chan(user.nickname),
+            user
+        )
+        self._unindex(
+            self._by_mask, self._mask_key(user.ident, user.host), user
+        )
+
+    def rename(self, user, nickname):
+        """
+        Change a user's nickname, updating the index if they're tracked.
+
+        :param user: The user that changed their nickname
+        :param nickname: Their new nickname
+        """
+
+        if user in self._users:
+            self._unindex(
+                self._by_nickname,
+                self.utils.lowercase_nick_chan(user.nickname),
+                user
+            )
+            self._index(
+                self._by_nickname, self.utils.lowercase_nick_chan(nickname),
+                user
+            )
+
+        user.nickname = nickname
+
+    def reindex(self):
+        """
+        Rebuild the indexes - for example, when the case-mapping changes.
+        """
+
+        users = self._users
+        self.clear()
+
+        for user in users:
+            self.add(user)
+
+    def clear(self):
+        """
+        Stop tracking everyone.
+        """
+
+        self._users = set()
+        self._by_nickname = {}
+        self._by_mask = {}
+
+    def by_nickname(self, nickname):
+        """
+        Get the users with a certain nickname, ignoring case.
+
+        :param nickname: The nickname to look for
+        :return: A set of users, which may be empty
+        :rtype: set
+        """
+
+        return self._by_nickname.get(
+            self.utils.lowercase_nick_chan(nickname), set()
+        )
+
+    def by_mask(self, ident, host):
+        """
+        Get the users with a certain ident and host, ignoring case.
+
+        :param ident: The ident to look for
+        :param host: The host to look for
+        :return: A set of users, which may be empty
+        :rtype: set
+        """
+
+        return self._by_mask.get(self._mask_key(ident, host), set())
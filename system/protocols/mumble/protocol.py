@@ -17,6 +17,7 @@ import os
 import platform
 import struct
 
+from kitchen.text.converters import to_unicode
 from twisted.internet import reactor, ssl
 
 from system.command_manager import CommandManager
@@ -38,6 +39,9 @@ _ = Translations().get()
 
 log = logging.getLogger(__name__)
 
+#: What we join lines with, when sending several in one text message
+LINE_BREAK = u"<br />"
+
 
 class Protocol(SingleChannelProtocol):
 
@@ -102,6 +106,9 @@ class Protocol(SingleChannelProtocol):
 
     pinging = True
 
+    allow_html = True
+    message_length = 0  # Maximum text message length, 0 for no limit
+
     ourselves = None
 
     def __init__(self, name, factory, config):
@@ -417,12 +424,12 @@ class Protocol(SingleChannelProtocol):
             max_bandwidth = message.max_bandwidth
             welcome_text = message.welcome_text
             self.allow_html = message.allow_html
-            message_length = message.message_length
+            self.message_length = message.message_length
             image_message_length = message.image_message_length
 
             event = mumble_events.ServerConfig(self, max_bandwidth,
                                                welcome_text, self.allow_html,
-                                               message_length,
+                                               self.message_length,
                                                image_message_length)
             self.event_manager.run_callback("Mumble/ServerConfig", event)
         elif isinstance(message, Mumble_pb2.Ping):
@@ -823,19 +830,20 @@ class Protocol(SingleChannelProtocol):
             #             self.msg_user("Joining channel", message.actor)
             #             self.join_channel(chan)
 
-    def send_msg(self, target, message, target_type=None, use_event=True):
+    def _resolve_target(self, target, target_type=None):
         if isinstance(target, int) or isinstance(target, str):
             if target_type == "user":
-                target = self.get_user(target)
-                if not target:
-                    return False
+                return self.get_user(target)
             else:  # Prioritize channels
-                target = self.get_channel(target)
-                if not target:
-                    return False
+                return self.get_channel(target)
 
         if target is None:
-            target = self.get_channel()
+            return self.get_channel()
+
+        return target
+
+    def send_msg(self, target, message, target_type=None, use_event=True):
+        target = self._resolve_target(target, target_type)
 
         if isinstance(target, User):
             self.msg_user(message, target, use_event)
@@ -846,6 +854,57 @@ class Protocol(SingleChannelProtocol):
 
         return False
 
+    def send_msgs(self, target, messages, target_type=None, use_event=True):
+        if use_event or not self.allow_html:
+            # Events are per-message, and we can only combine messages
+            # with HTML line breaks
+            return SingleChannelProtocol.send_msgs(self, target, messages,
+                                                   target_type, use_event)
+
+        target = self._resolve_target(target, target_type)
+
+        if isinstance(target, User):
+            kind, target_id = "user", target.session
+        elif isinstance(target, Channel):
+            kind, target_id = "channel", target.channel_id
+        else:
+            return False
+
+        # Send as few text messages as the server's length limit allows.
+        # We measure what we actually send - escaped, joined with <br />
+        # and encoded as UTF-8, which is never shorter than the server's
+        # count of characters.
+        chunk = []
+        length = 0
+
+        for message in messages:
+            line = to_unicode(cgi.escape(message))
+            size = len(line.encode("utf-8"))
+
+            if chunk and self.message_length and \
+                    length + len(LINE_BREAK) + size > self.message_length:
+                self._send_lines(chunk, kind, target, target_id)
+                chunk = []
+                length = 0
+
+            if chunk:
+                length += len(LINE_BREAK)
+
+            chunk.append((message, line))
+            length += size
+
+        if chunk:
+            self._send_lines(chunk, kind, target, target_id)
+
+        return True
+
+    def _send_lines(self, lines, kind, target, target_id):
+        for message, _line in lines:
+            self.log.info("-> *%s* %s" % (target, message))
+
+        self.msg(LINE_BREAK.join(line for _message, line in lines), kind,
+                 target_id, escape=False)
+
     def send_action(self, target, message, target_type=None, use_event=True):
         if isinstance(target, int) or isinstance(target, str):
             if target_type == "user":
@@ -922,13 +981,14 @@ class Protocol(SingleChannelProtocol):
         # TODO: Event?
         return False
 
-    def msg(self, message, target="channel", target_id=None):
+    def msg(self, message, target="channel", target_id=None, escape=True):
         if target_id is None and target == "channel":
             target_id = self.ourselves.channel.channel_id
 
         self.log.trace(_("Sending text message: %s") % message)
 
-        message = cgi.escape(message)
+        if escape:
+            message = cgi.escape(message)
 
         msg = Mumble_pb2.TextMessage()  # session, channel_id, tree_id, message
         msg.message = message
@@ -20,6 +20,7 @@ import os
 import yaml
 
 from system.storage import formats
+from system.storage.serializers import file_stat, json_load, yaml_load
 from system.logging.logger import getLogger
 
 from system.translations import Translations
@@ -148,6 +149,7 @@ class YamlConfig(Config):
 
     exists = True
     fh = None
+    _stat = None  # Stat of the file when we last parsed it
 
     callbacks = list()
 
@@ -173,21 +175,35 @@ class YamlConfig(Config):
         if not os.path.exists(self.filename):
             self.logger.error(_("File not found: %s") % self.filename)
             return False
-        try:
-            self.fh = open(self.filename, "r")
-        except Exception:
-            self.logger.exception("")
-            return False
+
+        stat = file_stat(self.filename)
+
+        if stat is not None and stat == self._stat:
+            # Unchanged since we last parsed it
+            self.logger.trace(_("Not re-parsing unchanged file: %s")
+                              % self.filename)
         else:
-            self.data = yaml.safe_load(self.fh)
-            if run_callbacks:
-                for callback in self.callbacks:
-                    try:
-                        callback()
-                    except Exception:
-                        self.logger.exception(_("Error running callback %s")
-                                              % callback)
-            return True
+            try:
+                self.fh = open(self.filename, "r")
+            except Exception:
+                self.logger.exception("")
+                return False
+
+            try:
+                self.data = yaml_load(self.fh)
+            finally:
+                self.fh.close()
+
+            self._stat = stat
+
+        if run_callbacks:
+            for callback in self.callbacks:
+                try:
+                    callback()
+                except Exception:
+                    self.logger.exception(_("Error running callback %s")
+                                          % callback)
+        return True
 
     load = reload
 
@@ -306,6 +322,7 @@ class JSONConfig(Config):
 
     exists = True
     fh = None
+    _stat = None  # Stat of the file when we last parsed it
 
     @property
     def mtime(self):
@@ -329,21 +346,35 @@ class JSONConfig(Config):
         if not os.path.exists(self.filename):
             self.logger.error(_("File not found: %s") % self.filename)
             return False
-        try:
-            self.fh = open(self.filename, "r")
-        except Exception:
-            self.logger.exception("")
-            return False
+
+        stat = file_stat(self.filename)
+
+        if stat is not None and stat == self._stat:
+            # Unchanged since we last parsed it
+            self.logger.trace(_("Not re-parsing unchanged file: %s")
+                              % self.filename)
         else:
-            self.data = json.load(self.fh)
-            if run_callbacks:
-                for callback in self.callbacks:
-                    try:
-                        callback()
-                    except Exception:
-                        self.logger.exception(_("Error running callback %s")
-                                              % callback)
-            return True
+            try:
+                self.fh = open(self.filename, "r")
+            except Exception:
+                self.logger.exception("")
+                return False
+
+            try:
+                self.data = json_load(self.fh)
+            finally:
+                self.fh.close()
+
+            self._stat = stat
+
+        if run_callbacks:
+            for callback in self.callbacks:
+                try:
+                    callback()
+                except Exception:
+                    self.logger.exception(_("Error running callback %s")
+                                          % callback)
+        return True
 
     load = reload
 
@@ -21,12 +21,17 @@ import os
 import pprint
 import pymongo
 import redis
+import sqlite3
 import yaml
 
-from threading import Lock
+from threading import Lock, RLock
 from twisted.enterprise import adbapi
+from twisted.internet import reactor
+from twisted.python import threadable
 
 from system.storage import formats
+from system.storage.serializers import file_stat, json_dumps, json_load, \
+    json_loads, yaml_dump, yaml_load, yaml_load_all
 from system.logging.logger import getLogger
 
 from system.translations import Translations
@@ -124,7 +129,436 @@ class Data(object):
         pass
 
 
-class YamlData(Data):
+def atomic_write(filename, data):
+    """
+    Write a file atomically, by writing to a temporary file next to it and
+    then renaming that over the original. Either the old file or the new one
+    will be there afterwards - never a truncated one.
+
+    :param filename: The file to write to
+    :type filename: str
+
+    :param data: The data to write
+    :type data: str
+    """
+
+    temp = "%s.tmp" % filename
+
+    with open(temp, "w") as fh:
+        fh.write(data)
+        fh.flush()
+        os.fsync(fh.fileno())
+
+    if os.name == "nt" and os.path.exists(filename):
+        # Windows won't rename over an existing file
+        os.remove(filename)
+
+    os.rename(temp, filename)
+
+
+def copy_value(value):
+    """
+    Copy the dicts and lists within a value, so changes to the original
+    don't show up in the copy. Anything else is assumed to be immutable.
+    """
+
+    if isinstance(value, dict):
+        return dict((k, copy_value(v)) for k, v in value.iteritems())
+
+    if isinstance(value, list):
+        return [copy_value(v) for v in value]
+
+    return value
+
+
+def diff_values(path, old, new, changes):
+    """
+    Work out the journal records that turn one value into another, and add
+    them to a list as (op, path, value) tuples.
+
+    Dicts are compared key by key, so only the nested values that changed
+    get a record. Lists that have only been added to get an "extend" record
+    with the new items, and lists that are the same length are compared
+    item by item. Anything else that changed is set as a whole.
+
+    :param path: The path to the values, as a list of keys and indexes
+    :param old: The value as it was last saved
+    :param new: The value as it is now
+    :param changes: The list to add records to
+    """
+
+    if type(old) is type(new) and old == new:
+        return
+
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key in old:
+            if key not in new:
+                changes.append(("del", path + [key], None))
+
+        for key, value in new.iteritems():
+            if key in old:
+                diff_values(path + [key], old[key], value, changes)
+            else:
+                changes.append(("set", path + [key], value))
+
+        return
+
+    if isinstance(old, list) and isinstance(new, list):
+        length = len(old)
+
+        if len(new) > length and new[:length] == old:
+            changes.append(("extend", path, new[length:]))
+            return
+
+        if len(new) == length:
+            for index in xrange(length):
+                diff_values(path + [index], old[index], new[index], changes)
+            return
+
+    changes.append(("set", path, new))
+
+
+def apply_record(data, op, path, value):
+    """
+    Apply a journal record to some data.
+
+    :param data: The dict to apply the record to
+    :param op: "set", "del" or "extend"
+    :param path: The keys and indexes leading to the value to change
+    :param value: The new value, or the items to add for "extend"
+
+    :raises: KeyError, IndexError or TypeError if the path doesn't exist
+    """
+
+    for key in path[:-1]:
+        data = data[key]
+
+    if op == "set":
+        data[path[-1]] = value
+    elif op == "del":
+        data.pop(path[-1], None)
+    elif op == "extend":
+        data[path[-1]].extend(value)
+
+
+class FileData(Data):
+    """
+    Base class for data objects that are stored in a single file.
+
+    These support write-behind - pass *save_delay* (in seconds) when getting
+    the file, and changes will mark the data as dirty instead of being saved
+    straight away. Dirty data is written out at most once every *save_delay*
+    seconds, however many changes are made in that time. ::
+
+        data = storage.get_file(self, "data", formats.YAML,
+                                "plugins/thing/data.yml", save_delay=5)
+
+    Call `flush` to write out any changes right away - the storage manager
+    does this for you when files are released.
+
+    They can also keep a journal - pass *journal=True*, and instead of
+    rewriting the whole file on every save, just the changes are appended to
+    a sidecar file (the filename with ".journal" on the end). The whole file
+    is only rewritten when the journal gets bigger than *journal_size*
+    bytes. When the file is loaded, the journal is replayed and then folded
+    back into the file. ::
+
+        data = storage.get_file(self, "data", formats.JSON,
+                                "plugins/thing/data.json", journal=True)
+
+    To work out what changed, we keep a copy of the data as it was last
+    saved. On each save, the top-level keys you set, deleted or accessed
+    within a *with* block are compared against that copy, and a record is
+    written for each nested value that changed - so changing
+    ``data["a"]["b"]["c"]`` writes a record for that path alone, and adding
+    to the end of a list writes just the new items. Unchanged keys cost a
+    comparison, but nothing is written for them.
+
+    The copy doubles the memory the data takes up, so the journal is off by
+    default - it's for files that are saved often, where each save only
+    changes a small part of the file.
+    """
+
+    #: Seconds to wait before writing out changes, or None to write them
+    #: straight away
+    #: :type: int, float, None
+    save_delay = None
+
+    #: Whether there are changes that haven't been written out yet
+    #: :type: bool
+    dirty = False
+
+    #: Whether to append changes to a journal instead of rewriting the file
+    #: :type: bool
+    journal = False
+
+    #: How big the journal can get, in bytes, before we rewrite the file
+    #: :type: int
+    journal_size = 1048576
+
+    _flush_call = None
+    _journal_bytes = 0
+    _stat = None  # Stat of the file when we last read or wrote it
+    _pending = None  # Keys changed since the last save, None for all keys
+    _saved = None  # Copy of the data as it was last saved, for journaling
+
+    @property
+    def journal_filename(self):
+        return "%s.journal" % self.filename
+
+    def save(self):
+        """
+        Save data to the filesystem.
+        """
+        raise NotImplementedError()
+
+    def _save(self):
+        """
+        Save data to the filesystem, when we already hold the mutex.
+        """
+        self.save()
+
+    def _dump(self):
+        """
+        Serialize all of the data - override this.
+        """
+        raise NotImplementedError()
+
+    def _dump_record(self, op, path, value):
+        """
+        Serialize a journal record - override this.
+        """
+        raise NotImplementedError()
+
+    def _load_records(self, fh):
+        """
+        Yield (op, path, value) records from a journal - override this.
+
+        This should stop quietly at a record that was only partly written.
+        """
+        raise NotImplementedError()
+
+    def _touch(self, key):
+        if self.journal and self._pending is not None:
+            self._pending[key] = True
+
+    def _touch_all(self):
+        # Values were handed out without their keys, so we can't tell which
+        # keys changed - all of them will have to be compared
+        if self.journal:
+            self._pending = None
+
+    def _replay_journal(self):
+        self._pending = {}
+        self._journal_bytes = 0
+
+        # Replay a journal even if we're not keeping one now, so switching
+        # it off doesn't lose whatever was left in it
+        if not os.path.exists(self.journal_filename):
+            self._copy_saved()
+            return
+
+        count = 0
+
+        with open(self.journal_filename, "r") as fh:
+            for op, path, value in self._load_records(fh):
+                if not isinstance(path, list):
+                    path = [path]  # Older journals only had top-level keys
+
+                try:
+                    apply_record(self.data, op, path, value)
+                except (KeyError, IndexError, TypeError, AttributeError):
+                    self.logger.warning(_("Ignoring journal record for a "
+                                          "missing path in %s: %s")
+                                        % (self.filename, path))
+                    continue
+
+                count += 1
+
+        self.logger.debug(_("Replayed %s journal records for %s")
+                          % (count, self.filename))
+
+        # Start with a fresh journal, in case the old one ends with a record
+        # that was only partly written
+        self._write_snapshot()
+
+    def _append_journal(self):
+        """
+        Append what's changed since the last save to the journal.
+
+        :return: False if the whole file should be written instead
+        """
+
+        if not self.journal or self._saved is None:
+            return False
+
+        if self._pending:
+            keys = self._pending
+        else:
+            # Either we can't tell which keys changed, or something was
+            # changed without us seeing which key it was - check them all
+            keys = set(self.data)
+            keys.update(self._saved)
+
+        changes = []
+
+        for key in keys:
+            if key not in self.data:
+                if key in self._saved:
+                    changes.append(("del", [key], None))
+            elif key not in self._saved:
+                changes.append(("set", [key], self.data[key]))
+            else:
+                diff_values([key], self._saved[key], self.data[key],
+                            changes)
+
+        records = "".join(
+            self._dump_record(op, path, value) for op, path, value in changes
+        )
+
+        if records:
+            with open(self.journal_filename, "a") as fh:
+                fh.write(records)
+                fh.flush()
+                os.fsync(fh.fileno())
+
+        for op, path, value in changes:
+            apply_record(self._saved, op, path, copy_value(value))
+
+        self._pending = {}
+        self._journal_bytes += len(records)
+
+        return self._journal_bytes <= self.journal_size
+
+    def _copy_saved(self):
+        """
+        Take a copy of the data as it is on disk, to compare against when we
+        next save.
+        """
+
+        if self.journal:
+            self._saved = copy_value(self.data)
+        else:
+            self._saved = None
+
+    def _write_snapshot(self):
+        """
+        Write all of the data to the file, and get rid of the journal.
+        """
+
+        atomic_write(self.filename, self._dump())
+        self._stat = file_stat(self.filename)
+        self._clear_journal()
+        self._copy_saved()
+
+    def _clear_journal(self):
+        """
+        Called when the whole file has been written - the journal isn't
+        needed any more.
+        """
+
+        self._pending = {}
+
+        if os.path.exists(self.journal_filename):
+            os.remove(self.journal_filename)
+
+        self._journal_bytes = 0
+
+    def mark_dirty(self):
+        """
+        Mark the data as changed, and schedule a flush if there isn't one
+        already.
+
+        If we're not using write-behind, this saves the data right away.
+        """
+
+        if not self.save_delay:
+            return self.save()
+
+        self.dirty = True
+
+        if threadable.ioThread is None or threadable.isInIOThread():
+            self._schedule_flush()
+        else:
+            reactor.callFromThread(self._schedule_flush)
+
+    def _save_pending(self):
+        """
+        Write out any changes that haven't been saved yet, so that reloading
+        doesn't throw them away. Call this with the mutex held.
+        """
+
+        if self._flush_call is not None and self._flush_call.active():
+            self._flush_call.cancel()
+
+        self._flush_call = None
+
+        if self.dirty:
+            self._save()
+            self.dirty = False
+
+    def _check_pending(self):
+        """
+        Deal with unsaved changes before the file is read again. Call this
+        with the mutex held.
+
+        If the file hasn't changed on disk since we last read or wrote it,
+        our changes are written out. If it has, someone edited it while we
+        had changes waiting - rather than silently writing over their edit,
+        we keep it and throw our changes away, with a warning.
+        """
+
+        if not self.dirty:
+            return
+
+        stat = file_stat(self.filename)
+
+        if stat is None or stat == self._stat:
+            return self._save_pending()
+
+        if self._flush_call is not None and self._flush_call.active():
+            self._flush_call.cancel()
+
+        self._flush_call = None
+        self.dirty = False
+
+        self.logger.warn(_("%s was changed on disk while it had unsaved "
+                           "changes - loading the file, and discarding the "
+                           "unsaved changes") % self.filename)
+
+    def _schedule_flush(self):
+        if self._flush_call is None or not self._flush_call.active():
+            self._flush_call = reactor.callLater(self.save_delay, self.flush)
+
+    def flush(self):
+        """
+        Write out any changes that haven't been saved yet.
+        """
+
+        if self._flush_call is not None and self._flush_call.active():
+            self._flush_call.cancel()
+
+        self._flush_call = None
+
+        if not self.dirty:
+            return
+
+        self.dirty = False
+
+        try:
+            self.save()
+        except Exception:
+            self.logger.exception(_("Error saving data file: %s")
+                                  % self.filename)
+
+            # Try again later
+            self.dirty = True
+
+            if self.save_delay:
+                self._schedule_flush()
+
+
+class YamlData(FileData):
     """
     Data object that uses YAML files for storage.
 
@@ -176,8 +610,14 @@ class YamlData(Data):
             os.path.getmtime(self.filename)
         )
 
-    def __init__(self, filename):
+    def __init__(self, filename, save_delay=None, journal=False,
+                 journal_size=None):
         self.callbacks = []
+        self.save_delay = save_delay
+        self.journal = journal
+
+        if journal_size is not None:
+            self.journal_size = journal_size
 
         self.logger = getLogger("Data")
         filename = filename.strip("..")
@@ -220,13 +660,23 @@ class YamlData(Data):
     load = reload
 
     def _load(self):
+        self._check_pending()
+
         if not os.path.exists(self.filename):
             open(self.filename, "w").close()
+
+        stat = file_stat(self.filename)
+
+        if stat == self._stat:
+            return  # Unchanged since we last read or wrote it
+
         fh = open(self.filename, "r")
-        self.data = yaml.load(fh)
+        self.data = yaml_load(fh)
         fh.close()
+        self._stat = stat
         if not self.data:
             self.data = {}
+        self._replay_journal()
 
     def save(self):
         """
@@ -239,15 +689,27 @@ class YamlData(Data):
             self._save()
 
     def _save(self):
-        data = yaml.dump(self.data, default_flow_style=False)
-        fh = open(self.filename, "w")
-        fh.write(data)
-        fh.flush()
-        fh.close()
+        if not self._append_journal():
+            self._write_snapshot()
+
+    def _dump(self):
+        return yaml_dump(self.data, default_flow_style=False)
+
+    def _dump_record(self, op, path, value):
+        return yaml_dump([op, path, value], explicit_start=True,
+                         default_flow_style=True)
+
+    def _load_records(self, fh):
+        try:
+            for record in yaml_load_all(fh):
+                yield record
+        except yaml.YAMLError:
+            self.logger.warning(_("Ignoring incomplete journal record in %s")
+                                % self.journal_filename)
 
     def validate(self, data):
         try:
-            yaml.load(data)
+            yaml_load(data)
         except yaml.YAMLError as e:
             problem = e.problem
             problem = problem.replace("could not found", "could not find")
@@ -263,10 +725,8 @@ class YamlData(Data):
 
         with self:  # Python <3
             try:
-                fh = open(self.filename, "w")
-                fh.write(data)
-                fh.flush()
-                fh.close()
+                atomic_write(self.filename, data)
+                self._clear_journal()
             except Exception:
                 self.logger.exception(_("Error writing file"))
                 success = False
@@ -275,7 +735,7 @@ class YamlData(Data):
         return success
 
     def read(self):
-        dumped = yaml.dump(self.data, default_flow_style=False)
+        dumped = yaml_dump(self.data, default_flow_style=False)
         return [
             self.editable,
             _("# This is the data in memory, and may not actually be what's "
@@ -286,21 +746,31 @@ class YamlData(Data):
         return self.data.keys()
 
     def items(self):
+        if self._context_guarded:
+            self._touch_all()
         return self.data.items()
 
     def iteritems(self):
+        if self._context_guarded:
+            self._touch_all()
         return self.data.iteritems()
 
     def iterkeys(self):
         return self.data.iterkeys()
 
     def itervalues(self):
+        if self._context_guarded:
+            self._touch_all()
         return self.data.itervalues()
 
     def values(self):
+        if self._context_guarded:
+            self._touch_all()
         return self.data.values()
 
     def get(self, key, default):
+        if self._context_guarded:
+            self._touch(key)
         return self.data.get(key, default)
 
     keys.__doc__ = data.keys.__doc__
@@ -313,20 +783,32 @@ class YamlData(Data):
             self._context_guarded = True
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.save()
-        self._context_guarded = False
+        try:
+            self.mark_dirty()
+        finally:
+            self._context_guarded = False
         if exc_type is None:
             return True
         return False
 
     def __getitem__(self, y):
+        if self._context_guarded:
+            self._touch(y)
         return self.data.__getitem__(y)
 
     def __setitem__(self, key, value):
-        return self.data.__setitem__(key, value)
+        self.data.__setitem__(key, value)
+        self._touch(key)
+
+        if self.save_delay:
+            self.mark_dirty()
 
     def __delitem__(self, key):
-        return self.data.__delitem__(key)
+        self.data.__delitem__(key)
+        self._touch(key)
+
+        if self.save_delay:
+            self.mark_dirty()
 
     def __len__(self):
         return self.data.__len__()
@@ -471,7 +953,7 @@ class MemoryData(Data):
         return True
 
 
-class JSONData(Data):
+class JSONData(FileData):
     """
     Data object that uses JSON files for storage.
 
@@ -500,8 +982,14 @@ class JSONData(Data):
             os.path.getmtime(self.filename)
         )
 
-    def __init__(self, filename):
+    def __init__(self, filename, save_delay=None, journal=False,
+                 journal_size=None):
         self.callbacks = []
+        self.save_delay = save_delay
+        self.journal = journal
+
+        if journal_size is not None:
+            self.journal_size = journal_size
 
         self.logger = getLogger("Data")
         filename = filename.strip("..")
@@ -544,16 +1032,26 @@ class JSONData(Data):
     load = reload
 
     def _load(self):
+        self._check_pending()
+
         if not os.path.exists(self.filename):
             f = open(self.filename, "w")
             f.write("{}")
             f.flush()
             f.close()
+
+        stat = file_stat(self.filename)
+
+        if stat == self._stat:
+            return  # Unchanged since we last read or wrote it
+
         fh = open(self.filename, "r")
-        self.data = json.load(fh)
+        self.data = json_load(fh)
         fh.close()
+        self._stat = stat
         if not self.data:
             self.data = {}
+        self._replay_journal()
 
     def save(self):
         """
@@ -566,12 +1064,23 @@ class JSONData(Data):
             self._save()
 
     def _save(self):
-        data = json.dumps(self.data, indent=4, sort_keys=True,
-                          separators=(",", ": "))
-        fh = open(self.filename, "w")
-        fh.write(data)
-        fh.flush()
-        fh.close()
+        if not self._append_journal():
+            self._write_snapshot()
+
+    def _dump(self):
+        return json_dumps(self.data, pretty=True)
+
+    def _dump_record(self, op, path, value):
+        return json_dumps([op, path, value]) + "\n"
+
+    def _load_records(self, fh):
+        for line in fh:
+            try:
+                yield json_loads(line)
+            except ValueError:
+                self.logger.warning(_("Ignoring incomplete journal record in "
+                                      "%s") % self.journal_filename)
+                return
 
     def validate(self, data):
         try:
@@ -599,10 +1108,8 @@ class JSONData(Data):
 
         with self:  # Python <3
             try:
-                fh = open(self.filename, "w")
-                fh.write(data)
-                fh.flush()
-                fh.close()
+                atomic_write(self.filename, data)
+                self._clear_journal()
             except Exception:
                 self.logger.exception(_("Error writing file"))
                 success = False
@@ -611,8 +1118,7 @@ class JSONData(Data):
         return success
 
     def read(self):
-        dumped = json.dumps(self.data, indent=4, sort_keys=True,
-                            separators=(",", ": "))
+        dumped = json_dumps(self.data, pretty=True)
 
         return [self.editable, dumped]
 
@@ -620,21 +1126,31 @@ class JSONData(Data):
         return self.data.keys()
 
     def items(self):
+        if self._context_guarded:
+            self._touch_all()
         return self.data.items()
 
     def iteritems(self):
+        if self._context_guarded:
+            self._touch_all()
         return self.data.iteritems()
 
     def iterkeys(self):
         return self.data.iterkeys()
 
     def itervalues(self):
+        if self._context_guarded:
+            self._touch_all()
         return self.data.itervalues()
 
     def values(self):
+        if self._context_guarded:
+            self._touch_all()
         return self.data.values()
 
     def get(self, key, default):
+        if self._context_guarded:
+            self._touch(key)
         return self.data.get(key, default)
 
     keys.__doc__ = data.keys.__doc__
@@ -647,20 +1163,32 @@ class JSONData(Data):
             self._context_guarded = True
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.save()
-        self._context_guarded = False
+        try:
+            self.mark_dirty()
+        finally:
+            self._context_guarded = False
         if exc_type is None:
             return True
         return False
 
     def __getitem__(self, y):
+        if self._context_guarded:
+            self._touch(y)
         return self.data.__getitem__(y)
 
     def __setitem__(self, key, value):
-        return self.data.__setitem__(key, value)
+        self.data.__setitem__(key, value)
+        self._touch(key)
+
+        if self.save_delay:
+            self.mark_dirty()
 
     def __delitem__(self, key):
-        return self.data.__delitem__(key)
+        self.data.__delitem__(key)
+        self._touch(key)
+
+        if self.save_delay:
+            self.mark_dirty()
 
     def __len__(self):
         return self.data.__len__()
@@ -678,6 +1206,300 @@ class JSONData(Data):
         return True
 
 
+class SQLiteData(FileData):
+    """
+    Data object that stores a dictionary in an SQLite database, one row per
+    top-level key.
+
+    This has the same dict-like interface as the YAML and JSON data
+    handlers, so you can switch a plugin over to it without changing any
+    code - but it doesn't keep the whole dataset in memory, and it doesn't
+    rewrite everything when you save. Values are JSON-encoded, and each is
+    only loaded when its key is first accessed. ::
+
+        data = storage.get_file(self, "data", formats.SQLITE,
+                                "plugins/thing/data.sqlite")
+
+        with data:
+            data["x"]["y"] = "z"
+            thing = data["a"]
+        # Changed keys are now committed
+
+    As with the other handlers, use the *with* macro when you're changing
+    things. You can only change values in place (eg, ``data["x"]["y"]``)
+    within a *with* block, as that's how we know which keys to write back -
+    everything accessed within the block is written back, in a single
+    transaction, when it ends.
+
+    This also supports write-behind in the same way as the YAML and JSON
+    data handlers - see `FileData`. There's no journal, as only the keys
+    that changed are written anyway - the *journal* and *journal_size*
+    arguments are accepted and ignored, so you can switch a file that uses
+    them over to this.
+
+    As values are stored as JSON, they come back the way the JSON handler
+    would give them to you - dict keys within values become strings (so
+    ``{1: "a"}`` comes back as ``{"1": "a"}``), and tuples become lists.
+    Top-level keys are stored with their types, so ``data[1]`` stays
+    ``data[1]``.
+
+    You can import an existing YAML or JSON data file with the
+    migrate_data.py script, or `import_data`.
+    """
+
+    editable = False
+    representation = "json"
+
+    format = formats.SQLITE
+
+    #: How many decoded values to keep in memory
+    #: :type: int
+    cache_size = 1000
+
+    @property
+    def mtime(self):
+        return datetime.datetime.fromtimestamp(
+            os.path.getmtime(self.filename)
+        )
+
+    def __init__(self, filename, save_delay=None, cache_size=None,
+                 journal=False, journal_size=None):
+        self.callbacks = []
+        self.save_delay = save_delay
+
+        if cache_size is not None:
+            self.cache_size = cache_size
+
+        self.logger = getLogger("Data")
+        filename = filename.strip("..")
+
+        folders = filename.split("/")
+        folders.pop()
+        folders = "/".join(folders)
+
+        if not os.path.exists(folders):
+            os.makedirs(folders)
+
+        self.filename = filename
+
+        self.mutex = RLock()
+        self._depth = 0
+
+        self._cache = {}  # Decoded values
+        self._touched = set()  # Keys accessed within a with block
+        self._deleted = set()
+
+        self.connection = sqlite3.connect(filename, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS data ("
+                                "key TEXT PRIMARY KEY, "
+                                "value TEXT NOT NULL)")
+        self.connection.commit()
+
+    @staticmethod
+    def _encode(obj):
+        return json.dumps(obj, sort_keys=True, separators=(",", ":"))
+
+    def reload(self, run_callbacks=True):
+        """
+        Throw away any values we've loaded, so they'll be loaded from the
+        database again when they're next accessed.
+        """
+        with self.mutex:
+            self._save_pending()
+
+            self._cache.clear()
+            self._touched.clear()
+            self._deleted.clear()
+
+            if run_callbacks:
+                for callback in self.callbacks:
+                    try:
+                        callback()
+                    except Exception:
+                        self.logger.exception(_("Error running callback %s")
+                                              % callback)
+
+    load = reload
+
+    def save(self):
+        """
+        Write any changed keys to the database, and commit.
+        """
+        with self.mutex:
+            rows = [(self._encode(key), json_dumps(self._cache[key]))
+                    for key in self._touched if key in self._cache]
+            deleted = [(self._encode(key),) for key in self._deleted]
+
+            if not rows and not deleted:
+                return
+
+            with self.connection:  # Commits, or rolls back on error
+                if deleted:
+                    self.connection.executemany(
+                        "DELETE FROM data WHERE key = ?", deleted
+                    )
+                if rows:
+                    self.connection.executemany(
+                        "INSERT OR REPLACE INTO data VALUES (?, ?)", rows
+                    )
+
+            self._touched.clear()
+            self._deleted.clear()
+
+    def import_data(self, data):
+        """
+        Import a dictionary, replacing any keys that already exist, in a
+        single transaction.
+
+        :param data: The dictionary (or dict-like data object) to import
+        """
+
+        with self.mutex:
+            with self.connection:
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO data VALUES (?, ?)",
+                    ((self._encode(k), json_dumps(v))
+                     for k, v in data.iteritems())
+                )
+
+            self._cache.clear()
+
+    def read(self):
+        dumped = json_dumps(dict(self.iteritems()), pretty=True)
+
+        return [self.editable, dumped]
+
+    def _get(self, key):
+        if key in self._cache:
+            value = self._cache[key]
+        else:
+            row = self.connection.execute(
+                "SELECT value FROM data WHERE key = ?", (self._encode(key),)
+            ).fetchone()
+
+            if row is None:
+                raise KeyError(key)
+
+            value = json_loads(row[0])
+
+            if len(self._cache) >= self.cache_size:
+                # Changed values must stay until they're saved
+                for k in self._cache.keys():
+                    if k not in self._touched:
+                        del self._cache[k]
+
+            self._cache[key] = value
+
+        if self._depth:
+            self._touched.add(key)
+
+        return value
+
+    def keys(self):
+        return list(self.iterkeys())
+
+    def items(self):
+        return list(self.iteritems())
+
+    def iteritems(self):
+        for key in self.iterkeys():
+            yield key, self[key]
+
+    def iterkeys(self):
+        with self.mutex:
+            keys = self.connection.execute("SELECT key FROM data").fetchall()
+            keys = set(json.loads(row[0]) for row in keys)
+
+            keys.update(k for k in self._touched if k in self._cache)
+            keys.difference_update(self._deleted)
+
+        return iter(keys)
+
+    def itervalues(self):
+        for key in self.iterkeys():
+            yield self[key]
+
+    def values(self):
+        return list(self.itervalues())
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __enter__(self):
+        self.mutex.acquire()
+        self._depth += 1
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            self._depth -= 1
+
+            if not self._depth:
+                self.mark_dirty()
+        finally:
+            self.mutex.release()
+
+        if exc_type is None:
+            return True
+        return False
+
+    def __getitem__(self, key):
+        with self.mutex:
+            if key in self._deleted:
+                raise KeyError(key)
+
+            return self._get(key)
+
+    def __setitem__(self, key, value):
+        with self.mutex:
+            self._cache[key] = value
+            self._touched.add(key)
+            self._deleted.discard(key)
+
+            if not self._depth:
+                self.mark_dirty()
+
+    def __delitem__(self, key):
+        with self.mutex:
+            if key not in self:
+                raise KeyError(key)
+
+            self._cache.pop(key, None)
+            self._touched.discard(key)
+            self._deleted.add(key)
+
+            if not self._depth:
+                self.mark_dirty()
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __contains__(self, key):
+        with self.mutex:
+            if key in self._deleted:
+                return False
+
+            if key in self._cache:
+                return True
+
+            return self.connection.execute(
+                "SELECT 1 FROM data WHERE key = ?", (self._encode(key),)
+            ).fetchone() is not None
+
+    def __iter__(self):
+        return self.iterkeys()
+
+    def __str__(self):
+        return "<Ultros SQLite data handler: %s>" % self.filename
+
+    def __nonzero__(self):
+        return True
+
+
 class DBAPIData(Data):
     """
     Data object that uses Twisted's async DBAPI adapters.
@@ -744,6 +1566,21 @@ class DBAPIData(Data):
             db="database"
         )
 
+    The connection pool's size can be set with the *cp_min* and *cp_max*
+    keyword arguments, which default to 3 and 5 connections. Use the *stats*
+    method to see how busy the pool is, if you're not sure what to set these
+    to.
+
+    SQLite connections are switched to WAL mode, with synchronous=NORMAL, as
+    they're opened. This lets the pool's threads read while another one is
+    writing, instead of waiting on the database lock.
+
+    If your SQL contains placeholders like {TABLE}, use *statement* to fill
+    them in - the result is cached, so it's only built once::
+
+        sql = data.statement("SELECT * FROM {TABLE} WHERE x = ?",
+                             TABLE="my_table")
+
     If there are problems using this database abstraction then you should run
     the bot in debug mode and report the output to us in a ticket.
 
@@ -759,8 +1596,12 @@ class DBAPIData(Data):
     pool = None
     info = ""
 
+    #: Pragmas to run on each new SQLite connection
+    sqlite_pragmas = ["PRAGMA journal_mode=WAL", "PRAGMA synchronous=NORMAL"]
+
     def __init__(self, path, *args, **kwargs):
         self.callbacks = []
+        self.statements = {}
 
         self.logger = getLogger("DBAPI")
 
@@ -784,9 +1625,89 @@ class DBAPIData(Data):
 
     def reconnect(self):
         args = self.args
-        kwargs = self.kwargs
+        kwargs = dict(self.kwargs)
+        kwargs.setdefault("cp_reconnect", True)
+
+        if self.parsed_module == "sqlite3":
+            kwargs["cp_openfun"] = self._sqlite_open(
+                kwargs.get("cp_openfun", None)
+            )
+
         self.pool = adbapi.ConnectionPool(self.parsed_module, *args,
-                                          cp_reconnect=True, **kwargs)
+                                          **kwargs)
+
+    def _sqlite_open(self, openfun):
+        def _inner(connection):
+            cursor = connection.cursor()
+
+            try:
+                for pragma in self.sqlite_pragmas:
+                    cursor.execute(pragma)
+            finally:
+                cursor.close()
+
+            if openfun is not None:
+                openfun(connection)
+
+        return _inner
+
+    def statement(self, sql, **replacements):
+        """
+        Fill in the {PLACEHOLDERS} in a piece of SQL, caching the result.
+
+        :param sql: The SQL to fill in
+        :param replacements: Placeholder names and their values
+
+        :type sql: str
+
+        :return: The SQL, with the placeholders replaced
+        :rtype: str
+        """
+
+        key = (sql, tuple(sorted(replacements.iteritems())))
+
+        try:
+            return self.statements[key]
+        except KeyError:
+            pass
+
+        statement = sql
+
+        for name, value in replacements.iteritems():
+            statement = statement.replace("{%s}" % name, value)
+
+        self.statements[key] = statement
+        return statement
+
+    def stats(self):
+        """
+        Get some information on how busy the connection pool is.
+
+        * *min* and *max* - The pool's size limits
+        * *connections* - How many connections are open
+        * *threads* - How many threads the pool has started
+        * *working* - How many threads are running a query
+        * *idle* - How many threads are waiting for work
+        * *queued* - How many queries are waiting for a thread
+
+        If *queued* is often above zero, then *max* should probably be
+        raised.
+
+        :return: A dict of statistics
+        :rtype: dict
+        """
+
+        threadpool = self.pool.threadpool
+
+        return {
+            "min": self.pool.min,
+            "max": self.pool.max,
+            "connections": len(self.pool.connections),
+            "threads": len(threadpool.threads),
+            "working": len(threadpool.working),
+            "idle": len(threadpool.waiters),
+            "queued": threadpool.q.qsize()
+        }
 
     def serialize(self, yielder):
         """
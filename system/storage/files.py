@@ -29,7 +29,8 @@ file_formats_map = {
         Formats.YAML: Data.YamlData,
         Formats.DBAPI: Data.DBAPIData,
         Formats.MONGO: Data.MongoDBData,
-        Formats.REDIS: Data.RedisData
+        Formats.REDIS: Data.RedisData,
+        Formats.SQLITE: Data.SQLiteData
     }
 }
 
@@ -116,12 +117,23 @@ class StorageFile(object):
     def is_owner(self, candidate):
         return isinstance(candidate, self._owner.__class__)
 
+    def flush(self):
+        """
+        Write out any changes the file has been holding on to, if it
+        supports write-behind.
+        """
+
+        if self.obj is not None and isinstance(self.obj, Data.FileData):
+            self.obj.flush()
+
     def release(self, caller):
         """
         Release the file object and let it be garbage collected.
         """
 
         if isinstance(caller, self.manager_class):
+            self.flush()
+
             del self.obj
             self.obj = None
             self._owner = None
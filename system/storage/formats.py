@@ -14,6 +14,7 @@ class Formats(Enum):
     DBAPI = "DBAPI"
     MONGO = "MongoDB"
     REDIS = "Redis"
+    SQLITE = "SQLite"
 
 # TODO: Remove enum references below
 
@@ -23,7 +24,8 @@ MEMORY = Formats.MEMORY
 DBAPI = Formats.DBAPI
 MONGO = Formats.MONGO
 REDIS = Formats.REDIS
+SQLITE = Formats.SQLITE
 
-DATA = [YAML, JSON, MEMORY, DBAPI, MONGO, REDIS]
+DATA = [YAML, JSON, MEMORY, DBAPI, MONGO, REDIS, SQLITE]
 CONF = [YAML, JSON, MEMORY]
 ALL = [YAML, JSON, MEMORY]
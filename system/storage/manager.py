@@ -11,9 +11,21 @@ format.
 
 __author__ = 'Gareth Coles'
 
+import os
+
+from twisted.internet import reactor
+from twisted.internet.task import LoopingCall
+
+try:
+    from twisted.internet import inotify
+    from twisted.python import filepath
+except ImportError:  # Not on Linux
+    inotify = None
+
 import system.storage.files as files
 
 from system.storage.exceptions import UnknownStorageTypeError
+from system.storage.serializers import file_stat
 from system.singleton import Singleton
 from system.logging.logger import getLogger
 
@@ -38,12 +50,24 @@ class StorageManager(object):
 
     editor_warning = False
 
+    #: How long a changed file has to stay unchanged before it's reloaded,
+    #: in seconds, so we don't reload something that's halfway through
+    #: being written
+    watch_debounce = 1
+
+    watcher = None  # LoopingCall that polls files for changes
+    notifier = None  # INotify instance, if we're using inotify
+    _recheck = None  # Delayed call to check changed files again
+
     def __init__(self, conf_path="config/", data_path="data/"):
         self.conf_path = conf_path
         self.data_path = data_path
 
         self.log = getLogger("Storage")
 
+        self._changed = {}  # {filename: (stat, when we first saw it)}
+        self._notify_paths = set()  # Directories inotify is watching
+
     def get_file(self, obj, storage_type, file_format, path, *args, **kwargs):
         """
         Get the instance of a storage file, creating it if it doesn't exist.
@@ -151,3 +175,213 @@ class StorageManager(object):
                 self.log.trace(_("Obj %s owns this file.") % instance)
                 f.release(self)
                 del self.data_files[key]
+
+    def flush_files(self):
+        """
+        Write out any changes that loaded files are holding on to. This is
+        done when files are released, but should also be done at shutdown,
+        for files that are never released.
+        """
+
+        for key, f in self.config_files.items() + self.data_files.items():
+            try:
+                f.flush()
+            except Exception:
+                self.log.exception(_("Error flushing file: %s") % key)
+
+    # File watching
+
+    def start_watching(self, interval=5, debounce=None, use_inotify=True):
+        """
+        Start watching loaded files for changes, reloading them when they're
+        edited.
+
+        All the files are checked together on one timer, with a single stat
+        call each. Files are only reloaded if their modification time, size
+        or inode are different from when they were last loaded or saved, and
+        haven't changed again for the debounce period.
+
+        If inotify is available, it's used to notice changes straight away,
+        and the timer remains as a fallback.
+
+        :param interval: How often to check the files, in seconds
+        :param debounce: How long to wait for a file to stop changing,
+            in seconds
+        :param use_inotify: Whether to use inotify if it's available
+
+        :type interval: int, float
+        :type debounce: int, float
+        :type use_inotify: bool
+        """
+
+        self.stop_watching()
+
+        if debounce is not None:
+            self.watch_debounce = debounce
+
+        if use_inotify and inotify is not None:
+            try:
+                self.notifier = inotify.INotify(reactor)
+                self.notifier.startReading()
+                self._update_notify_paths(self.get_watched_files())
+            except Exception:
+                self.log.debug(_("Unable to use inotify, falling back to "
+                                 "polling only"))
+                self.notifier = None
+
+        self.watcher = LoopingCall(self.check_files)
+        self.watcher.clock = reactor
+        self.watcher.start(interval, now=False)
+
+        self.log.debug(_("Watching files for changes every %s seconds")
+                       % interval)
+
+    def stop_watching(self):
+        """
+        Stop watching files for changes.
+        """
+
+        if self.watcher is not None and self.watcher.running:
+            self.watcher.stop()
+
+        self.watcher = None
+
+        if self.notifier is not None:
+            try:
+                self.notifier.loseConnection()
+            except Exception:
+                self.log.exception(_("Error stopping inotify"))
+
+        if self._recheck is not None and self._recheck.active():
+            self._recheck.cancel()
+
+        self.notifier = None
+        self._recheck = None
+        self._notify_paths = set()
+        self._changed = {}
+
+    def get_watched_files(self):
+        """
+        Get all of the loaded files that can be watched for changes - that
+        is, files that have been read from disk.
+
+        :return: A dict of {filename: file object}
+        :rtype: dict
+        """
+
+        watched = {}
+
+        for f in self.config_files.values() + self.data_files.values():
+            obj = f.obj
+
+            if obj is None or getattr(obj, "_stat", None) is None:
+                continue
+
+            watched[obj.filename] = obj
+
+        return watched
+
+    def check_files(self, filenames=None):
+        """
+        Check loaded files for changes, reloading any that have finished
+        changing.
+
+        This is called regularly once *start_watching* has been called, but
+        you can call it yourself as well.
+
+        Files with unsaved changes are left alone - they'll be written out
+        over the top of whatever's on disk anyway.
+
+        :param filenames: Only check these files, instead of all of them
+        :type filenames: list
+
+        :return: A list of files that were reloaded
+        :rtype: list
+        """
+
+        watched = self.get_watched_files()
+        now = reactor.seconds()
+        reloaded = []
+
+        if self.notifier is not None:
+            self._update_notify_paths(watched)
+
+        for filename, obj in watched.iteritems():
+            if filenames is not None and filename not in filenames:
+                continue
+
+            stat = file_stat(filename)
+
+            if stat is None or stat == obj._stat:
+                self._changed.pop(filename, None)
+                continue
+
+            if getattr(obj, "dirty", False):
+                continue
+
+            if filename in self._changed:
+                last_stat, seen = self._changed[filename]
+
+                if stat == last_stat:
+                    if now - seen < self.watch_debounce:
+                        continue  # Give it a bit longer
+
+                    del self._changed[filename]
+                    self.log.info(_("File changed, reloading: %s")
+                                  % filename)
+
+                    try:
+                        obj.reload()
+                    except Exception:
+                        self.log.exception(_("Error reloading file: %s")
+                                           % filename)
+                    else:
+                        reloaded.append(filename)
+
+                    continue
+
+            # New change, or it's still being written to
+            self._changed[filename] = (stat, now)
+
+        for filename in self._changed.keys():
+            if filename not in watched:
+                del self._changed[filename]
+
+        if self._changed and self.notifier is not None:
+            # Don't wait for the next poll to pick these up
+            if self._recheck is None or not self._recheck.active():
+                self._recheck = reactor.callLater(self.watch_debounce,
+                                                  self.check_files)
+
+        return reloaded
+
+    def _update_notify_paths(self, watched):
+        paths = set(
+            os.path.dirname(os.path.abspath(f)) for f in watched.iterkeys()
+        )
+
+        mask = inotify.IN_MODIFY | inotify.IN_CLOSE_WRITE | \
+            inotify.IN_MOVED_TO | inotify.IN_CREATE
+
+        for path in paths - self._notify_paths:
+            try:
+                self.notifier.watch(filepath.FilePath(path), mask,
+                                    callbacks=[self._inotify_event])
+            except Exception:
+                self.log.exception(_("Unable to watch directory: %s") % path)
+
+        for path in self._notify_paths - paths:
+            try:
+                self.notifier.ignore(filepath.FilePath(path))
+            except Exception:
+                pass  # Directory's probably gone
+
+        self._notify_paths = paths
+
+    def _inotify_event(self, ignored, path, mask):
+        path = path.path
+
+        for filename in self.get_watched_files().iterkeys():
+            if os.path.abspath(filename) == path:
+                self.check_files([filename])
+                break
@@ -0,0 +1,184 @@
+"""
+Serialization helpers for the storage system.
+
+These use the fastest implementations we have available - libyaml's C
+loader and dumper for YAML, and ujson or simplejson for JSON if they're
+installed - falling back to the pure-Python ones if not.
+
+YAML is always loaded safely. Files that were dumped before we used the
+safe dumper may contain a few Python-specific tags (for unicode strings and
+tuples, for example), so those are supported by the loader as well.
+"""
+
+__author__ = 'Gareth Coles'
+
+import json
+import os
+import yaml
+
+try:
+    from yaml import CSafeLoader as BaseLoader, CSafeDumper as BaseDumper
+except ImportError:
+    from yaml import SafeLoader as BaseLoader, SafeDumper as BaseDumper
+
+try:
+    import ujson as fast_json
+except ImportError:
+    fast_json = None
+
+try:
+    import simplejson as pretty_json
+except ImportError:
+    pretty_json = json
+
+from system.logging.logger import getLogger
+
+from system.translations import Translations
+_ = Translations().get()
+
+log = getLogger("Serializers")
+
+
+class Loader(BaseLoader):
+    """
+    Safe YAML loader that also understands the harmless Python tags that
+    the standard dumper emits.
+    """
+
+
+Loader.add_constructor(
+    u"tag:yaml.org,2002:python/unicode",
+    lambda loader, node: unicode(loader.construct_scalar(node))
+)
+Loader.add_constructor(
+    u"tag:yaml.org,2002:python/str",
+    lambda loader, node: str(loader.construct_scalar(node))
+)
+Loader.add_constructor(
+    u"tag:yaml.org,2002:python/long",
+    lambda loader, node: long(loader.construct_scalar(node))
+)
+Loader.add_constructor(
+    u"tag:yaml.org,2002:python/tuple",
+    lambda loader, node: tuple(loader.construct_sequence(node))
+)
+
+
+class Dumper(BaseDumper):
+    """
+    Safe YAML dumper.
+    """
+
+
+def yaml_load(stream):
+    """
+    Load a YAML document.
+
+    :param stream: A string or file-like object to load from
+    :return: The loaded data
+    """
+
+    return yaml.load(stream, Loader=Loader)
+
+
+def yaml_load_all(stream):
+    """
+    Load a stream of YAML documents.
+
+    :param stream: A string or file-like object to load from
+    :return: A generator of loaded documents
+    """
+
+    return yaml.load_all(stream, Loader=Loader)
+
+
+def yaml_dump(data, **kwargs):
+    """
+    Dump some data to a YAML string.
+
+    Only types the safe loader can read back are supported - if the data
+    contains anything else (objects, frozensets, complex numbers and so
+    on), this raises rather than writing a file we couldn't load again.
+
+    :param data: The data to dump
+    :param kwargs: Extra arguments for the dumper
+    :return: The YAML document
+    :rtype: str
+
+    :raises: yaml.representer.RepresenterError if the data contains
+        something we can't safely dump
+    """
+
+    try:
+        return yaml.dump(data, Dumper=Dumper, **kwargs)
+    except yaml.representer.RepresenterError as e:
+        log.error(_("Unable to dump data safely: %s") % e)
+        raise
+
+
+def json_load(fh):
+    """
+    Load a JSON document from a file.
+
+    :param fh: A file-like object to load from
+    :return: The loaded data
+    """
+
+    return json_loads(fh.read())
+
+
+def json_loads(data):
+    """
+    Load a JSON document from a string.
+
+    :param data: The string to load
+    :return: The loaded data
+    """
+
+    if fast_json is not None:
+        try:
+            return fast_json.loads(data)
+        except ValueError:
+            pass  # Let the standard module produce a proper error message
+
+    return json.loads(data)
+
+
+def json_dumps(data, pretty=False):
+    """
+    Dump some data to a JSON string.
+
+    :param data: The data to dump
+    :param pretty: Whether to indent and sort the output, for files people
+        might want to read
+    :return: The JSON document
+    :rtype: str
+    """
+
+    if pretty:
+        return pretty_json.dumps(data, indent=4, sort_keys=True,
+                                 separators=(",", ": "))
+
+    if fast_json is not None:
+        return fast_json.dumps(data)
+
+    return json.dumps(data, separators=(",", ":"))
+
+
+def file_stat(filename):
+    """
+    Get a key that changes whenever a file does, for deciding whether it
+    needs to be parsed again.
+
+    :param filename: The file to check
+    :return: A tuple of the file's mtime, size and inode, or None if it
+        doesn't exist
+    :rtype: tuple, None
+    """
+
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+
+    return st.st_mtime, st.st_size, st.st_ino
@@ -0,0 +1,227 @@
+__author__ = 'Gareth Coles'
+
+"""
+Tests for the auth handler in the auth plugin.
+"""
+
+# Imports
+
+import hashlib
+
+import nose.tools as nosetools
+
+from mock import Mock
+from twisted.internet.defer import fail
+from twisted.internet.task import Clock
+
+from plugins.auth import hashing
+from plugins.auth.auth_handler import authHandler
+from plugins.auth.throttle import LoginThrottle, get_hostmask
+from system.storage.data import MemoryData
+
+
+class test_auth:
+    """
+    AUTH | Test password hashing, logins and throttling
+    """
+
+    def setup(self):
+        self.plugin = Mock()
+        self.plugin.config = {"hashing": {"scheme": "pbkdf2",
+                                          "rounds": 1000}}
+        self.plugin.get_permissions_handler.return_value = None
+
+        self.data = MemoryData({})
+
+        self.handler = authHandler.__new__(authHandler)
+        self.handler.use_threads = False
+        self.handler.__init__(self.plugin, self.data, MemoryData({}))
+
+    def result(self, d):
+        results = []
+        d.addBoth(results.append)
+        return results[0]
+
+    def test_hashing(self):
+        """
+        AUTH | Test password hashing schemes
+        """
+
+        hasher = hashing.get_hasher("pbkdf2", rounds=1000)
+        record = hasher.hash("password")
+
+        nosetools.eq_(record["scheme"], "pbkdf2")
+        nosetools.eq_(record["rounds"], 1000)
+        nosetools.ok_(hashing.verify("password", record))
+        nosetools.ok_(not hashing.verify("Password", record))
+        nosetools.ok_(not hasher.needs_rehash(record))
+
+        nosetools.ok_(hashing.get_hasher("pbkdf2", rounds=2000)
+                      .needs_rehash(record))
+
+        legacy = {"salt": "salt",
+                  "password": hashlib.sha512("saltpassword").hexdigest()}
+
+        nosetools.ok_(hashing.verify("password", legacy))
+        nosetools.ok_(hasher.needs_rehash(legacy))
+
+        nosetools.assert_raises(KeyError, hashing.get_hasher, "rot13")
+
+    def test_superadmin(self):
+        """
+        AUTH | Test the superadmin account's password is only logged once
+        it's been created
+        """
+
+        logged = [call[0][0] for call
+                  in self.plugin.logger.info.call_args_list
+                  if "password:" in call[0][0]]
+
+        nosetools.eq_(len(logged), 1)
+        nosetools.ok_(hashing.verify(logged[0].split()[-1],
+                                     self.data["superadmin"]))
+
+        plugin = Mock()
+        plugin.config = self.plugin.config
+
+        handler = authHandler.__new__(authHandler)
+        handler.use_threads = False
+        handler.create_user = Mock(return_value=fail(Exception("Broken")))
+        handler.__init__(plugin, MemoryData({}), MemoryData({}))
+
+        logged = [call[0][0] for call in plugin.logger.info.call_args_list]
+
+        nosetools.ok_(not any("password:" in line for line in logged))
+        nosetools.eq_(plugin.logger.error.call_count, 1)
+        nosetools.ok_(not plugin.get_permissions_handler.called)
+
+    def test_login(self):
+        """
+        AUTH | Test logging in, and upgrading legacy password hashes
+        """
+
+        handler = self.handler
+
+        nosetools.ok_("superadmin" in self.data)
+        nosetools.ok_(self.result(handler.create_user("Test", "password")))
+        nosetools.ok_(not self.result(handler.create_user("test", "other")))
+
+        user = Mock()
+        user.authorized = False
+
+        nosetools.ok_(not self.result(
+            handler.login(user, None, "test", "wrong")
+        ))
+        nosetools.ok_(not user.authorized)
+
+        nosetools.ok_(self.result(
+            handler.login(user, None, "TEST", "password")
+        ))
+        nosetools.ok_(user.authorized)
+        nosetools.eq_(user.auth_name, "test")
+
+        # Logging in without a password check, like after registering
+        other = Mock()
+        handler.set_logged_in(other, "Test")
+
+        nosetools.ok_(other.authorized)
+        nosetools.eq_(other.auth_name, "test")
+
+        nosetools.ok_(not self.result(
+            handler.change_password("test", "wrong", "new")
+        ))
+        nosetools.ok_(self.result(
+            handler.change_password("test", "password", "new")
+        ))
+        nosetools.ok_(self.result(handler.check_login("test", "new")))
+
+        # Legacy hashes are upgraded when their owners log in
+        with self.data:
+            self.data["legacy"] = {
+                "salt": "salt",
+                "password": hashlib.sha512("saltpassword").hexdigest()
+            }
+
+        nosetools.ok_(not self.result(handler.check_login("legacy", "wrong")))
+        nosetools.ok_("scheme" not in self.data["legacy"])
+
+        nosetools.ok_(self.result(handler.check_login("legacy", "password")))
+        nosetools.eq_(self.data["legacy"]["scheme"], "pbkdf2")
+        nosetools.eq_(self.data["legacy"]["rounds"], 1000)
+
+        nosetools.ok_(self.result(handler.check_login("legacy", "password")))
+
+    def test_throttle(self):
+        """
+        AUTH | Test throttling login attempts
+        """
+
+        clock = Clock()
+        login = LoginThrottle({"username": {"attempts": 2, "per": 10},
+                               "hostmask": {"attempts": 3, "per": 30},
+                               "max-entries": 20}, clock)
+
+        nosetools.ok_(login.attempt("irc/a@one", "Test"))
+        nosetools.ok_(login.attempt("irc/a@one", "test"))
+        nosetools.ok_(not login.attempt("irc/a@one", "test"))
+
+        # Refused by the hostmask, without using up the username's tokens
+        nosetools.ok_(not login.attempt("irc/a@one", "other"))
+        nosetools.eq_(login.usernames.tokens("other"), 2)
+
+        nosetools.ok_(not login.attempt("irc/b@two", "test"))
+        login.succeeded("test")
+        nosetools.ok_(login.attempt("irc/b@two", "test"))
+
+        clock.advance(10)
+        nosetools.ok_(login.attempt("irc/a@one"))
+        nosetools.eq_(len(login), 3)
+
+        # Buckets are swept once they've refilled
+        login.start()
+        clock.advance(60)
+        nosetools.eq_(len(login), 0)
+        login.stop()
+
+        # Spraying keys can't grow the tables past their limit
+        for i in xrange(100):
+            login.attempt("irc/a@%s" % i, "user%s" % i)
+
+        nosetools.ok_(len(login.hostmasks) <= 20)
+        nosetools.ok_(len(login.usernames) <= 20)
+        nosetools.ok_("irc/a@99" in login.hostmasks)
+
+        # ..and can't push out the buckets that are throttling someone
+        clock.advance(60)
+
+        for i in xrange(3):
+            login.attempt("irc/throttled", "victim")
+
+        for i in xrange(100):
+            nosetools.ok_(not login.attempt("irc/throttled", "victim"))
+            login.attempt("irc/spray%s" % i, "spray%s" % i)
+
+        nosetools.ok_(login.hostmasks.evicted > 0)
+        nosetools.ok_(login.usernames.evicted > 0)
+        nosetools.ok_(not login.attempt("irc/throttled"))
+        nosetools.ok_(not login.attempt("irc/other", "victim"))
+
+        user = Mock()
+        user.nickname = "Gdude"
+        user.ident = "Ident"
+        user.host = "Example.com"
+
+        # Idents and nicknames can be changed at will, so only the host counts
+        nosetools.eq_(get_hostmask(user, "irc"), "irc/example.com")
+
+        user.host = None
+        nosetools.eq_(get_hostmask(user, "irc"), None)
+
+        # Without a host, only the username limit applies
+        login = LoginThrottle({"username": {"attempts": 1, "per": 10},
+                               "hostmask": {"attempts": 1, "per": 10}}, clock)
+
+        nosetools.ok_(login.attempt(None, "test"))
+        nosetools.ok_(login.attempt(None))
+        nosetools.ok_(not login.attempt(None, "test"))
+        nosetools.eq_(len(login.hostmasks), 0)
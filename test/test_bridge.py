@@ -0,0 +1,181 @@
+__author__ = 'Gareth Coles'
+
+"""
+Tests for the bridge plugin's rule routing and templates.
+"""
+
+# Imports
+
+import nose.tools as nosetools
+
+from mock import Mock
+
+from plugins.bridge import BridgePlugin
+from plugins.bridge.rules import RoutingTable, Template
+from system.protocols.generic.channel import Channel
+from system.protocols.generic.user import User
+
+
+def make_rule(protocol, source, target, source_type="channel",
+              target_protocol="irc-archives", target_type="channel"):
+    return {
+        "from": {"protocol": protocol, "source": source,
+                 "source-type": source_type},
+        "to": {"protocol": target_protocol, "target": target,
+               "target-type": target_type},
+        "formatting": {"general": {"message": "<{USER}> {MESSAGE}",
+                                   "join": "* {USER} joined {CHANNEL}"}}
+    }
+
+
+class FakeProtocol(object):
+    """
+    Records sent messages, in place of a protocol
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.ourselves = User("Ultros", self)
+        self.sent = []
+        self.batches = 0
+
+    def send_msgs(self, target, messages, target_type=None, use_event=True):
+        self.batches += 1
+        self.sent.extend((target, message) for message in messages)
+
+
+class test_bridge:
+    """
+    BRIDGE | Test rule routing and templates
+    """
+
+    def setup(self):
+        self.rules = {
+            "specific": make_rule("IRC-Esper", "#Ultros", "#one"),
+            "wildcard": make_rule("irc-esper", "*", "#two"),
+            "private": make_rule("irc-esper", "ignored", "#three", "user"),
+            "other": make_rule("mumble", "Root", "#four"),
+            "missing": make_rule("irc-esper", "*", "#five",
+                                 target_protocol="nowhere")
+        }
+
+        self.esper = FakeProtocol("irc-esper")
+        self.archives = FakeProtocol("irc-archives")
+
+        protocols = {"irc-esper": self.esper, "irc-archives": self.archives}
+
+        self.plugin = BridgePlugin.__new__(BridgePlugin)
+        self.plugin.config = {"rules": self.rules}
+        self.plugin.logger = Mock()
+        self.plugin.factory_manager = Mock()
+        self.plugin.factory_manager.get_protocol = protocols.get
+        self.plugin.routes = RoutingTable()
+        self.plugin.compile_rules()
+
+    def test_routing_table(self):
+        """
+        BRIDGE | Test matching rules with the routing table
+        """
+
+        routes = self.plugin.routes
+
+        nosetools.eq_(len(routes), 5)
+        nosetools.eq_(
+            [r.name for r in routes.match("irc-esper", "channel", "#ultros")],
+            ["missing", "specific", "wildcard"]
+        )
+        nosetools.eq_(
+            [r.name for r in routes.match("irc-esper", "channel", "#other")],
+            ["missing", "wildcard"]
+        )
+        nosetools.eq_(
+            [r.name for r in routes.match("irc-esper", "user", "anyone")],
+            ["private"]
+        )
+        nosetools.eq_(routes.match("irc-other", "channel", "#ultros"), [])
+
+        errors = routes.compile({"broken": {"from": {}}})
+
+        nosetools.eq_([name for name, error in errors], ["broken"])
+        nosetools.eq_(len(routes), 0)
+
+    def test_relay(self):
+        """
+        BRIDGE | Test relaying messages with compiled rules
+        """
+
+        user = User("gdude", self.esper)
+        channel = Channel("#Ultros", self.esper)
+
+        self.plugin.do_rules("Hello\nWorld", self.esper, user, channel)
+
+        nosetools.eq_(self.archives.sent, [
+            ("#one", "<gdude> Hello"), ("#one", "<gdude> World"),
+            ("#two", "<gdude> Hello"), ("#two", "<gdude> World")
+        ])
+        nosetools.eq_(self.archives.batches, 2)  # One per rule
+
+        self.archives.sent = []
+        self.plugin.do_rules("", self.esper, user, channel,
+                             f_str=["general", "join"],
+                             tokens={"CHANNEL": "#Ultros"})
+        self.plugin.do_rules("Hi", self.esper, user,
+                             self.esper.ourselves)
+
+        nosetools.eq_(self.archives.sent, [
+            ("#one", "* gdude joined #Ultros"),
+            ("#two", "* gdude joined #Ultros"),
+            ("#three", "<gdude> Hi")
+        ])
+
+        # Rules are recompiled when the config changes
+        self.archives.sent = []
+        del self.rules["wildcard"]
+        self.plugin.compile_rules()
+        self.plugin.do_rules("Hello", self.esper, user, channel)
+
+        nosetools.eq_(self.archives.sent, [("#one", "<gdude> Hello")])
+
+    def test_relay_to_user(self):
+        """
+        BRIDGE | Test that to_user is checked against the target type
+        """
+
+        self.rules.clear()
+        self.rules["pm"] = make_rule("irc-esper", "*", "gdude",
+                                     target_type="user")
+        self.rules["named"] = make_rule("irc-esper", "*", "user")
+        self.plugin.compile_rules()
+
+        user = User("gdude", self.esper)
+        channel = Channel("#Ultros", self.esper)
+
+        self.plugin.do_rules("Hi", self.esper, user, channel)
+
+        nosetools.eq_(sorted(self.archives.sent), [("gdude", "<gdude> Hi"),
+                                                   ("user", "<gdude> Hi")])
+
+        # A channel that happens to be called "user" isn't a PM
+        self.archives.sent = []
+        self.plugin.do_rules("Hi", self.esper, user, channel, to_user=False)
+
+        nosetools.eq_(self.archives.sent, [("user", "<gdude> Hi")])
+
+    def test_template(self):
+        """
+        BRIDGE | Test parsed format templates
+        """
+
+        template = Template("* {USER} was {BANNED?} ({MESSAGE}) {UNKNOWN}")
+
+        nosetools.eq_(
+            template.render({"USER": "gdude", "BANNED?": "kicked",
+                             "MESSAGE": "{USER}"}),
+            "* gdude was kicked ({USER}) {UNKNOWN}"
+        )
+
+        chunks = Template("{MESSAGE} | {MESSAGE}").split({})
+        nosetools.eq_([line.join(chunks) for line in ["a", "b"]],
+                      ["a | a", "b | b"])
+
+        nosetools.eq_(Template("No tokens").split({}), ["No tokens"])
@@ -8,7 +8,7 @@ import nose
 import nose.tools as nosetools
 from mock import MagicMock as Mock
 
-from system.command_manager import CommandManager
+from system.command_manager import CommandManager, split_args
 from system.enums import CommandState
 
 
@@ -245,3 +245,56 @@ class test_commands:
         r = self.manager.run_command("test7", caller, source, protocol, "")
         nosetools.assert_equals(r, (CommandState.Unknown, None))
         nosetools.assert_equals(self.plugin.handler.call_count, 0)
+
+    @nose.with_setup(teardown=teardown)
+    def test_split_args(self):
+        """CMNDS | Test splitting command arguments"""
+
+        nosetools.assert_equals(split_args("  a b\tc  "), ["a", "b", "c"])
+        nosetools.assert_equals(split_args('a "b c" d"e f"g ""'),
+                                ["a", "b c", "de fg", ""])
+        nosetools.assert_equals(split_args(r'a\ b "c\"d\e"'),
+                                ["a b", 'c"d\\e'])
+        nosetools.assert_equals(split_args("it's"), ["it's"])
+        nosetools.assert_equals(split_args(u'\xe9 "\xe9 \xe9"'),
+                                [u"\xe9", u"\xe9 \xe9"])
+
+        nosetools.assert_raises(ValueError, split_args, 'a "b')
+        nosetools.assert_raises(ValueError, split_args, "a\\")
+
+    @nose.with_setup(teardown=teardown)
+    def test_process_input(self):
+        """CMNDS | Test processing input"""
+
+        self.manager.register_command("test8", self.plugin.handler,
+                                      self.plugin, default=True)
+        self.manager.register_command("test9", self.plugin.raw_handler,
+                                      self.plugin, default=True,
+                                      parse_args=False)
+
+        caller = Mock(name="caller")
+        source = Mock(name="source")
+        protocol = Mock(name="protocol")
+
+        r = self.manager.process_input("hello there", caller, source,
+                                       protocol, "!", "Ultros")
+        nosetools.assert_equals(r, (CommandState.NotACommand, None))
+
+        r = self.manager.process_input('ULTROS: test8 a "b c"', caller,
+                                       source, protocol, "{NAME}: ",
+                                       "Ultros")
+        nosetools.assert_equals(r, (CommandState.Success, None))
+        self.plugin.handler.assert_called_with(protocol, caller, source,
+                                               "test8", 'a "b c"',
+                                               ["a", "b c"])
+
+        r = self.manager.process_input('ultros: test9 a "b c', caller,
+                                       source, protocol, "{NAME}: ",
+                                       "Ultros")
+        nosetools.assert_equals(r, (CommandState.Success, None))
+        self.plugin.raw_handler.assert_called_with(protocol, caller, source,
+                                                   "test9", 'a "b c', None)
+
+        r = self.manager.process_input("Ultros", caller, source, protocol,
+                                       "{NAME}: ", "Ultros")
+        nosetools.assert_equals(r, (CommandState.NotACommand, None))
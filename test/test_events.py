@@ -0,0 +1,457 @@
+__author__ = 'Gareth Coles'
+
+"""Tests for the event manager"""
+
+import logbook
+import logging
+import nose
+
+import nose.tools as nosetools
+from mock import MagicMock as Mock, patch
+from twisted.internet.defer import Deferred, succeed
+from twisted.internet.task import Clock
+
+from system.decorators.threads import BoundedQueue
+from system.enums import QueuePolicy
+from system.event_manager import EventManager
+from system.events.base import BaseEvent, PluginEvent
+
+
+def make_plugin(name):
+    plugin = Mock(name=name)
+    plugin.info.name = name
+
+    return plugin
+
+
+def make_protocol(name, protocol_type):
+    protocol = Mock(name=name)
+    protocol.name = name
+    protocol.TYPE = protocol_type
+
+    return protocol
+
+
+class SubPluginEvent(PluginEvent):
+    pass
+
+
+class test_events:
+
+    def __init__(self):
+        self.manager = EventManager()
+        self.manager.logger.setLevel(logging.CRITICAL)  # Shut up, logger
+
+    @nosetools.nottest
+    def teardown(self):
+        # Clean up
+        self.manager.callbacks.clear()
+        self.manager.plans.clear()
+        self.manager.routes.clear()
+        self.manager.subscriptions.clear()
+        self.manager.queues.clear()
+
+    @nose.with_setup(teardown=teardown)
+    def test_singleton(self):
+        """EVNTS | Test Singleton metaclass"""
+        nosetools.assert_true(self.manager is EventManager())
+
+    @nose.with_setup(teardown=teardown)
+    def test_add_callback(self):
+        """EVNTS | Test adding callbacks compiles a plan"""
+        plugin = make_plugin("test")
+
+        self.manager.add_callback("Test", plugin, plugin.handler, 0,
+                                  extra_args=["arg"],
+                                  extra_kwargs={"kwarg": True})
+
+        nosetools.assert_true(self.manager.has_callback("Test"))
+        nosetools.assert_true(self.manager.has_plugin_callback("Test",
+                                                               "test"))
+        nosetools.eq_(len(self.manager.plans["Test"]), 1)
+
+        event = BaseEvent(None)
+        self.manager.run_callback("Test", event)
+
+        plugin.handler.assert_called_once_with(event, "arg", kwarg=True)
+
+    @nose.with_setup(teardown=teardown)
+    @nosetools.raises(ValueError)
+    def test_add_callback_twice(self):
+        """EVNTS | Test adding a second callback for the same plugin"""
+        plugin = make_plugin("test")
+
+        self.manager.add_callback("Test", plugin, plugin.handler, 0)
+        self.manager.add_callback("Test", plugin, plugin.handler, 0)
+
+    @nose.with_setup(teardown=teardown)
+    def test_priority(self):
+        """EVNTS | Test callbacks are run in priority order"""
+        order = []
+
+        low = make_plugin("low")
+        high = make_plugin("high")
+
+        self.manager.add_callback("Test", low,
+                                  lambda e: order.append("low"), 0)
+        self.manager.add_callback("Test", high,
+                                  lambda e: order.append("high"), 10)
+
+        self.manager.run_callback("Test", BaseEvent(None))
+
+        nosetools.eq_(order, ["high", "low"])
+
+    @nose.with_setup(teardown=teardown)
+    def test_filters(self):
+        """EVNTS | Test callback filters"""
+        accepted = make_plugin("accepted")
+        rejected = make_plugin("rejected")
+        broken = make_plugin("broken")
+
+        self.manager.add_callback("Test", accepted, accepted.handler, 0,
+                                  fltr=lambda e: True)
+        self.manager.add_callback("Test", rejected, rejected.handler, 0,
+                                  fltr=lambda e: False)
+        self.manager.add_callback("Test", broken, broken.handler, 0,
+                                  fltr="Not a callable")
+
+        # Broken filters are left out of the plan, but not the callbacks
+        nosetools.eq_(len(self.manager.get_callbacks("Test")), 3)
+        nosetools.eq_(len(self.manager.plans["Test"]), 2)
+
+        self.manager.run_callback("Test", BaseEvent(None))
+
+        nosetools.eq_(accepted.handler.call_count, 1)
+        nosetools.eq_(rejected.handler.call_count, 0)
+        nosetools.eq_(broken.handler.call_count, 0)
+
+    @nose.with_setup(teardown=teardown)
+    def test_cancelled(self):
+        """EVNTS | Test cancelled events"""
+        accepts = make_plugin("accepts")
+        ignores = make_plugin("ignores")
+
+        self.manager.add_callback("Test", accepts, accepts.handler, 0,
+                                  cancelled=True)
+        self.manager.add_callback("Test", ignores, ignores.handler, 0)
+
+        event = BaseEvent(None)
+        event.cancelled = True
+
+        self.manager.run_callback("Test", event)
+
+        nosetools.eq_(accepts.handler.call_count, 1)
+        nosetools.eq_(ignores.handler.call_count, 0)
+
+    @nose.with_setup(teardown=teardown)
+    def test_exceptions(self):
+        """EVNTS | Test an exception doesn't stop other callbacks"""
+        broken = make_plugin("broken")
+        working = make_plugin("working")
+
+        broken.handler.side_effect = Exception("Broken")
+
+        self.manager.add_callback("Test", broken, broken.handler, 10)
+        self.manager.add_callback("Test", working, working.handler, 0)
+
+        self.manager.run_callback("Test", BaseEvent(None))
+
+        nosetools.eq_(broken.handler.call_count, 1)
+        nosetools.eq_(working.handler.call_count, 1)
+
+    @nose.with_setup(teardown=teardown)
+    def test_remove_callbacks(self):
+        """EVNTS | Test removing callbacks recompiles plans"""
+        first = make_plugin("first")
+        second = make_plugin("second")
+
+        self.manager.add_callback("Test", first, first.handler, 0)
+        self.manager.add_callback("Test", second, second.handler, 0)
+        self.manager.add_callback("Other", first, first.handler, 0)
+
+        self.manager.remove_callback("Test", "first")
+        nosetools.eq_(len(self.manager.plans["Test"]), 1)
+
+        self.manager.remove_callbacks_for_plugin("first")
+        nosetools.assert_false("Other" in self.manager.plans)
+
+        self.manager.remove_callbacks("Test")
+        nosetools.assert_false("Test" in self.manager.plans)
+
+        self.manager.run_callback("Test", BaseEvent(None))
+
+        nosetools.eq_(first.handler.call_count, 0)
+        nosetools.eq_(second.handler.call_count, 0)
+
+    @nose.with_setup(teardown=teardown)
+    def test_event_type_routing(self):
+        """EVNTS | Test routing callbacks by event class"""
+        untyped = make_plugin("untyped")
+        plugins = make_plugin("plugins")
+        sub = make_plugin("sub")
+
+        self.manager.add_callback("Test", untyped, untyped.handler, 0)
+        self.manager.add_callback("Test", plugins, plugins.handler, 0,
+                                  event_type=PluginEvent)
+        self.manager.add_callback("Test", sub, sub.handler, 0,
+                                  event_type=[SubPluginEvent])
+
+        self.manager.run_callback("Test", BaseEvent(None))
+        self.manager.run_callback("Test", PluginEvent(None))
+        self.manager.run_callback("Test", SubPluginEvent(None))
+
+        nosetools.eq_(untyped.handler.call_count, 3)
+        nosetools.eq_(plugins.handler.call_count, 2)
+        nosetools.eq_(sub.handler.call_count, 1)
+
+        # One route per event class
+        nosetools.eq_(len(self.manager.routes["Test"]), 3)
+
+    @nose.with_setup(teardown=teardown)
+    def test_protocol_routing(self):
+        """EVNTS | Test routing callbacks by protocol name and type"""
+        esper = make_plugin("esper")
+        irc = make_plugin("irc")
+        mumble = make_plugin("mumble")
+
+        self.manager.add_callback("Test", esper, esper.handler, 0,
+                                  protocol="esper")
+        self.manager.add_callback("Test", irc, irc.handler, 0,
+                                  protocol_type=["irc"])
+        self.manager.add_callback("Test", mumble, mumble.handler, 0,
+                                  protocol_type="mumble")
+
+        self.manager.run_callback(
+            "Test", BaseEvent(make_protocol("esper", "irc"))
+        )
+        self.manager.run_callback(
+            "Test", BaseEvent(make_protocol("freenode", "irc"))
+        )
+        self.manager.run_callback(
+            "Test", BaseEvent(make_protocol("mumble", "mumble"))
+        )
+
+        nosetools.eq_(esper.handler.call_count, 1)
+        nosetools.eq_(irc.handler.call_count, 2)
+        nosetools.eq_(mumble.handler.call_count, 1)
+
+    @nose.with_setup(teardown=teardown)
+    def test_routing_recompiled(self):
+        """EVNTS | Test routes are dropped when callbacks change"""
+        first = make_plugin("first")
+        second = make_plugin("second")
+
+        self.manager.add_callback("Test", first, first.handler, 0,
+                                  event_type=PluginEvent)
+        self.manager.run_callback("Test", PluginEvent(None))
+
+        nosetools.eq_(len(self.manager.routes["Test"]), 1)
+
+        self.manager.add_callback("Test", second, second.handler, 0,
+                                  event_type=PluginEvent)
+        nosetools.eq_(len(self.manager.routes["Test"]), 0)
+
+        self.manager.run_callback("Test", PluginEvent(None))
+
+        nosetools.eq_(first.handler.call_count, 2)
+        nosetools.eq_(second.handler.call_count, 1)
+
+        self.manager.remove_callback("Test", "first")
+        self.manager.remove_callback("Test", "second")
+
+        nosetools.assert_false("Test" in self.manager.routes)
+
+    @nose.with_setup(teardown=teardown)
+    @patch("system.decorators.threads.pool")
+    def test_plugin_queue(self, pool):
+        """EVNTS | Test running threaded handlers on a plugin's queue"""
+        plugin = make_plugin("queued")
+
+        self.manager.add_callback("Test", plugin, plugin.handler, 0)
+        queue = self.manager.set_plugin_queue(plugin, max_depth=1)
+
+        nosetools.assert_true(self.manager.get_plugin_queue("queued")
+                              is queue)
+
+        first = BaseEvent(None)
+        self.manager.run_callback("Test", first, threaded=True)
+        self.manager.run_callback("Test", BaseEvent(None), threaded=True)
+
+        # One worker was started, and the second event was dropped
+        nosetools.eq_(pool.callInThread.call_count, 1)
+        nosetools.eq_(plugin.handler.call_count, 0)
+
+        queue._work()
+
+        plugin.handler.assert_called_once_with(first)
+
+        stats = queue.stats()
+
+        nosetools.eq_(stats["queued"], 0)
+        nosetools.eq_(stats["running"], 0)
+        nosetools.eq_(stats["completed"], 1)
+        nosetools.eq_(stats["dropped"], 1)
+
+        self.manager.remove_callbacks_for_plugin("queued")
+        nosetools.assert_true(self.manager.get_plugin_queue("queued") is None)
+
+    @patch("system.decorators.threads.pool")
+    def test_queue_coalesce(self, pool):
+        """EVNTS | Test coalescing work in a full bounded queue"""
+        func = Mock()
+        queue = BoundedQueue("Test", workers=1, max_depth=2,
+                             policy=QueuePolicy.Coalesce)
+
+        nosetools.assert_true(queue.submit("a", func, 1))
+        nosetools.assert_true(queue.submit("b", func, 2))
+        nosetools.assert_true(queue.full)
+
+        # Replaces the waiting work for "a", and "c" has nothing to replace
+        nosetools.assert_true(queue.submit("a", func, 3))
+        nosetools.assert_false(queue.submit("c", func, 4))
+
+        queue._work()
+
+        nosetools.eq_([c[0] for c in func.call_args_list], [(3,), (2,)])
+
+        stats = queue.stats()
+
+        nosetools.eq_(stats["submitted"], 4)
+        nosetools.eq_(stats["coalesced"], 1)
+        nosetools.eq_(stats["dropped"], 1)
+        nosetools.eq_(stats["completed"], 2)
+        nosetools.assert_true(stats["wait_max"] >= stats["wait_avg"] >= 0)
+
+    @nose.with_setup(teardown=teardown)
+    def test_run_callback_async(self):
+        """EVNTS | Test running callbacks that return Deferreds"""
+        order = []
+        waiting = Deferred()
+
+        slow = make_plugin("slow")
+        fast = make_plugin("fast")
+
+        def slow_handler(event):
+            order.append("slow")
+            return waiting
+
+        def fast_handler(event):
+            order.append("fast")
+            return succeed(None)
+
+        self.manager.add_callback("Test", slow, slow_handler, 10)
+        self.manager.add_callback("Test", fast, fast_handler, 0)
+
+        event = BaseEvent(None)
+        results = []
+
+        d = self.manager.run_callback_async("Test", event)
+        d.addCallback(results.append)
+
+        # The fast handler waits for the slow one to finish
+        nosetools.eq_(order, ["slow"])
+        nosetools.eq_(results, [])
+
+        waiting.callback(None)
+
+        nosetools.eq_(order, ["slow", "fast"])
+        nosetools.eq_(results, [event])
+
+    @nose.with_setup(teardown=teardown)
+    def test_run_callback_async_empty(self):
+        """EVNTS | Test running async callbacks with no handlers"""
+        results = []
+        event = BaseEvent(None)
+
+        self.manager.run_callback_async("Test", event).addCallback(
+            results.append
+        )
+
+        nosetools.eq_(results, [event])
+
+    @nose.with_setup(teardown=teardown)
+    def test_run_callback_async_timeout(self):
+        """EVNTS | Test timing out handlers that return Deferreds"""
+        clock = Clock()
+
+        stuck = make_plugin("stuck")
+        after = make_plugin("after")
+
+        stuck.handler.return_value = Deferred()
+        after.handler.return_value = Deferred()
+
+        self.manager.add_callback("Test", stuck, stuck.handler, 10,
+                                  timeout=5)
+        self.manager.add_callback("Test", after, after.handler, 0)
+
+        results = []
+
+        with patch("system.event_manager.reactor", clock):
+            d = self.manager.run_callback_async("Test", BaseEvent(None),
+                                                timeout=30)
+            d.addCallback(results.append)
+
+            clock.advance(5)
+
+            # The stuck handler was cancelled, the next uses the default
+            nosetools.eq_(after.handler.call_count, 1)
+            nosetools.eq_(results, [])
+
+            clock.advance(30)
+
+        nosetools.eq_(len(results), 1)
+        nosetools.eq_(clock.getDelayedCalls(), [])
+
+    @nose.with_setup(teardown=teardown)
+    def test_run_callback_deferred_errors(self):
+        """EVNTS | Test errors from returned Deferreds are handled"""
+        broken = make_plugin("broken")
+        failing = Deferred()
+
+        broken.handler.return_value = failing
+
+        self.manager.add_callback("Test", broken, broken.handler, 0)
+        self.manager.run_callback("Test", BaseEvent(None))
+
+        failing.errback(Exception("Broken"))
+
+        # The error was consumed, rather than left unhandled
+        results = []
+        failing.addBoth(results.append)
+
+        nosetools.eq_(results, [None])
+
+    @nose.with_setup(teardown=teardown)
+    def test_debug_messages_skipped(self):
+        """EVNTS | Test debug messages are only formatted when output"""
+
+        class Name(str):
+            formatted = 0
+
+            def __str__(self):
+                Name.formatted += 1
+                return str.__str__(self)
+
+        plugin = make_plugin(Name("test"))
+        self.manager.add_callback("Test", plugin, plugin.handler, 0)
+
+        logger = self.manager.logger.logger
+        old_level, old_handlers = logger.level, logger.handlers
+
+        handler = logbook.TestHandler(level=logbook.INFO)
+        logger.level = logbook.NOTSET
+        logger.handlers = [handler, logbook.NullHandler()]
+
+        try:
+            self.manager.run_callback("Test", BaseEvent(None))
+            nosetools.eq_(Name.formatted, 0)
+
+            handler.level = logbook.DEBUG
+            self.manager.run_callback("Test", BaseEvent(None))
+            nosetools.eq_(Name.formatted, 1)
+            nosetools.eq_([r.message for r in handler.records],
+                          ["Running callback: test"])
+        finally:
+            logger.level, logger.handlers = old_level, old_handlers
+
+        nosetools.eq_(plugin.handler.call_count, 2)
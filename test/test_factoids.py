@@ -0,0 +1,212 @@
+__author__ = 'Gareth Coles'
+
+"""
+Tests for the factoids plugin's cache and database.
+"""
+
+# Imports
+
+import sqlite3
+
+import nose.tools as nosetools
+
+from mock import Mock
+from twisted.internet.defer import fail, succeed
+
+from plugins.factoids import FactoidsPlugin, MissingFactoidError
+from plugins.factoids.cache import FactoidCache
+from plugins.factoids.migrations import VERSION, get_version, migrate
+from system.protocols.generic.channel import Channel
+
+
+class SyncDB(object):
+    """
+    Runs queries and interactions immediately, against an in-memory SQLite
+    database
+    """
+
+    def __init__(self):
+        self.connection = sqlite3.connect(":memory:")
+        self.interactions = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+    def runInteraction(self, func, *args):
+        self.interactions += 1
+        cursor = self.connection.cursor()
+
+        try:
+            result = func(cursor, *args)
+        except Exception as e:
+            return fail(e)
+
+        self.connection.commit()
+        return succeed(result)
+
+    def runQuery(self, sql, args=()):
+        def _query(txn):
+            txn.execute(sql, args)
+            return txn.fetchall()
+
+        return self.runInteraction(_query)
+
+
+class test_factoids:
+    """
+    FACTOIDS | Test the factoid cache and database
+    """
+
+    def setup(self):
+        self.plugin = FactoidsPlugin.__new__(FactoidsPlugin)
+        self.plugin.logger = Mock()
+        self.plugin.events = Mock()
+        self.plugin.commands = Mock()
+        self.plugin.database = SyncDB()
+        self.plugin.cache = FactoidCache()
+
+        self.plugin.reload()
+
+        self.protocol = Mock()
+        self.protocol.name = "IRC"
+
+        self.channels = []
+
+        for name in ["#one", "#two"]:
+            channel = Channel(name, self.protocol)
+            self.channels.append(channel)
+
+    def get(self, location, factoid, channel=0):
+        results = []
+
+        d = self.plugin.get_factoid(None, self.channels[channel],
+                                    self.protocol, location, factoid)
+        d.addCallbacks(results.append,
+                       lambda f: results.append(f.trap(MissingFactoidError)))
+
+        return results[0]
+
+    def test_cache(self):
+        """
+        FACTOIDS | Test cached factoid lookups and writes
+        """
+
+        one, two = self.channels
+        plugin = self.plugin
+
+        plugin.add_factoid(None, two, self.protocol, "global", "Test", "g")
+        plugin.add_factoid(None, one, self.protocol, "protocol", "Test", "p")
+        plugin.add_factoid(None, one, self.protocol, "channel", "Test", "c")
+        plugin.add_factoid(None, one, self.protocol, "channel", "test", "c2")
+
+        nosetools.ok_(plugin.cache.loaded)
+        nosetools.eq_(len(plugin.cache), 3)
+
+        interactions = plugin.database.interactions
+
+        nosetools.eq_(self.get(None, "TEST"), ("Test", ["c", "c2"]))
+        nosetools.eq_(self.get(None, "test", 1), ("Test", ["p"]))
+        nosetools.eq_(self.get("global", "test", 1), ("Test", ["g"]))
+        nosetools.eq_(self.get("global", "test", 0), MissingFactoidError)
+        nosetools.eq_(self.get(None, "missing"), MissingFactoidError)
+
+        # None of those should have touched the database
+        nosetools.eq_(plugin.database.interactions, interactions)
+
+        plugin.delete_factoid(None, two, self.protocol, "protocol", "test")
+        nosetools.eq_(self.get(None, "test", 1), ("Test", ["g"]))
+
+        plugin.set_factoid(None, two, self.protocol, "channel", "test", "s")
+        nosetools.eq_(self.get(None, "test", 1), ("test", ["s"]))
+
+        # The cache should match the database after all of that
+        expected = sorted(plugin.cache._rows.items())
+        plugin.warm_cache()
+
+        nosetools.eq_(sorted(plugin.cache._rows.items()), expected)
+
+    def test_stale_load(self):
+        """
+        FACTOIDS | Test that loads which raced with a write are discarded
+        """
+
+        cache = FactoidCache()
+        generation = cache.generation
+
+        cache.set("a", "global", "irc", "#one", "A", "new")
+
+        nosetools.ok_(not cache.load([("a", "global", "irc", "#one", "A",
+                                       "old")], generation))
+        nosetools.ok_(not cache.loaded)
+
+        nosetools.ok_(cache.load([("a", "global", "irc", "#one", "A", "new")],
+                                 cache.generation))
+        nosetools.eq_(cache.resolve("a", "other", "#two"), ("A", "new"))
+
+    def test_lookup_order(self):
+        """
+        FACTOIDS | Test that the cache and database pick the same factoid
+        """
+
+        one, two = self.channels
+        plugin = self.plugin
+
+        plugin.add_factoid(None, two, self.protocol, "global", "Test", "b")
+        plugin.add_factoid(None, one, self.protocol, "global", "Test", "a")
+        plugin.add_factoid(None, two, self.protocol, "protocol", "Proto", "b")
+        plugin.add_factoid(None, one, self.protocol, "protocol", "Proto", "a")
+
+        cached = [self.get(None, "test"), self.get(None, "proto")]
+        nosetools.eq_(cached, [("Test", ["a"]), ("Proto", ["a"])])
+
+        interactions = plugin.database.interactions
+        plugin.cache.clear()
+
+        nosetools.eq_([self.get(None, "test"), self.get(None, "proto")],
+                      cached)
+        nosetools.eq_(plugin.database.interactions, interactions + 2)
+
+        # Channel factoids win over protocol ones, which win over global ones
+        plugin.add_factoid(None, one, self.protocol, "channel", "Proto", "c")
+        plugin.cache.clear()
+
+        nosetools.eq_(self.get(None, "proto"), ("Proto", ["c"]))
+        nosetools.eq_(self.get(None, "proto", 1), ("Proto", ["a"]))
+
+    def test_migrations(self):
+        """
+        FACTOIDS | Test migrating a database from before migrations existed
+        """
+
+        connection = sqlite3.connect(":memory:")
+        cursor = connection.cursor()
+
+        cursor.execute("CREATE TABLE factoids (factoid_key TEXT, "
+                       "location TEXT, protocol TEXT, channel TEXT, "
+                       "factoid_name TEXT, info TEXT, "
+                       "UNIQUE(factoid_key, location, protocol, channel) "
+                       "ON CONFLICT REPLACE)")
+        cursor.executemany("INSERT INTO factoids VALUES (?, ?, ?, ?, ?, ?)",
+                           [(u"\xc9t\xc9", "global", None, None,
+                             u"\xc9t\xc9", "info"),
+                            (u"\xc9a", "global", None, None, u"\xc9a", "a"),
+                            (u"\xe9a", "global", None, None, u"\xe9a", "b")])
+
+        logger = Mock()
+
+        nosetools.eq_(migrate(cursor, logger), 0)
+        nosetools.eq_(get_version(cursor), VERSION)
+
+        # The colliding factoid is left alone, rather than replacing the
+        # one that's already there
+        cursor.execute("SELECT factoid_key, info FROM factoids "
+                       "ORDER BY info")
+        nosetools.eq_(cursor.fetchall(), [(u"\xc9a", "a"), (u"\xe9a", "b"),
+                                          (u"\xe9t\xe9", "info")])
+        nosetools.eq_(logger.warn.call_count, 1)
+
+        # Running them again shouldn't do anything
+        nosetools.eq_(migrate(cursor), VERSION)
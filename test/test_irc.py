@@ -0,0 +1,76 @@
+__author__ = 'Gareth Coles'
+
+"""
+Tests for the IRC protocol's user tracking.
+"""
+
+# Imports
+
+import nose.tools as nosetools
+
+from system.protocols.irc.user import User
+from system.protocols.irc.users import Users
+
+from utils.irc import IRCUtils
+
+
+class test_irc:
+    """
+    IRC | Test the IRC protocol's user registry
+    """
+
+    def setup(self):
+        self.utils = IRCUtils(None)
+        self.users = Users(self.utils)
+
+        self.alice = User(None, "Alice[1]", "~alice", "Example.com")
+        self.bob = User(None, "bob", "~bob", "example.com")
+
+        self.users.add(self.alice)
+        self.users.add(self.bob)
+
+    def test_lookups(self):
+        """
+        IRC | Test user registry lookups
+        """
+
+        nosetools.eq_(len(self.users), 2)
+        nosetools.eq_(self.users.by_nickname("alice{1}"), {self.alice})
+        nosetools.eq_(self.users.by_nickname("BOB"), {self.bob})
+        nosetools.eq_(self.users.by_nickname("carol"), set())
+        nosetools.eq_(self.users.by_mask("~ALICE", "example.com"),
+                      {self.alice})
+
+    def test_rename(self):
+        """
+        IRC | Test user registry nickname changes
+        """
+
+        self.users.rename(self.alice, "Carol")
+
+        nosetools.eq_(self.alice.nickname, "Carol")
+        nosetools.eq_(self.users.by_nickname("alice[1]"), set())
+        nosetools.eq_(self.users.by_nickname("carol"), {self.alice})
+
+    def test_remove(self):
+        """
+        IRC | Test user registry removal
+        """
+
+        self.users.remove(self.bob)
+
+        nosetools.eq_(len(self.users), 1)
+        nosetools.eq_(self.users.by_nickname("bob"), set())
+        nosetools.eq_(self.users.by_mask("~bob", "example.com"), set())
+        nosetools.assert_raises(KeyError, self.users.remove, self.bob)
+
+    def test_reindex(self):
+        """
+        IRC | Test user registry reindexing on case-mapping changes
+        """
+
+        self.utils.case_mapping = "ascii"
+        self.users.reindex()
+
+        nosetools.eq_(self.users.by_nickname("alice{1}"), set())
+        nosetools.eq_(self.users.by_nickname("alice[1]"), {self.alice})
@@ -13,6 +13,7 @@ import yaml
 
 import nose.tools as nosetools
 
+from plugins.auth.matcher import PermissionMatcher
 from plugins.auth.permissions_handler import permissionsHandler
 from system.logging.logger import configure
 from system.plugin import PluginObject
@@ -271,3 +272,110 @@ class TestPlugin(PluginObject):
         """
         PERMS | Test typical permissions handler usage
         """
+
+    def test_matcher(self):
+        """
+        PERMS | Test compiled permissions and cached decisions
+        """
+
+        matcher = PermissionMatcher(["Nose.Test", "nose.wild.*", "nose.?",
+                                     "/g[a-z]+2002/i", "^nose.wild.denied",
+                                     "/broken/z"])
+
+        nosetools.ok_(matcher.matches("nose.test"))
+        nosetools.ok_(matcher.matches("NOSE.WILD.card"))
+        nosetools.ok_(matcher.matches("nose.a"))
+        nosetools.ok_(matcher.matches("gDroid2002"))
+        nosetools.ok_(not matcher.matches("nose.wild.denied"))
+        nosetools.ok_(not matcher.matches("nose.ab"))
+        nosetools.ok_(not matcher.matches("nose.wild"))
+        nosetools.eq_([node for node, error in matcher.invalid],
+                      ["/broken/z"])
+
+        nosetools.ok_(not PermissionMatcher(["nose.*"], wildcard=False)
+                      .matches("nose.test"))
+        nosetools.ok_(PermissionMatcher(["^nose.test", "nose.test"],
+                                        deny_nodes=False)
+                      .matches("nose.test"))
+
+        handler = self.handler
+
+        with self.data:
+            self.data["groups"] = {}
+            self.data["users"] = {}
+
+        handler.invalidate()
+
+        handler.create_group("cached")
+        handler.create_user("cached")
+        handler.set_user_group("cached", "cached")
+
+        nosetools.ok_(not handler.user_has_permission("cached", "nose.test"))
+
+        # Mutators should throw the cached decision away
+        handler.add_group_permission("cached", "nose.*")
+        nosetools.ok_(handler.user_has_permission("cached", "nose.test"))
+
+        handler.remove_group_permission("cached", "nose.*")
+        nosetools.ok_(not handler.user_has_permission("cached", "nose.test"))
+
+        # So should reloading the file
+        handler.add_group_permission("cached", "nose.test")
+        handler.user_has_permission("cached", "nose.test")
+        nosetools.ok_(len(handler.decisions))
+
+        handler.reload()
+        nosetools.eq_(len(handler.decisions), 0)
+
+    def test_inheritance(self):
+        """
+        PERMS | Test flattened group inheritance
+        """
+
+        handler = self.handler
+
+        with self.data:
+            self.data["groups"] = {}
+            self.data["users"] = {}
+
+        handler.invalidate()
+
+        for group in ["base", "middle", "top", "other"]:
+            handler.create_group(group)
+
+        handler.set_group_inheritance("middle", "base")
+        handler.set_group_inheritance("top", "middle")
+        handler.add_group_permission("base", "nose.base")
+        handler.add_group_permission("other", "nose.other")
+
+        tree = handler.inheritance
+
+        nosetools.eq_(tree.chain("top"), ("top", "middle", "base"))
+        nosetools.eq_(tree.dependents("base"), {"base", "middle", "top"})
+        nosetools.ok_(handler.group_has_permission("top", "nose.base"))
+
+        # Only groups inheriting from the changed group are thrown away
+        handler.group_has_permission("other", "nose.other")
+        nosetools.ok_("other" in tree._flat)
+
+        handler.add_group_permission("middle", "nose.middle")
+        nosetools.ok_("other" in tree._flat)
+        nosetools.ok_("top" not in tree._flat)
+
+        nosetools.ok_(handler.group_has_permission("top", "nose.middle"))
+        nosetools.ok_(not handler.group_has_permission("base", "nose.middle"))
+
+        # Loops are broken when the chains are built
+        handler.set_group_inheritance("base", "top")
+
+        nosetools.eq_(tree.chain("base"), ("base", "top", "middle"))
+        nosetools.eq_(len(tree.loops), 3)
+        nosetools.ok_(handler.group_has_permission("base", "nose.middle"))
+
+        # Groups inheriting from a group that doesn't exist yet
+        handler.set_group_inheritance("other", "later")
+        nosetools.ok_(not handler.group_has_permission("other", "nose.later"))
+
+        handler.create_group("later")
+        handler.add_group_permission("later", "nose.later")
+        nosetools.ok_(handler.group_has_permission("other", "nose.later"))
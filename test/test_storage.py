@@ -0,0 +1,418 @@
+__author__ = 'Gareth Coles'
+
+"""
+Tests for the data classes in the storage system.
+"""
+
+# Imports
+
+import json
+import os
+import shutil
+import tempfile
+import yaml
+
+import nose.tools as nosetools
+
+from mock import Mock, patch
+from twisted.internet.task import Clock
+
+from system.storage import serializers
+from system.storage.data import DBAPIData, JSONData, SQLiteData, YamlData, \
+    atomic_write
+from system.storage.formats import YAML
+from system.storage.manager import StorageManager
+
+
+class test_storage:
+    """
+    STORAGE | Test the file-based data classes
+    """
+
+    def setup(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def teardown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_atomic_write(self):
+        """
+        STORAGE | Test atomic file writes
+        """
+
+        filename = os.path.join(self.tmpdir, "test.txt")
+
+        atomic_write(filename, "one")
+        atomic_write(filename, "two")
+
+        nosetools.eq_(open(filename).read(), "two")
+        nosetools.eq_(os.listdir(self.tmpdir), ["test.txt"])
+
+    def test_yaml_compatibility(self):
+        """
+        STORAGE | Test loading YAML dumped by the standard dumper
+        """
+
+        data = {"a": u"unicode", "b": (1, 2), "c": 12345678901234567890}
+        dumped = yaml.dump(data)
+
+        nosetools.ok_("!!python/unicode" in dumped)
+        nosetools.eq_(serializers.yaml_load(dumped), data)
+        nosetools.eq_(serializers.yaml_load(serializers.yaml_dump(data)),
+                      {"a": u"unicode", "b": [1, 2],
+                       "c": 12345678901234567890})
+
+        nosetools.assert_raises(yaml.YAMLError, serializers.yaml_load,
+                                "!!python/object/apply:os.system ['true']")
+
+        # Anything the safe loader couldn't read back is refused, and the
+        # file that's already there is left alone
+        filename = os.path.join(self.tmpdir, "test.yml")
+        data = YamlData(filename)
+
+        with data:
+            data["a"] = 1
+
+        for value in (object(), frozenset([1]), 1j):
+            nosetools.assert_raises(yaml.representer.RepresenterError,
+                                    serializers.yaml_dump, {"b": value})
+
+            def save():
+                with data:
+                    data["b"] = value
+
+            nosetools.assert_raises(yaml.representer.RepresenterError, save)
+            nosetools.ok_(not data._context_guarded)
+            nosetools.eq_(YamlData(filename).data, {"a": 1})
+
+            del data["b"]
+
+    def test_write_behind(self):
+        """
+        STORAGE | Test write-behind saving of data files
+        """
+
+        clock = Clock()
+        filename = os.path.join(self.tmpdir, "test.yml")
+
+        with patch("system.storage.data.reactor", clock):
+            data = YamlData(filename, save_delay=5)
+
+            with data:
+                data["a"] = 1
+
+            with data:
+                data["b"] = 2
+
+            nosetools.ok_(data.dirty)
+            nosetools.eq_(yaml.load(open(filename)), None)
+            nosetools.eq_(len(clock.getDelayedCalls()), 1)
+
+            clock.advance(5)
+
+            nosetools.ok_(not data.dirty)
+            nosetools.eq_(yaml.load(open(filename)), {"a": 1, "b": 2})
+
+            data["c"] = 3
+            data.flush()
+
+            nosetools.eq_(yaml.load(open(filename)), {"a": 1, "b": 2, "c": 3})
+            nosetools.eq_(clock.getDelayedCalls(), [])
+
+            # Reloading writes out pending changes instead of losing them
+            for data in (YamlData(filename, save_delay=5),
+                         JSONData(filename + ".json", save_delay=5),
+                         SQLiteData(filename + ".sqlite", save_delay=5)):
+                data["d"] = 4
+                nosetools.ok_(data.dirty)
+
+                data.reload()
+
+                nosetools.ok_(not data.dirty)
+                nosetools.eq_(data["d"], 4)
+                nosetools.eq_(clock.getDelayedCalls(), [])
+
+            nosetools.eq_(yaml.load(open(filename))["d"], 4)
+
+            # Someone edited the file while we had unsaved changes - their
+            # edit wins, rather than being silently overwritten
+            for data, dump in ((YamlData(filename, save_delay=5), yaml.dump),
+                               (JSONData(filename + ".json", save_delay=5),
+                                json.dumps)):
+                data.logger = Mock()
+                data["e"] = 5
+
+                atomic_write(data.filename, dump({"edited": True}))
+                data.reload()
+
+                nosetools.ok_(not data.dirty)
+                nosetools.eq_(data.data, {"edited": True})
+                nosetools.eq_(data.logger.warn.call_count, 1)
+                nosetools.eq_(clock.getDelayedCalls(), [])
+
+    def test_write_through(self):
+        """
+        STORAGE | Test that data files save straight away by default
+        """
+
+        filename = os.path.join(self.tmpdir, "test.json")
+        data = JSONData(filename)
+
+        with data:
+            data["a"] = 1
+
+        nosetools.ok_(not data.dirty)
+        nosetools.eq_(json.load(open(filename)), {"a": 1})
+
+    def test_sqlite(self):
+        """
+        STORAGE | Test the SQLite key/value data handler
+        """
+
+        filename = os.path.join(self.tmpdir, "test.sqlite")
+        data = SQLiteData(filename)
+
+        with data:
+            data["users"] = {"gdude": {"password": "hunter2"}}
+            data[1] = ["a", "b"]
+
+        with data:
+            data["users"]["rakiru"] = {"password": "*******"}
+            del data[1]
+
+        nosetools.assert_raises(KeyError, data.__getitem__, 1)
+
+        data = SQLiteData(filename)
+
+        nosetools.eq_(data.keys(), ["users"])
+        nosetools.eq_(len(data), 1)
+        nosetools.ok_("users" in data)
+        nosetools.ok_(1 not in data)
+        nosetools.eq_(sorted(data["users"].keys()), ["gdude", "rakiru"])
+        nosetools.eq_(data.get("missing", 42), 42)
+
+        # Journal options are ignored, and values come back as JSON would
+        # give them to us
+        data = SQLiteData(filename, journal=True, journal_size=1024)
+
+        with data:
+            data[2] = {1: ("a", "b")}
+
+        data = SQLiteData(filename)
+
+        nosetools.eq_(data[2], {"1": ["a", "b"]})
+
+    def test_sqlite_import(self):
+        """
+        STORAGE | Test importing data into the SQLite data handler
+        """
+
+        source = YamlData(os.path.join(self.tmpdir, "test.yml"))
+
+        with source:
+            source["a"] = {"b": [1, 2, 3]}
+            source["c"] = "d"
+
+        data = SQLiteData(os.path.join(self.tmpdir, "test.sqlite"))
+        data.import_data(source)
+
+        nosetools.eq_(dict(data.iteritems()), {"a": {"b": [1, 2, 3]},
+                                               "c": "d"})
+
+    def test_dbapi(self):
+        """
+        STORAGE | Test DBAPI pool options, pragmas and statement cache
+        """
+
+        filename = os.path.join(self.tmpdir, "test.sqlite")
+        data = DBAPIData("data/sqlite3:%s" % filename, filename,
+                         check_same_thread=False, cp_min=1, cp_max=2)
+
+        stats = data.stats()
+
+        nosetools.eq_((stats["min"], stats["max"]), (1, 2))
+        nosetools.eq_(stats["queued"], 0)
+
+        connection = data.pool.connect()
+
+        try:
+            cursor = connection.cursor()
+
+            cursor.execute("PRAGMA journal_mode")
+            nosetools.eq_(cursor.fetchone()[0], "wal")
+
+            cursor.execute("PRAGMA synchronous")
+            nosetools.eq_(cursor.fetchone()[0], 1)  # NORMAL
+
+            nosetools.eq_(data.stats()["connections"], 1)
+
+            sql = "SELECT * FROM {TABLE} WHERE {TABLE}.x = ?"
+            first = data.statement(sql, TABLE="things")
+
+            nosetools.eq_(first, "SELECT * FROM things WHERE things.x = ?")
+            nosetools.ok_(data.statement(sql, TABLE="things") is first)
+            nosetools.eq_(data.statement(sql, TABLE="other"),
+                          "SELECT * FROM other WHERE other.x = ?")
+        finally:
+            data.pool.disconnect(connection)
+
+    def test_journal(self):
+        """
+        STORAGE | Test journaled saving of data files
+        """
+
+        for cls, name in [(YamlData, "test.yml"), (JSONData, "test.json")]:
+            filename = os.path.join(self.tmpdir, name)
+            data = cls(filename, journal=True, journal_size=200)
+
+            with data:
+                data["a"] = {"b": 1}
+                data["c"] = "d"
+
+            with data:
+                data["a"]["b"] = 2
+                del data["c"]
+
+            nosetools.ok_(os.path.exists(data.journal_filename))
+            # The snapshot is still empty
+            nosetools.ok_(open(filename).read().strip() in ("", "{}"))
+
+            # Simulate a crash partway through writing a record
+            with open(data.journal_filename, "a") as fh:
+                fh.write(data._dump_record("set", "x", "y")[:-4])
+
+            data = cls(filename, journal=True, journal_size=200)
+            nosetools.eq_(data.data, {"a": {"b": 2}})
+
+            # The journal's folded back into the file when it's loaded
+            nosetools.ok_(not os.path.exists(data.journal_filename))
+            nosetools.eq_(cls(filename).data, {"a": {"b": 2}})
+
+            with data:
+                data["c"] = "d"
+
+            nosetools.ok_(os.path.exists(data.journal_filename))
+
+            with data:
+                data["e"] = "f" * 200  # Pushes the journal over its size
+
+            nosetools.ok_(not os.path.exists(data.journal_filename))
+            nosetools.eq_(cls(filename).data, {"a": {"b": 2}, "c": "d",
+                                               "e": "f" * 200})
+
+            # A journal left behind is still replayed with journaling off
+            with data:
+                data["c"] = "g"
+
+            nosetools.ok_(os.path.exists(data.journal_filename))
+            nosetools.eq_(cls(filename)["c"], "g")
+            nosetools.ok_(not os.path.exists(data.journal_filename))
+
+    def test_journal_records(self):
+        """
+        STORAGE | Test journal records only hold what changed
+        """
+
+        for cls, name in [(YamlData, "test.yml"), (JSONData, "test.json")]:
+            filename = os.path.join(self.tmpdir, name)
+            data = cls(filename, journal=True)
+
+            with data:
+                data["irc"] = dict(
+                    ("#channel-%s" % i, {"status": True, "last": "x" * 50})
+                    for i in xrange(500)
+                )
+                data["log"] = ["a", "b"]
+
+            # Loading folds the journal back into the file
+            data = cls(filename, journal=True)
+
+            size = os.path.getsize(filename)
+            nosetools.ok_(not os.path.exists(data.journal_filename))
+
+            # A small change to a big key makes a small record
+            with data:
+                data["irc"]["#channel-1"]["last"] = "y"
+
+            journal = os.path.getsize(data.journal_filename)
+            nosetools.ok_(journal < 100)
+            nosetools.eq_(os.path.getsize(filename), size)
+
+            # Twice as many changes make records about twice the size
+            with data:
+                data["irc"]["#channel-2"]["last"] = "y"
+                data["irc"]["#channel-3"]["last"] = "y"
+
+            written = os.path.getsize(data.journal_filename) - journal
+            nosetools.ok_(written < journal * 3)
+
+            # Adding to a list only writes the new items, and untouched or
+            # unchanged keys don't write anything
+            journal = os.path.getsize(data.journal_filename)
+
+            with data:
+                data["log"].append("c")
+                data["irc"]["#channel-4"]["status"] = True
+                del data["irc"]["#channel-5"]
+
+            written = os.path.getsize(data.journal_filename) - journal
+            nosetools.ok_(written < 100)
+
+            journal = os.path.getsize(data.journal_filename)
+
+            with data:
+                data["irc"].keys()
+
+            nosetools.eq_(os.path.getsize(data.journal_filename), journal)
+
+            expected = cls(filename, journal=False).data
+
+            nosetools.eq_(expected["log"], ["a", "b", "c"])
+            nosetools.eq_(expected["irc"]["#channel-1"]["last"], "y")
+            nosetools.eq_(expected["irc"]["#channel-3"]["last"], "y")
+            nosetools.ok_("#channel-5" not in expected["irc"])
+            nosetools.eq_(len(expected["irc"]), 499)
+
+    def test_watcher(self):
+        """
+        STORAGE | Test reloading files when they're changed on disk
+        """
+
+        clock = Clock()
+        storage = StorageManager()
+        data_path = storage.data_path
+        storage.data_path = self.tmpdir
+
+        try:
+            with patch("system.storage.manager.reactor", clock), \
+                    patch("system.storage.manager.inotify", None):
+                data = storage.get_file(self, "data", YAML, "test.yml")
+                reloads = []
+                data.callbacks.append(lambda: reloads.append(True))
+
+                storage.start_watching(5, 1)
+
+                with data:
+                    data["a"] = 1
+
+                clock.advance(5)
+                nosetools.eq_(reloads, [])  # We saved it, so no reload
+
+                with open(data.filename, "w") as fh:
+                    fh.write("a: 2\nb: 3\n")
+
+                clock.advance(5)
+                nosetools.eq_(reloads, [])  # Not finished changing yet
+
+                clock.advance(5)
+                nosetools.eq_(reloads, [True])
+                nosetools.eq_(data.data, {"a": 2, "b": 3})
+
+                clock.advance(5)
+                nosetools.eq_(reloads, [True])
+
+                storage.stop_watching()
+                nosetools.eq_(clock.getDelayedCalls(), [])
+        finally:
+            storage.release_file(self, "data", "test.yml")
+            storage.data_path = data_path
@@ -0,0 +1,266 @@
+__author__ = 'Gareth Coles'
+
+"""
+Tests for the URLs plugin's helpers.
+"""
+
+# Imports
+
+import time
+
+import nose.tools as nosetools
+
+from collections import OrderedDict
+
+from mock import Mock, patch
+from twisted.internet.defer import Deferred, fail, succeed
+from twisted.internet.endpoints import TCP6ClientEndpoint
+from twisted.names.dns import RRHeader, Record_AAAA, Record_CNAME, \
+    AAAA, CNAME
+from twisted.web.client import URI
+
+from plugins.urls.cache import TitleCache, normalize_url
+from plugins.urls.catcher import Catcher
+from plugins.urls.fetcher import PinnedEndpointFactory, TitleFetcher
+
+
+class FakeCursor(object):
+    """
+    Records executed statements, in place of a DBAPI cursor
+    """
+
+    def __init__(self):
+        self.executed = []
+
+    def execute(self, sql, args=None):
+        self.executed.append((sql, [args]))
+
+    def executemany(self, sql, args):
+        self.executed.append((sql, list(args)))
+
+    def fetchone(self):
+        return None
+
+
+class FakeDB(object):
+    """
+    Runs interactions immediately with a FakeCursor
+    """
+
+    def __init__(self):
+        self.cursor = FakeCursor()
+        self.interactions = 0
+
+    def runInteraction(self, func, *args, **kwargs):
+        self.interactions += 1
+        return succeed(func(self.cursor, *args, **kwargs))
+
+
+class test_urls:
+    """
+    URLS | Test the helpers used by the URLs plugin
+    """
+
+    # Cache
+
+    def test_normalize_url(self):
+        """
+        URLS | Test URL normalization for the title cache
+        """
+
+        nosetools.eq_(normalize_url("HTTP://Example.COM:80#top"),
+                      "http://example.com/")
+        nosetools.eq_(normalize_url("https://example.com:443/a?b=c"),
+                      "https://example.com/a?b=c")
+        nosetools.eq_(normalize_url("http://example.com:8080/Path"),
+                      "http://example.com:8080/Path")
+        nosetools.eq_(normalize_url(" http://example.com:8o/ "),
+                      "http://example.com:8o/")
+
+    def test_cache_lru(self):
+        """
+        URLS | Test title cache LRU eviction
+        """
+
+        cache = TitleCache(size=2)
+
+        cache.set("a", ("A", "a.com", "http://a.com/"))
+        cache.set("b", ("B", "b.com", "http://b.com/"))
+
+        cache.get("a")  # Make "b" the least recently used
+        cache.set("c", ("C", "c.com", "http://c.com/"))
+
+        nosetools.eq_(len(cache), 2)
+        nosetools.eq_(cache.get("b"), None)
+        nosetools.eq_(cache.get("a"), ("A", "a.com", "http://a.com/"))
+
+    def test_cache_load_lru(self):
+        """
+        URLS | Test titles loaded from the database respect the LRU size
+        """
+
+        class TitlesDB(object):
+            def runQuery(self, sql, args):
+                url = args[0]
+                return succeed([(url, "example.com", url, time.time() + 60)])
+
+        cache = TitleCache(size=2, db=TitlesDB())
+
+        for url in ["http://a.com/", "http://b.com/", "http://c.com/"]:
+            cache.fetch(url, lambda u: succeed(None))
+
+        nosetools.eq_(len(cache), 2)
+        nosetools.eq_(list(cache.entries), [("http://b.com/",),
+                                            ("http://c.com/",)])
+
+    def test_cache_ttl(self):
+        """
+        URLS | Test title cache expiry and negative caching
+        """
+
+        cache = TitleCache(ttl=60, negative_ttl=-1)
+
+        cache.set("good", ("Good", "good.com", "http://good.com/"))
+        cache.set("bad", (None, None, None))
+
+        nosetools.eq_(cache.get("good"), ("Good", "good.com",
+                                          "http://good.com/"))
+        nosetools.eq_(cache.get("bad"), None)
+
+    def test_cache_fetch(self):
+        """
+        URLS | Test title cache fetching and request coalescing
+        """
+
+        cache = TitleCache()
+        waiting = Deferred()
+        calls = []
+        results = []
+
+        def fetch(url, use_handler):
+            calls.append(url)
+            return waiting
+
+        cache.fetch("http://example.com", fetch, True).addCallback(
+            results.append
+        )
+        cache.fetch("HTTP://EXAMPLE.COM/", fetch, True).addCallback(
+            results.append
+        )
+
+        nosetools.eq_(len(calls), 1)
+        nosetools.eq_(results, [])
+
+        waiting.callback(("Title", "example.com", "http://example.com/"))
+
+        nosetools.eq_(len(results), 2)
+
+        cache.fetch("http://example.com/", lambda u, h: succeed(None),
+                    True).addCallback(results.append)
+
+        nosetools.eq_(len(calls), 1)
+        nosetools.eq_(results[2], ("Title", "example.com",
+                                   "http://example.com/"))
+
+        stats = cache.stats()
+
+        nosetools.eq_(stats["hits"], 1)
+        nosetools.eq_(stats["misses"], 1)
+        nosetools.eq_(stats["coalesced"], 1)
+        nosetools.eq_(stats["in_flight"], 0)
+
+    # Fetcher
+
+    @patch("plugins.urls.fetcher.dns")
+    def test_fetcher_resolve(self, dns):
+        """
+        URLS | Test resolving hosts for the fetcher, falling back to IPv6
+        """
+
+        cname = RRHeader("example.com", CNAME,
+                         payload=Record_CNAME("v6.example.com"))
+        aaaa = RRHeader("v6.example.com", AAAA, payload=Record_AAAA("::1"))
+
+        dns.lookupAddress.return_value = succeed(([cname], [], []))
+        dns.lookupIPV6Address.return_value = succeed(([cname, aaaa], [], []))
+
+        fetcher = TitleFetcher()
+        results = []
+
+        fetcher.resolve("example.com").addBoth(results.append)
+        fetcher.resolve("127.0.0.1").addBoth(results.append)
+
+        nosetools.eq_(results, ["::1", "127.0.0.1"])
+        dns.lookupIPV6Address.assert_called_once_with("example.com")
+
+    def test_fetcher_pinned(self):
+        """
+        URLS | Test the fetcher connects to the address it was given
+        """
+
+        endpoints = PinnedEndpointFactory(10)
+        uri = URI.fromBytes("http://example.com/")
+
+        nosetools.assert_raises(ValueError, endpoints.endpointForURI, uri)
+
+        endpoints.address = "::1"
+        endpoint = endpoints.endpointForURI(uri)
+
+        nosetools.ok_(isinstance(endpoint, TCP6ClientEndpoint))
+        nosetools.eq_((endpoint._host, endpoint._port), ("::1", 80))
+
+    # Catcher
+
+    def test_catcher_batching(self):
+        """
+        URLS | Test batched URL catcher writes
+        """
+
+        catcher = Catcher.__new__(Catcher)
+        catcher._config = {"catcher": {"use": True, "batch_size": 3,
+                                       "seen_size": 3,
+                                       "ignored": ["irc:#secret"]}}
+        catcher.sql = {"insert_batch": "BATCH"}
+        catcher.db = FakeDB()
+        catcher.buffer = []
+        catcher.seen = OrderedDict()
+
+        catcher.insert_url("http://a.com", "user", "#chan", "irc")
+        catcher.insert_url("http://a.com", "user", "#chan", "irc")
+        catcher.insert_url("http://b.com", "user", "#secret", "irc")
+        catcher.insert_url("http://b.com", "user", "#chan", "irc")
+
+        nosetools.eq_(len(catcher.buffer), 2)
+        nosetools.eq_(catcher.db.interactions, 0)
+
+        catcher.insert_url("http://c.com", "user", "#chan", "irc")
+
+        nosetools.eq_(catcher.buffer, [])
+        nosetools.eq_(catcher.db.interactions, 1)
+
+        sql, rows = catcher.db.cursor.executed[0]
+
+        nosetools.eq_(sql, "BATCH")
+        nosetools.eq_([row[0] for row in rows],
+                      ["http://a.com", "http://b.com", "http://c.com"])
+        nosetools.eq_(rows[0][-1], "http://a.com")
+
+        catcher.insert_url("http://d.com", "user", "#chan", "irc")
+
+        nosetools.eq_(list(catcher.seen),
+                      ["http://b.com", "http://c.com", "http://d.com"])
+        nosetools.eq_(catcher.flush().called, True)
+        nosetools.eq_(catcher.flush(), None)
+
+        # URLs from a batch that failed to write aren't suppressed
+        catcher.logger = Mock()
+        catcher.db.runInteraction = lambda *args: fail(Exception("Down"))
+
+        catcher.insert_url("http://e.com", "user", "#chan", "irc")
+        catcher.flush()
+
+        nosetools.eq_(list(catcher.seen), ["http://c.com", "http://d.com"])
+        nosetools.eq_(catcher.logger.error.call_count, 1)
+
+        catcher.insert_url("http://e.com", "user", "#chan", "irc")
+        nosetools.eq_(len(catcher.buffer), 1)
@@ -106,6 +106,55 @@ class test_utils:
         nosetools.eq_(result_newlines_three, "Some body that I "
                                              "\nused to know\n")
 
+    def test_html_title(self):
+        """
+        UTILS | Test incremental HTML title extraction
+        """
+
+        page = ("<html><head><meta charset='iso-8859-1'>"
+                "<title>Caf\xe9  &amp;\n &#8220;Bar&#x201D;</title>"
+                "</head><body>Ignored</body></html>")
+
+        extractor = html.HTMLTitleExtractor()
+
+        for i in xrange(0, len(page), 7):
+            if extractor.feed(page[i:i + 7]):
+                break
+
+        nosetools.assert_true(extractor.done)
+        nosetools.assert_true(i < len(page) - 7)  # Stopped early
+        nosetools.eq_(extractor.get_title(),
+                      u"Caf\xe9 & \u201cBar\u201d")
+
+        # The header charset wins, and split characters still decode
+        extractor = html.HTMLTitleExtractor("utf-8")
+        extractor.feed("<title>Caf\xc3")
+        extractor.feed("\xa9</title>")
+
+        nosetools.eq_(extractor.get_title(), u"Caf\xe9")
+
+        # Entities in non-ASCII attributes don't break parsing
+        extractor = html.HTMLTitleExtractor()
+        extractor.feed('<meta content="caf\xc3\xa9 &amp; bar">'
+                       '<meta http-equiv="Content-Type" '
+                       'content="text/html; charset=utf-8&#x20;">'
+                       '<title>Hi</title>')
+
+        nosetools.assert_true(extractor.done)
+        nosetools.eq_(extractor.meta_charset, "utf-8")
+        nosetools.eq_(extractor.get_title(), u"Hi")
+
+        extractor = html.HTMLTitleExtractor(max_length=5)
+        extractor.feed("<title>Far too long</title>")
+
+        nosetools.eq_(extractor.get_title(), u"Far too long"[:5])
+
+        extractor = html.HTMLTitleExtractor()
+        extractor.feed("<html><body>No title here</body></html>")
+
+        nosetools.assert_false(extractor.done)
+        nosetools.eq_(extractor.get_title(), None)
+
     # IRC
 
     def test_irc_split_hostmask(self):
@@ -127,6 +176,23 @@ class test_utils:
 
         irc.split_hostmask("aaa!bbbccc")
 
+    def test_irc_lowercase_nick_chan(self):
+        """
+        UTILS | Test IRC case-mapping
+        """
+
+        utils = irc.IRCUtils(None)
+
+        nosetools.eq_(utils.lowercase_nick_chan("Nick[A]\\^"), "nick{a}|~")
+        nosetools.eq_(utils.lowercase_nick_chan(u"N\xc9ICK^"), u"n\xe9ick~")
+        nosetools.ok_(utils.compare_nicknames("#Chan[1]", "#chan{1}"))
+
+        utils.case_mapping = "strict-rfc1459"
+        nosetools.eq_(utils.lowercase_nick_chan("Nick[A]\\^"), "nick{a}|^")
+
+        utils.case_mapping = "ascii"
+        nosetools.eq_(utils.lowercase_nick_chan("Nick[A]\\^"), "nick[a]\\^")
+
     # Misc
 
     def test_misc_chunker(self):
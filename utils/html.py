@@ -8,8 +8,13 @@ Mumble.
 
 __author__ = 'Gareth Coles'
 
-from HTMLParser import HTMLParser
+from HTMLParser import HTMLParser, HTMLParseError
+import codecs
 import htmlentitydefs
+import re
+
+#: For pulling the charset out of a Content-Type header or meta tag
+CHARSET_REGEX = re.compile(r"charset\s*=\s*[\"']?([\w.:-]+)", re.I)
 
 
 class HTMLTextExtractor(HTMLParser):
@@ -56,6 +61,173 @@ class HTMLTextExtractor(HTMLParser):
         return u''.join(self.result)
 
 
+class HTMLTitleExtractor(HTMLParser):
+    """
+    Class for incrementally extracting the title from a HTML page.
+
+    Feed it chunks of the page as they arrive - once `done` is True, the
+    title has been found and you can stop reading. The title is decoded
+    using the charset from the Content-Type header if you have one, then
+    the charset from a meta tag, then UTF-8, falling back to Latin-1 if that
+    doesn't work out.
+
+    Only the title is kept, and it's limited to `max_length` bytes, so
+    memory use depends on how much you feed it rather than on the page.
+
+    For example::
+
+        extractor = HTMLTitleExtractor("utf-8")
+
+        for chunk in chunks:
+            if extractor.feed(chunk):
+                break
+
+        title = extractor.get_title()
+    """
+
+    def __init__(self, charset=None, max_length=4096):
+        HTMLParser.__init__(self)
+
+        self.header_charset = self._check_charset(charset)
+        self.meta_charset = None
+        self.max_length = max_length
+
+        self.done = False
+        self.in_title = False
+        self.length = 0
+        self.parts = []
+
+    @staticmethod
+    def _check_charset(charset):
+        if not charset:
+            return None
+
+        try:
+            return codecs.lookup(charset).name
+        except LookupError:
+            return None
+
+    def feed(self, data):
+        """
+        Feed a chunk of the page to the parser.
+
+        :param data: The chunk to parse
+        :type data: str
+
+        :return: Whether we're done, and you can stop feeding chunks
+        :rtype: bool
+        """
+
+        if self.done:
+            return True
+
+        try:
+            HTMLParser.feed(self, data)
+        except HTMLParseError:
+            # Broken HTML; go with what we've got
+            self.done = True
+
+        return self.done
+
+    def unescape(self, s):
+        # HTMLParser unescapes attribute values by mixing unicode into them,
+        # which fails on non-ASCII bytes. We only look at attributes to find
+        # charsets, so decoding them as Latin-1 (which can't fail) is fine.
+        if isinstance(s, str):
+            s = s.decode("latin-1")
+
+        return HTMLParser.unescape(self, s)
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "title" and not self.done:
+            self.in_title = True
+        elif tag == "meta" and self.meta_charset is None:
+            attrs = dict(attrs)
+
+            if attrs.get("charset"):
+                self.meta_charset = self._check_charset(attrs["charset"])
+            elif (attrs.get("http-equiv") or "").lower() == "content-type":
+                match = CHARSET_REGEX.search(attrs.get("content") or "")
+
+                if match:
+                    self.meta_charset = self._check_charset(match.group(1))
+
+    def handle_endtag(self, tag):
+        if tag == "title" and self.in_title:
+            self.in_title = False
+            self.done = True
+
+    def _append(self, part):
+        if not self.in_title:
+            return
+
+        part = part[:self.max_length - self.length]
+
+        self.parts.append(part)
+        self.length += len(part)
+
+        if self.length >= self.max_length:
+            self.in_title = False
+            self.done = True
+
+    def handle_data(self, d):
+        self._append(d)
+
+    def handle_charref(self, number):
+        try:
+            if number[0] in (u'x', u'X'):
+                codepoint = int(number[1:], 16)
+            else:
+                codepoint = int(number)
+            self._append(unichr(codepoint))
+        except ValueError:
+            self._append(u"&#%s;" % number)
+
+    def handle_entityref(self, name):
+        if name in htmlentitydefs.name2codepoint:
+            self._append(unichr(htmlentitydefs.name2codepoint[name]))
+        else:
+            self._append(u"&%s;" % name)
+
+    def _decode(self, part):
+        for charset in (self.header_charset, self.meta_charset, "utf-8"):
+            if charset is not None:
+                try:
+                    return part.decode(charset)
+                except UnicodeDecodeError:
+                    pass
+
+        return part.decode("latin-1")
+
+    def get_title(self):
+        """
+        Get the title we've found, with its whitespace collapsed.
+
+        :return: The title, or None if we didn't find one
+        :rtype: unicode, None
+        """
+
+        decoded = []
+        raw = []
+
+        # Characters may be split across chunks, so decode runs of bytes
+        for part in self.parts:
+            if isinstance(part, unicode):
+                if raw:
+                    decoded.append(self._decode("".join(raw)))
+                    raw = []
+                decoded.append(part)
+            else:
+                raw.append(part)
+
+        if raw:
+            decoded.append(self._decode("".join(raw)))
+
+        title = u" ".join(u"".join(decoded).split())
+
+        return title or None
+
+
 def html_to_text(html, newlines=False):
     """
     Given a HTML snippet, strip out all the HTML and leave just the text.
@@ -7,6 +7,7 @@ that make direct use of it.
 """
 
 import re
+import string
 from system.protocols.irc import constants
 
 from system.translations import Translations
@@ -113,10 +114,33 @@ class IRCUtils(object):
                      "rfc1459": RFC1459,
                      "strict-rfc1459": STRICT_RFC1459}
 
+    # Extra characters each case-mapping lowercases, on top of A-Z
+    _CASE_EXTRAS = {ASCII: ("", ""),
+                    RFC1459: ("[]\\^", "{}|~"),
+                    STRICT_RFC1459: ("[]\\", "{}|")}
+
+    # Translation tables for each case-mapping - one for byte strings, which
+    # also lowercases A-Z, and one for unicode, which is used after lower()
+    CASE_TABLES = dict(
+        (mapping, string.maketrans(string.ascii_uppercase + upper,
+                                   string.ascii_lowercase + lower))
+        for mapping, (upper, lower) in _CASE_EXTRAS.iteritems()
+    )
+    UNICODE_CASE_TABLES = dict(
+        (mapping, dict((ord(u), unicode(l)) for u, l in zip(upper, lower)))
+        for mapping, (upper, lower) in _CASE_EXTRAS.iteritems()
+    )
+
+    #: How many lowercased nicks/channels to remember
+    casefold_cache_size = 10000
+
     _case_mapping = RFC1459
+    _case_table = CASE_TABLES[RFC1459]
+    _unicode_case_table = UNICODE_CASE_TABLES[RFC1459]
 
     def __init__(self, log, case_mapping="rfc1459", chan_types="&#+!"):
         self.log = log
+        self._casefold_cache = {}
         self.case_mapping = case_mapping
         self.chan_types = chan_types
 
@@ -143,21 +167,38 @@ class IRCUtils(object):
             self._case_mapping = self.CASE_MAPPINGS[val.lower()]
         except Exception:
             self.log.warning(_("Invalid case mapping: %s") % val)
+        else:
+            self._case_table = self.CASE_TABLES[self._case_mapping]
+            self._unicode_case_table = self.UNICODE_CASE_TABLES[
+                self._case_mapping
+            ]
+            self._casefold_cache = {}
 
     def lowercase_nick_chan(self, nick):
         """
         Take a nick or channel, make it lowercase.
 
+        Results are cached, and the cache is simply emptied when it gets
+        too big - nicks and channels come and go, but not that quickly.
+
         :param nick: Nick/channel to make lowercase
         :return: Lowercase nick/channel
         """
-        nick = nick.lower()
-        if ((self.case_mapping == self.RFC1459 or
-             self.case_mapping == self.STRICT_RFC1459)):
-            nick = nick.replace('[', '{').replace(']', '}').replace('\\', '|')
-            if self.case_mapping == self.RFC1459:
-                nick.replace('^', '~')
-        return nick
+        try:
+            return self._casefold_cache[nick]
+        except KeyError:
+            pass
+
+        if isinstance(nick, unicode):
+            lowered = nick.lower().translate(self._unicode_case_table)
+        else:
+            lowered = nick.translate(self._case_table)
+
+        if len(self._casefold_cache) >= self.casefold_cache_size:
+            self._casefold_cache.clear()
+
+        self._casefold_cache[nick] = lowered
+        return lowered
 
     def compare_nicknames(self, nickone, nicktwo):
         """
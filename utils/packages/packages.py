@@ -54,7 +54,8 @@ class Packages(object):
             self.data = yaml.load(data)
             self.packages = sorted(self.data.keys())
 
-        self.config = self.storage.get_file(self, "data", YAML, "packages.yml")
+        self.config = self.storage.get_file(self, "data", YAML, "packages.yml",
+                                            journal=True)
 
         with self.config:
             if "installed" not in self.config: